@@ -0,0 +1,178 @@
+# server/app/aiodb.py
+"""
+Async data access on top of db.py.
+
+vertica_python is a blocking driver, so the async API runs each blocking
+call on the DB executor (executor.py) with one of its pooled connections:
+the priority class and statement timeout of the db_route being served
+apply, the request's cancellation scope travels with the call, and the
+event loop only awaits the result. Independent queries in one request can
+then run side by side, each on its own worker:
+
+    totals, rows = await asyncio.gather(
+        aiodb.run(cube.totals, start, end),
+        aiodb.fetchall(query, params),
+    )
+
+Composite routes, whose panels must all succeed, use gather() instead:
+the first failure cancels the other panels rather than letting them run
+on for a response that will not be sent.
+
+Outside a db_route (the preset scheduler computing presets on its own
+thread) there is no class to queue under and calls run inline.
+
+Responses too large to build in memory (exports) use stream(): a blocking
+generator runs on one worker and hands its chunks to the event loop
+through a small bounded buffer.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Sequence
+
+from backend.db import fetch_columns as _fetch_columns, get_conn
+from backend.cancellation import current_scope
+from backend.executor import current_route, submit_scoped
+from backend.profiling import awaiting
+
+
+async def run(fn: Callable, *args, **kwargs) -> Any:
+    """fn(*args, **kwargs) on the DB executor, for blocking work (queries, cube fills)."""
+    route = current_route()
+    if route is None:
+        return fn(*args, **kwargs)
+    priority, timeout = route
+    with awaiting():
+        return await asyncio.wrap_future(submit_scoped(fn, *args, priority=priority, timeout=timeout, **kwargs))
+
+
+async def gather(*aws: Awaitable) -> List[Any]:
+    """Results of `aws`, run concurrently; the first failure cancels the rest and is raised as is."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # gather() leaves the others running after a failure: stop them, and
+        # let them unwind before the error reaches the route
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _fetchall(query: str, params: Optional[Sequence]) -> List[tuple]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(query, list(params or []))
+        return cur.fetchall()
+
+
+async def fetchall(query: str, params: Optional[Sequence] = None) -> List[tuple]:
+    """Every row of `query`, fetched on the DB executor."""
+    return await run(_fetchall, query, params)
+
+
+def _columns(query: str, params: Optional[Sequence]) -> List[list]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(query, list(params or []))
+        return _fetch_columns(cur)
+
+
+async def fetch_columns(query: str, params: Optional[Sequence] = None) -> List[list]:
+    """`query`'s result set as one list per column (see db.fetch_columns)."""
+    return await run(_columns, query, params)
+
+
+def _produce(gen_fn: Callable[..., Iterator], args, kwargs, loop: asyncio.AbstractEventLoop,
+             buffer: asyncio.Queue, stop: threading.Event):
+    # runs on a worker: every item goes into the buffer, blocking while it is full
+    scope = current_scope()
+
+    def gone() -> bool:
+        # the consumer closed the stream, or the client disconnected before it started
+        return stop.is_set() or (scope is not None and scope.cancelled)
+
+    def put(item) -> bool:
+        fut = asyncio.run_coroutine_threadsafe(buffer.put(item), loop)
+        while True:
+            try:
+                fut.result(timeout=1)
+                return True
+            except FutureTimeout:
+                if gone():
+                    fut.cancel()
+                    return False
+
+    try:
+        gen = gen_fn(*args, **kwargs)
+        try:
+            for item in gen:
+                if gone() or not put((item, None)):
+                    return
+        finally:
+            gen.close()  # releases the generator's connection
+    except BaseException as e:
+        put((None, e))
+        return
+    put((None, None))
+
+
+def stream(gen_fn: Callable[..., Iterator], *args, buffered: int = 2,
+           on_done: Optional[Callable[[], None]] = None, **kwargs) -> AsyncIterator:
+    """
+    Iterate gen_fn(*args, **kwargs), a blocking generator, on one DB
+    executor worker. At most `buffered` items wait for the consumer, so the
+    worker pauses (and memory stays bounded) while the client reads slowly.
+
+    The priority class, statement timeout and cancellation scope are taken
+    when stream() is called, inside the db_route, not when the response
+    body is iterated after the route has returned. The worker starts on the
+    first iteration; closing the iterator early stops it. on_done() is
+    called once the worker is finished with the generator (or the job was
+    dropped before it ran).
+    """
+    route = current_route()
+    ctx = contextvars.copy_context()
+
+    async def items():
+        loop = asyncio.get_running_loop()
+        buffer: asyncio.Queue = asyncio.Queue(maxsize=buffered)
+        stop = threading.Event()
+        try:
+            if route is None:
+                future = loop.run_in_executor(None, ctx.run, _produce, gen_fn, args, kwargs, loop, buffer, stop)
+            else:
+                priority, timeout = route
+                future = ctx.run(submit_scoped, _produce, gen_fn, args, kwargs, loop, buffer, stop,
+                                 priority=priority, timeout=timeout)
+        except BaseException:  # shed by admission control
+            if on_done is not None:
+                on_done()
+            raise
+
+        def rejected(f):
+            if on_done is not None:
+                on_done()
+            # _produce reports its own errors; this is the job failing before it
+            # ran (the client left while it was queued)
+            if not f.cancelled() and f.exception() is not None:
+                loop.call_soon_threadsafe(buffer.put_nowait, (None, f.exception()))
+
+        future.add_done_callback(rejected)
+        try:
+            while True:
+                item, error = await buffer.get()
+                if error is not None:
+                    raise error
+                if item is None:
+                    return
+                yield item
+        finally:
+            stop.set()
+            while not buffer.empty():  # unblock a pending put
+                buffer.get_nowait()
+            future.cancel()  # still queued: never runs
+
+    return items()
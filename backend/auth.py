@@ -0,0 +1,23 @@
+# server/app/auth.py
+import hmac
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from backend.config import settings
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    """True if `token` is the configured admin token (never, with none configured)."""
+    return bool(settings.ADMIN_TOKEN) and hmac.compare_digest(token or "", settings.ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Dependency for admin/ETL endpoints: the X-Admin-Token header must match
+    settings.ADMIN_TOKEN. With no token configured these endpoints are off.
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(403, "admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not admin_token_valid(x_admin_token):
+        raise HTTPException(403, "invalid admin token")
@@ -0,0 +1,111 @@
+# server/app/cancellation.py
+"""
+Statement timeouts and cancellation of abandoned requests.
+
+Every HTTP request runs inside a RequestScope (a context variable set by
+CancelOnDisconnect). Connections taken with db.get_conn() while a scope is
+active are attached to it. Independently, `statement_timeout` (set per
+call by executor.db_route) becomes the connection's session RUNTIMECAP. When the client goes away (react-query abandons a
+request on every filter change), the middleware sees http.disconnect and
+cancels the scope: in-flight Vertica statements are cancelled, their
+connections are dropped instead of returned, and any later get_conn() in
+the same request raises RequestCancelled before touching the database.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """The client disconnected; the rest of the request's work is abandoned."""
+
+
+class RequestScope:
+    def __init__(self):
+        self.cancelled = False
+        self._conns: Set = set()
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled("client disconnected")
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            conns = list(self._conns)
+        for conn in conns:
+            try:
+                conn.cancel()
+            except Exception:
+                logger.debug("Could not cancel statement", exc_info=True)
+        if conns:
+            logger.info(f"Client disconnected; cancelled {len(conns)} running statement(s)")
+
+    @contextmanager
+    def attach(self, conn):
+        """Cancel `conn`'s statement if the scope is cancelled while it is in use."""
+        with self._lock:
+            self.check()
+            self._conns.add(conn)
+        try:
+            yield conn
+        except Exception as e:
+            if self.cancelled:  # the driver reports our cancel as QueryCanceled
+                raise RequestCancelled("client disconnected") from e
+            raise
+        finally:
+            with self._lock:
+                self._conns.discard(conn)
+        self.check()  # a cancelled statement may have returned partial results
+
+
+_scope: contextvars.ContextVar[Optional[RequestScope]] = contextvars.ContextVar("request_scope", default=None)
+
+# statement timeout in seconds for queries in the current context; None/0 = no cap.
+# A context variable rather than a scope attribute, so concurrent calls within
+# one request (see aiodb.py) each keep their own.
+statement_timeout: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("statement_timeout", default=None)
+
+
+def current_scope() -> Optional[RequestScope]:
+    return _scope.get()
+
+
+class CancelOnDisconnect:
+    """ASGI middleware: one RequestScope per HTTP request, cancelled on http.disconnect."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = RequestScope()
+        token = _scope.set(request)
+        inbox: asyncio.Queue = asyncio.Queue()
+        done = False
+
+        async def watch():
+            while True:
+                message = await receive()
+                await inbox.put(message)
+                if message["type"] == "http.disconnect":
+                    if not done:
+                        request.cancel()
+                    return
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await self.app(scope, inbox.get, send)
+        finally:
+            done = True
+            watcher.cancel()
+            _scope.reset(token)
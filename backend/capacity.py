@@ -0,0 +1,243 @@
+# server/app/capacity.py
+"""
+Per-terminal gate capacity, stored in Vertica and served from memory.
+
+Each terminal has a base capacity (settings.VERTICA_TABLE_CAPACITY, schema
+migration 5) plus an optional calendar (migration 6): recurring shift
+rules by weekday and hour, and one-off overrides such as maintenance
+windows. Overrides win over rules, rules over the base; among rules (and
+among overrides) the later one wins.
+
+On load every terminal's calendar is compiled into a CapacityCalendar: a
+168-hour week template with the rules applied, and the overrides as
+arrays of hour intervals. The hourly capacity of any window is then an
+index into the template plus one slice assignment per overlapping
+override, with no rule evaluated per hour.
+
+The tables are small, so the store keeps all of them: reads are
+dictionary lookups (the forecast routes attach capacity to every response
+without a query), writes go to the tables and then reload the cache. Each
+API process loads the tables on its poller thread, started at startup,
+and reloads them every CAPACITY_POLL_SECONDS, which is how an edit made
+through one worker reaches the others; reads never query. Terminals
+without a row, and every terminal until the first load succeeds, get
+DEFAULT_CAPACITY_PER_HOUR.
+"""
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from backend.config import settings
+from backend.db import get_conn, transaction
+from backend import schema
+from backend.schemas import CapacityOverride, CapacityPutRequest, CapacityRule
+from backend.utils.timebox import TZ
+
+logger = logging.getLogger(__name__)
+
+_WEEK = 7 * 24
+_THURSDAY = 3  # weekday of 1970-01-01, the origin of local_hour()
+
+
+def local_hour(ts: datetime) -> int:
+    """Whole local hours since 1970-01-01 00:00 local (the calendar's time axis)."""
+    ts = ts.astimezone(TZ) if ts.tzinfo is not None else ts.replace(tzinfo=TZ)
+    return int((ts.timestamp() + ts.utcoffset().total_seconds()) // 3600)
+
+
+def _week_hours(rule: CapacityRule) -> List[int]:
+    """Hours of the week (0 = Monday 00:00) a rule covers."""
+    end = rule.end_hour if rule.end_hour > rule.start_hour else rule.end_hour + 24
+    return [(wd * 24 + h) % _WEEK for wd in rule.weekdays for h in range(rule.start_hour, end)]
+
+
+@dataclass
+class CapacityCalendar:
+    base: int
+    updated_at: Optional[datetime] = None
+    rules: List[CapacityRule] = field(default_factory=list)
+    overrides: List[CapacityOverride] = field(default_factory=list)
+
+    def __post_init__(self):
+        week = np.full(_WEEK, self.base, dtype=np.int64)
+        for rule in self.rules:
+            week[_week_hours(rule)] = rule.capacity_per_hour
+        self.week = week
+        self._starts = np.array([local_hour(o.start) for o in self.overrides], dtype=np.int64)
+        self._ends = np.array([local_hour(o.end) for o in self.overrides], dtype=np.int64)
+        self._caps = [o.capacity_per_hour for o in self.overrides]
+
+    def hourly(self, start: datetime, hours: int) -> np.ndarray:
+        """Capacity for each of `hours` local hours from `start` (truncated to the hour)."""
+        h0 = local_hour(start)
+        out = self.week[(np.arange(h0, h0 + hours) + _THURSDAY * 24) % _WEEK]
+        if len(self._caps):
+            for i in np.nonzero((self._starts < h0 + hours) & (self._ends > h0))[0]:
+                out[max(self._starts[i] - h0, 0):self._ends[i] - h0] = self._caps[i]
+        return out
+
+
+class CapacityStore:
+    def __init__(self, poll_seconds: int = settings.CAPACITY_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._calendars: Dict[str, CapacityCalendar] = {}
+        self._default = CapacityCalendar(settings.DEFAULT_CAPACITY_PER_HOUR)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._migrated = False
+        self.loaded = False
+        self.checked_at: Optional[datetime] = None
+
+    def _fetch(self, conn) -> Dict[str, CapacityCalendar]:
+        t = settings.VERTICA_TABLE_CAPACITY
+        cur = conn.cursor()
+        cur.execute(f'SELECT "TerminalID", capacity_per_hour, "updated_at" FROM {t}')
+        base = {str(term): (int(c), _aware(u)) for term, c, u in cur.fetchall()}
+        cur.execute(f"""
+        SELECT "TerminalID", weekdays, start_hour, end_hour, capacity_per_hour
+        FROM {t}_RULES ORDER BY "TerminalID", seq
+        """)
+        rules: Dict[str, List[CapacityRule]] = {}
+        for term, weekdays, sh, eh, c in cur.fetchall():
+            rules.setdefault(str(term), []).append(CapacityRule(
+                weekdays=[int(d) for d in str(weekdays).split(",") if d != ""],
+                start_hour=int(sh), end_hour=int(eh), capacity_per_hour=int(c)))
+        cur.execute(f"""
+        SELECT "TerminalID", start_ts, end_ts, capacity_per_hour, reason
+        FROM {t}_OVERRIDES ORDER BY "TerminalID", seq
+        """)
+        overrides: Dict[str, List[CapacityOverride]] = {}
+        for term, s, e, c, reason in cur.fetchall():
+            overrides.setdefault(str(term), []).append(CapacityOverride(
+                start=_aware(s), end=_aware(e), capacity_per_hour=int(c), reason=reason or ""))
+
+        calendars = {}
+        for term in set(base) | set(rules) | set(overrides):
+            cap, updated = base.get(term, (settings.DEFAULT_CAPACITY_PER_HOUR, None))
+            calendars[term] = CapacityCalendar(cap, updated, rules.get(term, []), overrides.get(term, []))
+        return calendars
+
+    def _with_conn(self, fn):
+        with get_conn() as conn:
+            if not self._migrated:
+                schema.migrate(conn)  # the tables may predate this process
+                self._migrated = True
+            return fn(conn)
+
+    def _replace(self, calendars: Dict[str, CapacityCalendar]):
+        with self._lock:
+            changed = calendars.keys() != self._calendars.keys() or any(
+                (c.base, c.rules, c.overrides) != (o.base, o.rules, o.overrides)
+                for c, o in ((calendars[k], self._calendars[k]) for k in calendars))
+            self._calendars = calendars
+            self.loaded = True
+            self.checked_at = datetime.now(TZ)
+        return changed
+
+    def reload(self):
+        """Replace the cache with the tables' current contents."""
+        if self._replace(self._with_conn(self._fetch)):
+            logger.info(f"Capacity reloaded: {len(self._calendars)} terminals configured")
+
+    def calendar(self, terminal: str) -> CapacityCalendar:
+        """The terminal's compiled calendar (a flat default one if it has none or none are loaded yet)."""
+        cal = self._calendars.get(terminal)
+        return cal if cal is not None else self._default
+
+    def get(self, terminal: str) -> int:
+        """Base capacity per hour."""
+        return self.calendar(terminal).base
+
+    def hourly(self, terminal: str, start: datetime, end: datetime) -> np.ndarray:
+        """Capacity for each local hour in [start, end)."""
+        return self.calendar(terminal).hourly(start, max(0, local_hour(end) - local_hour(start)))
+
+    def all(self) -> Dict[str, CapacityCalendar]:
+        """Every configured terminal (terminals at the default are not listed)."""
+        return dict(self._calendars)
+
+    def put_many(self, requests: List[CapacityPutRequest]):
+        """Upsert base capacities, replace calendars given in the requests, then reload the cache."""
+        t = settings.VERTICA_TABLE_CAPACITY
+        merge = f"""
+        MERGE INTO {t} c
+        USING (SELECT ? AS "TerminalID", ? AS capacity_per_hour) s
+        ON c."TerminalID" = s."TerminalID"
+        WHEN MATCHED THEN UPDATE SET capacity_per_hour = s.capacity_per_hour, "updated_at" = NOW()
+        WHEN NOT MATCHED THEN INSERT ("TerminalID", capacity_per_hour, "updated_at")
+          VALUES (s."TerminalID", s.capacity_per_hour, NOW())
+        """
+
+        def write(conn):
+            with transaction(conn):
+                cur = conn.cursor()
+                if requests:
+                    cur.executemany(merge, [[r.terminal_id, r.capacity_per_hour] for r in requests])
+                for r in requests:
+                    if r.rules is not None:
+                        cur.execute(f'DELETE FROM {t}_RULES WHERE "TerminalID" = ?', [r.terminal_id])
+                        if r.rules:
+                            cur.executemany(
+                                f'INSERT INTO {t}_RULES ("TerminalID", seq, weekdays, start_hour, end_hour, capacity_per_hour) '
+                                f'VALUES (?, ?, ?, ?, ?, ?)',
+                                [[r.terminal_id, i, ",".join(str(d) for d in rule.weekdays),
+                                  rule.start_hour, rule.end_hour, rule.capacity_per_hour]
+                                 for i, rule in enumerate(r.rules)])
+                    if r.overrides is not None:
+                        cur.execute(f'DELETE FROM {t}_OVERRIDES WHERE "TerminalID" = ?', [r.terminal_id])
+                        if r.overrides:
+                            cur.executemany(
+                                f'INSERT INTO {t}_OVERRIDES ("TerminalID", seq, start_ts, end_ts, capacity_per_hour, reason) '
+                                f'VALUES (?, ?, ?, ?, ?, ?)',
+                                [[r.terminal_id, i, _naive(o.start), _naive(o.end), o.capacity_per_hour, o.reason]
+                                 for i, o in enumerate(r.overrides)])
+            return self._fetch(conn)
+
+        self._replace(self._with_conn(write))
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="capacity-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Capacity reload failed; keeping the cached values")
+            self._stop.wait(self.poll_seconds)
+
+
+def validate_calendar(rules: Optional[List[CapacityRule]], overrides: Optional[List[CapacityOverride]]):
+    """Raise ValueError for a rule or override the calendar cannot represent."""
+    for rule in rules or []:
+        if not rule.weekdays or any(not 0 <= d <= 6 for d in rule.weekdays):
+            raise ValueError(f"weekdays must be 0 (Mon) .. 6 (Sun), got {rule.weekdays}")
+    for o in overrides or []:
+        if local_hour(o.end) <= local_hour(o.start):
+            raise ValueError(f"override ends before it starts: {o.start} .. {o.end}")
+
+
+def _aware(ts: Optional[datetime]) -> Optional[datetime]:
+    # TIMESTAMP columns come back naive in the session's (local) time zone
+    return ts.replace(tzinfo=TZ) if ts is not None and ts.tzinfo is None else ts
+
+
+def _naive(ts: datetime) -> datetime:
+    # stored as local wall-clock time, truncated to the hour
+    ts = ts.astimezone(TZ) if ts.tzinfo is not None else ts
+    return ts.replace(tzinfo=None, minute=0, second=0, microsecond=0)
+
+
+capacities = CapacityStore()
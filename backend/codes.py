@@ -0,0 +1,78 @@
+# server/app/codes.py
+"""
+Canonical MoveType / Desig vocabularies and their small-integer codes.
+
+Raw tokens rows carry free-form values ("Inbound", " e ", "LADEN", ...).
+They are mapped to a code once, when a model run is merged into the
+hourly latest-run table (see latest_runs.py); everything downstream (the
+table's code columns, the in-memory cube, request filters) compares
+integers. Code 0 is always UNK. A request filter naming no known value
+maps to NO_MATCH, which no row carries, so it selects nothing (an explicit
+"UNK" selects the unrecognized rows).
+"""
+from typing import Dict, Iterable, Optional, Tuple
+
+MOVE_TYPES: Tuple[str, ...] = ("UNK", "IN", "OUT")
+DESIGS: Tuple[str, ...] = ("UNK", "EMPTY", "FULL", "EXP")
+UNK = 0
+NO_MATCH = -1  # filter code of an unrecognized request value
+
+# canonical name -> accepted spellings (after UPPER/TRIM)
+MOVE_TYPE_VARIANTS: Dict[str, Tuple[str, ...]] = {
+    "IN": ("IN", "INBOUND", "INWARD", "I", "IMPORT", "ENTRY"),
+    "OUT": ("OUT", "OUTBOUND", "OUTWARD", "O", "EXPORT", "EXIT"),
+}
+DESIG_VARIANTS: Dict[str, Tuple[str, ...]] = {
+    "EMPTY": ("EMPTY", "E", "MT", "BLANK"),
+    "FULL": ("FULL", "F", "LADEN", "LOADED"),
+    "EXP": ("EXP", "EXPORT", "X"),
+}
+
+_MOVE_TYPE_CODES = {v: MOVE_TYPES.index(name) for name, vs in MOVE_TYPE_VARIANTS.items() for v in vs}
+_DESIG_CODES = {v: DESIGS.index(name) for name, vs in DESIG_VARIANTS.items() for v in vs}
+
+
+def move_type_code(raw: Optional[str]) -> int:
+    return _MOVE_TYPE_CODES.get(str(raw).strip().upper(), UNK) if raw else UNK
+
+
+def desig_code(raw: Optional[str]) -> int:
+    return _DESIG_CODES.get(str(raw).strip().upper(), UNK) if raw else UNK
+
+
+def _filter(raw: Optional[str], lookup: Dict[str, int], names: Tuple[str, ...]) -> Optional[int]:
+    if not raw:
+        return None
+    s = raw.strip().upper()
+    if s in {"", "ALL", "ANY"}:
+        return None
+    return lookup.get(s, names.index(s) if s in names else NO_MATCH)
+
+
+def move_type_filter(raw: Optional[str]) -> Optional[int]:
+    """Request filter -> code; None for no filter ("ALL", empty), NO_MATCH if unrecognized."""
+    return _filter(raw, _MOVE_TYPE_CODES, MOVE_TYPES)
+
+
+def desig_filter(raw: Optional[str]) -> Optional[int]:
+    """Request filter -> code; None for no filter ("ALL", empty), NO_MATCH if unrecognized."""
+    return _filter(raw, _DESIG_CODES, DESIGS)
+
+
+def _sql_case(column: str, variants: Dict[str, Iterable[str]], names: Tuple[str, ...]) -> str:
+    whens = "\n".join(
+        f"          WHEN UPPER(TRIM(\"{column}\")) IN ({', '.join(repr(v) for v in vs)}) THEN {names.index(name)}"
+        for name, vs in variants.items()
+    )
+    return f"CASE\n{whens}\n          ELSE {UNK}\n        END"
+
+
+def _sql_decode(column: str, names: Tuple[str, ...]) -> str:
+    pairs = ", ".join(f"{code}, '{name}'" for code, name in enumerate(names) if code != UNK)
+    return f"DECODE({column}, {pairs}, '{names[UNK]}')"
+
+
+MOVE_TYPE_CODE_SQL = _sql_case("MoveType", MOVE_TYPE_VARIANTS, MOVE_TYPES)
+DESIG_CODE_SQL = _sql_case("Desig", DESIG_VARIANTS, DESIGS)
+MOVE_TYPE_NAME_SQL = _sql_decode("move_type_code", MOVE_TYPES)
+DESIG_NAME_SQL = _sql_decode("desig_code", DESIGS)
@@ -16,10 +16,86 @@ class Settings(BaseModel):
     VERTICA_USER: str = os.getenv("VERTICA_USER", "dbadmin")
     VERTICA_PASSWORD: str = os.getenv("VERTICA_PASSWORD", "")
     VERTICA_TABLE_TOKENS: str = os.getenv("VERTICA_TABLE_TOKENS", "DPW_DL.TBL_GATE_TOKENS")
+    # maintained latest-run table (see backend/latest_runs.py)
+    VERTICA_TABLE_LATEST: str = os.getenv("VERTICA_TABLE_LATEST", os.getenv("VERTICA_TABLE_TOKENS", "DPW_DL.TBL_GATE_TOKENS") + "_LATEST")
+    # per-terminal gate capacity, edited via /capacity (see backend/capacity.py)
+    VERTICA_TABLE_CAPACITY: str = os.getenv("VERTICA_TABLE_CAPACITY", os.getenv("VERTICA_TABLE_TOKENS", "DPW_DL.TBL_GATE_TOKENS") + "_CAPACITY")
+    LATEST_REFRESH_IN_PROCESS: bool = os.getenv("LATEST_REFRESH_IN_PROCESS", "1") == "1"
     DROP_COL_NAME: str = os.getenv("DROP_COL_NAME", "ContainerCount")
+    # shared secret for admin/ETL endpoints (X-Admin-Token); unset = disabled
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
     # defaults for UI/ops
     DEFAULT_TIMEZONE: str = "Asia/Dubai"
     DEFAULT_CAPACITY_PER_HOUR: int = 60  # editable via capacity endpoint
+    # background pre-computation of the rolling next8h/today presets
+    PRECOMPUTE_ENABLED: bool = os.getenv("PRECOMPUTE_ENABLED", "1") == "1"
+    PRECOMPUTE_POLL_SECONDS: int = int(os.getenv("PRECOMPUTE_POLL_SECONDS", "60"))
+    # background poll of the tokens table watermark (see backend/freshness.py)
+    FRESHNESS_POLL_SECONDS: int = int(os.getenv("FRESHNESS_POLL_SECONDS", "60"))
+    # reload of the capacity table, picking up edits made through other workers
+    CAPACITY_POLL_SECONDS: int = int(os.getenv("CAPACITY_POLL_SECONDS", "30"))
+    # per-hour cell cache behind the analytics endpoints (~120 days); only hours
+    # within this many hours of now are cached, other windows query Vertica
+    CUBE_MAX_HOURS: int = int(os.getenv("CUBE_MAX_HOURS", "2880"))
+    # longest window /forecast/range returns as hourly points
+    MAX_RANGE_DAYS: int = int(os.getenv("MAX_RANGE_DAYS", "14"))
+    # point budget per series when an hourly endpoint's window is longer than
+    # MAX_RANGE_DAYS: rolled up to day/week buckets (336 = 14 days of hours)
+    MAX_POINTS_PER_SERIES: int = int(os.getenv("MAX_POINTS_PER_SERIES", "336"))
+    # GET /export: longest window (days) and exports streaming at once; each
+    # holds one executor worker and connection for its duration
+    EXPORT_MAX_DAYS: int = int(os.getenv("EXPORT_MAX_DAYS", "366"))
+    EXPORT_MAX_CONCURRENT: int = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+    # scenarios per POST /analytics/what_if (evaluated as one array)
+    WHAT_IF_MAX_SCENARIOS: int = int(os.getenv("WHAT_IF_MAX_SCENARIOS", "500"))
+    # database connections: DB_POOL_SIZE request workers (see backend/executor.py)
+    # plus DB_POOL_RESERVE for the background jobs
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "8"))
+    DB_POOL_RESERVE: int = int(os.getenv("DB_POOL_RESERVE", "2"))
+    DB_POOL_TIMEOUT_SECONDS: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+    # result sets: binary wire format (no text parsing of numbers/dates) and
+    # rows per fetchmany() batch when reading into columns (see db.fetch_columns)
+    VERTICA_BINARY_TRANSFER: bool = os.getenv("VERTICA_BINARY_TRANSFER", "1") == "1"
+    DB_FETCH_BATCH_ROWS: int = int(os.getenv("DB_FETCH_BATCH_ROWS", "10000"))
+    # requests are shed (503 + Retry-After) when this many are queued ahead of them
+    DB_QUEUE_LIMIT: int = int(os.getenv("DB_QUEUE_LIMIT", "32"))
+    # statement timeouts (session RUNTIMECAP) per executor priority class
+    STATEMENT_TIMEOUT_LIVE_SECONDS: int = int(os.getenv("STATEMENT_TIMEOUT_LIVE_SECONDS", "15"))
+    STATEMENT_TIMEOUT_CUSTOM_SECONDS: int = int(os.getenv("STATEMENT_TIMEOUT_CUSTOM_SECONDS", "60"))
+    STATEMENT_TIMEOUT_EXPORT_SECONDS: int = int(os.getenv("STATEMENT_TIMEOUT_EXPORT_SECONDS", "600"))
+    # stale-while-revalidate (see backend/stale.py): the last good result of a
+    # call is served, marked stale, when its query fails or takes longer than
+    # STALE_AFTER_SECONDS, but never once older than STALE_MAX_SECONDS (0 = off);
+    # one background refresh per call retries with backoff meanwhile
+    STALE_MAX_SECONDS: int = int(os.getenv("STALE_MAX_SECONDS", "1800"))
+    STALE_AFTER_SECONDS: float = float(os.getenv("STALE_AFTER_SECONDS", "5"))
+    STALE_RETRY_SECONDS: float = float(os.getenv("STALE_RETRY_SECONDS", "15"))
+    STALE_RETRY_MAX_SECONDS: float = float(os.getenv("STALE_RETRY_MAX_SECONDS", "120"))
+    STALE_MAX_ENTRIES: int = int(os.getenv("STALE_MAX_ENTRIES", "5000"))
+    # per-request profiling (?profile=1 with the admin token, see backend/profiling.py):
+    # stack sampling interval and how many profiles are kept for /meta/profiles
+    PROFILE_SAMPLE_INTERVAL_MS: int = int(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+    PROFILE_KEEP: int = int(os.getenv("PROFILE_KEEP", "20"))
+    # request tracing (see backend/tracing.py): spans kept in memory for
+    # /diagnostics/traces and, with TRACE_FILE set, appended there
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "0") == "1"
+    TRACE_FILE: str = os.getenv("TRACE_FILE", "")
+    TRACE_KEEP: int = int(os.getenv("TRACE_KEEP", "200"))
+    # saturation gauges in /meta/metrics (see backend/saturation.py): sampling
+    # interval (0 = off) and the window averages/maxima cover
+    SATURATION_SAMPLE_MS: int = int(os.getenv("SATURATION_SAMPLE_MS", "250"))
+    SATURATION_WINDOW_SECONDS: int = int(os.getenv("SATURATION_WINDOW_SECONDS", "60"))
+    # background stack sampler for /diagnostics/hot (0 = off): samples per
+    # thread every interval, kept in buckets for a sliding window
+    SAMPLER_INTERVAL_MS: int = int(os.getenv("SAMPLER_INTERVAL_MS", "100"))
+    SAMPLER_WINDOW_SECONDS: int = int(os.getenv("SAMPLER_WINDOW_SECONDS", "600"))
+    SAMPLER_BUCKET_SECONDS: int = int(os.getenv("SAMPLER_BUCKET_SECONDS", "10"))
+    # stack depth recorded per allocation once /diagnostics/memory/start is called
+    TRACEMALLOC_FRAMES: int = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+    # data-quality telemetry: at most one log line per (endpoint, kind) per
+    # interval; distinct (endpoint, kind, value) counters kept in memory
+    DQ_LOG_INTERVAL_SECONDS: int = int(os.getenv("DQ_LOG_INTERVAL_SECONDS", "60"))
+    DQ_MAX_COUNTERS: int = int(os.getenv("DQ_MAX_COUNTERS", "1000"))
 
 settings = Settings()
 # Expose settings as a global variable
\ No newline at end of file
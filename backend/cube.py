@@ -0,0 +1,486 @@
+# server/app/cube.py
+"""
+Per-hour cell cache behind the analytics endpoints.
+
+`parse_local_dt` truncates every window to whole hours, so any window
+aggregate is a sum over (terminal, move_type, desig, hour) cells. The cube
+keeps those cells (the latest model run per cell, normalized and clamped;
+see latest_runs.latest_cte) and, for a request over [start, end), only asks
+Vertica for the hours it has not seen yet. Overlapping custom ranges
+(yesterday+today vs today+tomorrow) therefore rescan only the new day.
+Only hours within CUBE_MAX_HOURS of now are cached, so the cube (and the
+index below) spans a bounded stretch of time whatever windows clients
+ask for; windows reaching outside it are read from Vertica directly.
+The whole cube is dropped when the freshness tracker sees a new model run;
+a fill that was in flight at that moment is not stored.
+
+Window totals go through a prefix-sum index over the same cells: per
+series cumulative sums along the hour axis, updated for the hours each
+fill adds or evicts, so a total over any window is two lookups and a subtraction.
+The same index yields hour/day/week rollups (one subtraction per bucket),
+which the hourly endpoints use for windows past MAX_RANGE_DAYS or when the
+caller passes a point budget.
+"""
+import logging
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from backend.config import settings
+from backend.db import fetch_columns, get_conn
+from backend.freshness import freshness
+from backend.latest_runs import latest_cte
+from backend.registry import registry
+from backend.utils.timebox import TZ, now_local
+
+logger = logging.getLogger(__name__)
+
+# (terminal, move_type, desig) codes; see registry.py and codes.py
+CellKey = Tuple[int, int, int]
+Cell = Tuple[datetime, int, int, int, float]  # (hour, terminal, move_type, desig, pred)
+
+
+def hours_between(start: datetime, end: datetime) -> List[datetime]:
+    """Whole local hours in [start, end)."""
+    n = int((end - start).total_seconds() // 3600)
+    return [start + timedelta(hours=i) for i in range(max(0, n))]
+
+
+def _runs(hours: List[datetime]) -> List[Tuple[datetime, datetime]]:
+    """Collapse sorted hours into contiguous [start, end) runs, one Vertica scan each."""
+    runs: List[Tuple[datetime, datetime]] = []
+    for h in hours:
+        if runs and runs[-1][1] == h:
+            runs[-1] = (runs[-1][0], h + timedelta(hours=1))
+        else:
+            runs.append((h, h + timedelta(hours=1)))
+    return runs
+
+
+# Resolutions the hourly endpoints can be served at, finest first.
+# "window" is a single bucket spanning the whole request.
+RESOLUTIONS = ("hour", "day", "week")
+
+
+def bucket_edges(start: datetime, end: datetime, resolution: str) -> List[datetime]:
+    """
+    Bucket boundaries [start, ..., end] for a resolution. Buckets align to
+    local hours, midnights or Mondays, so the first and last ones may be
+    partial.
+    """
+    if end <= start:
+        return [start]
+    if resolution == "window":
+        return [start, end]
+    if resolution == "hour":
+        step, first = timedelta(hours=1), start + timedelta(hours=1)
+    elif resolution == "day":
+        step = timedelta(days=1)
+        first = start.replace(hour=0) + step
+    elif resolution == "week":
+        step = timedelta(weeks=1)
+        first = start.replace(hour=0) - timedelta(days=start.weekday()) + step
+    else:
+        raise ValueError(f"unknown resolution {resolution!r}")
+    edges = [start]
+    e = first
+    while e < end:
+        edges.append(e)
+        e += step
+    edges.append(end)
+    return edges
+
+
+def pick_resolution(start: datetime, end: datetime, max_points: int) -> str:
+    """Finest resolution whose bucket count per series fits the point budget (week at worst)."""
+    for resolution in RESOLUTIONS:
+        if len(bucket_edges(start, end, resolution)) - 1 <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def choose_resolution(start: datetime, end: datetime, max_points: Optional[int]) -> str:
+    """
+    Resolution of an hourly endpoint's series over [start, end): hourly,
+    unless the caller passed a point budget or the window is longer than
+    MAX_RANGE_DAYS; then the finest resolution within max_points (default
+    MAX_POINTS_PER_SERIES). Raises ValueError for a non-positive max_points.
+    """
+    if max_points is not None:
+        if max_points < 1:
+            raise ValueError("max_points must be positive")
+        return pick_resolution(start, end, max_points)
+    if (end - start).days > settings.MAX_RANGE_DAYS:
+        return pick_resolution(start, end, settings.MAX_POINTS_PER_SERIES)
+    return "hour"
+
+
+class Rollup(NamedTuple):
+    starts: List[datetime]  # bucket start per column
+    keys: List[CellKey]     # series per row
+    sums: np.ndarray        # SUM(pred), shape (series, buckets)
+    counts: np.ndarray      # rows behind each sum; 0 = no data in that bucket
+
+
+def _matches(key: CellKey, terminal: Optional[int], move_type: Optional[int], desig: Optional[int]) -> bool:
+    t, mt, dg = key
+    return ((terminal is None or t == terminal)
+            and (move_type is None or mt == move_type)
+            and (desig is None or dg == desig))
+
+
+class PrefixIndex:
+    """
+    Cumulative sums along the hour axis for every (terminal, move_type, desig)
+    series in the cube.
+
+    sums[i, j]   = sum of series i over the first j hours of the axis
+    counts[i, j] = number of those hours where series i has a row
+    loaded[j]    = number of those hours present in the cube
+    so totals over any [start, end) are O(1) per series, and `loaded` tells
+    whether the window is fully covered.
+
+    Maintained by the cube as hours are filled and evicted (update()): the
+    per-hour values are kept alongside, and only the prefix sums from the
+    earliest changed hour on are recomputed, with numpy, instead of
+    rebuilding the index from the whole cube.
+    """
+
+    def __init__(self):
+        self.origin: Optional[datetime] = None
+        self.keys: List[CellKey] = []
+        self._row: Dict[CellKey, int] = {}
+        self._values = np.zeros((0, 0))
+        self._present = np.zeros((0, 0), dtype=np.int8)
+        self._hours = np.zeros(0, dtype=np.int8)
+        self.sums = np.zeros((0, 1))
+        self.counts = np.zeros((0, 1), dtype=np.int32)
+        self.loaded = np.zeros(1, dtype=np.int32)
+
+    def _grow(self, first: datetime, last: datetime, keys):
+        # widen the axis to cover [first, last] and add rows (in key order) for new series
+        new = {k for k in keys if k not in self._row}
+        if self.origin is None:
+            self.origin = first
+        before = max(0, int((self.origin - first).total_seconds() // 3600))
+        after = max(0, self._offset(last) + 1 + before - len(self._hours))
+        if not (before or after or new):
+            return
+        keys = sorted(set(self.keys) | new)
+        rows = [keys.index(k) for k in self.keys] if new else slice(None)
+        n = len(self._hours) + before + after
+
+        def widen(old: np.ndarray, shape, offset: int) -> np.ndarray:
+            out = np.zeros(shape, dtype=old.dtype)
+            out[rows, offset:offset + old.shape[1]] = old
+            return out
+
+        self._values = widen(self._values, (len(keys), n), before)
+        self._present = widen(self._present, (len(keys), n), before)
+        hours = np.zeros(n, dtype=np.int8)
+        hours[before:before + len(self._hours)] = self._hours
+        self._hours = hours
+        self.sums = np.zeros((len(keys), n + 1))
+        self.counts = np.zeros((len(keys), n + 1), dtype=np.int32)
+        self.loaded = np.zeros(n + 1, dtype=np.int32)
+        self.keys, self._row = keys, {k: i for i, k in enumerate(keys)}
+        self.origin -= timedelta(hours=before)
+        self._accumulate(0)
+
+    def _accumulate(self, a: int):
+        """Recompute the prefix sums from hour offset `a` on."""
+        np.cumsum(self._values[:, a:], axis=1, out=self.sums[:, a + 1:])
+        self.sums[:, a + 1:] += self.sums[:, a:a + 1]
+        np.cumsum(self._present[:, a:], axis=1, dtype=np.int32, out=self.counts[:, a + 1:])
+        self.counts[:, a + 1:] += self.counts[:, a:a + 1]
+        np.cumsum(self._hours[a:], dtype=np.int32, out=self.loaded[a + 1:])
+        self.loaded[a + 1:] += self.loaded[a]
+
+    def update(self, filled: Dict[datetime, Dict[CellKey, float]], evicted: List[datetime] = ()):
+        """Record filled hours (with their cells) and hours dropped from the cube."""
+        if filled:
+            self._grow(min(filled), max(filled), {k for cells in filled.values() for k in cells})
+        if self.origin is None:
+            return
+        changed = []
+        for h, cells in filled.items():
+            j = self._offset(h)
+            self._values[:, j] = 0.0
+            self._present[:, j] = 0
+            self._hours[j] = 1
+            for k, v in cells.items():
+                self._values[self._row[k], j] = v
+                self._present[self._row[k], j] = 1
+            changed.append(j)
+        # after the fill: a fill larger than the cube evicts some of its own hours
+        for h in evicted:
+            j = self._offset(h)
+            if 0 <= j < len(self._hours):
+                self._values[:, j] = 0.0
+                self._present[:, j] = 0
+                self._hours[j] = 0
+                changed.append(j)
+        if changed:
+            self._accumulate(min(changed))
+        self._trim()
+
+    def _trim(self):
+        # hours before the first loaded one are dead weight once they are half the axis
+        loaded = np.flatnonzero(self._hours)
+        first = int(loaded[0]) if len(loaded) else len(self._hours)
+        if first == 0 or first < len(self._hours) // 2:
+            return
+        self._values = self._values[:, first:].copy()
+        self._present = self._present[:, first:].copy()
+        self._hours = self._hours[first:].copy()
+        self.sums = self.sums[:, first:] - self.sums[:, first:first + 1]
+        self.counts = self.counts[:, first:] - self.counts[:, first:first + 1]
+        self.loaded = self.loaded[first:] - self.loaded[first]
+        self.origin += timedelta(hours=first)
+        if not len(self._hours):
+            self.__init__()
+
+    def _offset(self, h: datetime) -> int:
+        return int((h - self.origin).total_seconds() // 3600)
+
+    def buckets(self, edges: List[datetime]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (sums, row counts) per series and bucket for the bucket boundaries
+        `edges` = [start, ..., end], or None if [start, end) is not fully
+        loaded. Each bucket is one subtraction per series.
+        """
+        n_hours = len(hours_between(edges[0], edges[-1]))
+        if n_hours == 0:
+            empty = np.zeros((len(self.keys), len(edges) - 1))
+            return empty, empty.astype(np.int32)
+        if self.origin is None:
+            return None
+        offs = np.array([self._offset(e) for e in edges])
+        a, b = offs[0], offs[-1]
+        if a < 0 or b >= len(self.loaded) or self.loaded[b] - self.loaded[a] != n_hours:
+            return None
+        return np.diff(self.sums[:, offs], axis=1), np.diff(self.counts[:, offs], axis=1)
+
+
+class HourlyCube:
+    """
+    hour -> {(terminal, move_type, desig) codes: pred}, all terminals and filter
+    values, LRU-bounded by number of hours. An hour present in the cube is
+    complete: hours with no forecast rows are stored as empty dicts.
+    """
+
+    def __init__(self, max_hours: int = settings.CUBE_MAX_HOURS):
+        self.max_hours = max_hours
+        self._hours: "OrderedDict[datetime, Dict[CellKey, float]]" = OrderedDict()
+        self._lock = threading.Lock()       # guards _hours and _filling
+        self._filling: Dict[datetime, threading.Event] = {}  # hour -> set once its fill is over
+        self._generation = 0                # bumped by invalidate(); fills from before it are dropped
+        self._index = PrefixIndex()         # kept in step with _hours, under _lock
+
+    def _fetch(self, start: datetime, end: datetime) -> Dict[datetime, Dict[CellKey, float]]:
+        q = f"""
+        {latest_cte()}
+        SELECT "TerminalID", move_type_code, desig_code, "MoveDate_pred", "MoveHour_pred", SUM(pred) AS pred
+        FROM latest
+        GROUP BY 1,2,3,4,5
+        """
+        filled: Dict[datetime, Dict[CellKey, float]] = {h: {} for h in hours_between(start, end)}
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(q, [start, end])
+            t, mt, dg, d, h, s = fetch_columns(cur)
+        if not t:
+            return filled
+        # per distinct value rather than per row: terminal codes and hour keys
+        terminal = {name: registry.code(str(name)) for name in set(t)}
+        hour = {(day, hh): datetime.combine(day, time(int(hh)), tzinfo=TZ) for day, hh in set(zip(d, h))}
+        preds = np.nan_to_num(np.array(s, dtype=float)).tolist()  # NULL -> 0
+        mts = np.array(mt, dtype=np.int64).tolist()
+        dgs = np.array(dg, dtype=np.int64).tolist()
+        for ti, m, g, day, hh, p in zip(t, mts, dgs, d, h, preds):
+            filled.setdefault(hour[(day, hh)], {})[(terminal[ti], m, g)] = p
+        return filled
+
+    def _cacheable(self, start: datetime, end: datetime) -> bool:
+        """
+        Whether [start, end) goes through the cube: it lies within max_hours
+        of now, the stretch the cube caches, and is no longer than the cube
+        holds (a longer one would evict the live hours to make room).
+        """
+        span = timedelta(hours=self.max_hours)
+        now = now_local()
+        return now - span <= start and end <= now + span and end - start <= span
+
+    def _load(self, hours: List[datetime]) -> Dict[datetime, Dict[CellKey, float]]:
+        """
+        Fetch and store the given hours; returns them even if they are evicted
+        right away. Hours another request is already fetching are waited for
+        rather than fetched twice; fills of different hours run side by side,
+        so a live window never queues behind a long custom one.
+        """
+        loaded: Dict[datetime, Dict[CellKey, float]] = {}
+        claimed: Dict[datetime, threading.Event] = {}
+        waiting = set()
+        with self._lock:
+            generation = self._generation
+            for h in hours:
+                if h in self._hours:
+                    loaded[h] = self._hours[h]
+                elif h in self._filling:
+                    waiting.add(self._filling[h])
+                else:
+                    claimed[h] = None
+            runs = _runs(list(claimed))
+            for run_start, run_end in runs:
+                done = threading.Event()
+                for h in hours_between(run_start, run_end):
+                    claimed[h] = self._filling[h] = done
+        try:
+            for run_start, run_end in runs:
+                fetched = self._fetch(run_start, run_end)
+                loaded.update(fetched)
+                with self._lock:
+                    if self._generation != generation:
+                        continue  # invalidated mid-fill: these rows may predate the new run
+                    self._hours.update(fetched)
+                    evicted = []
+                    while len(self._hours) > self.max_hours:
+                        evicted.append(self._hours.popitem(last=False)[0])
+                    # hours that have fallen out of the cached stretch as time moved on
+                    floor = now_local() - timedelta(hours=self.max_hours)
+                    for h in [h for h in self._hours if h < floor]:
+                        del self._hours[h]
+                        evicted.append(h)
+                    self._index.update(fetched, evicted)
+                    self._release(fetched, claimed)
+        finally:
+            with self._lock:
+                self._release(claimed, claimed)
+
+        if claimed:
+            logger.debug(f"Cube filled {len(claimed)} of {len(hours)} hours from Vertica")
+        for done in waiting:
+            done.wait()
+        rest = [h for h in hours if h not in loaded]
+        if rest:
+            # filled by other requests meanwhile (or dropped by an invalidation: fetch them again)
+            with self._lock:
+                loaded.update({h: self._hours[h] for h in rest if h in self._hours})
+            rest = [h for h in rest if h not in loaded]
+            if rest:
+                loaded.update(self._load(rest))
+        return loaded
+
+    def _release(self, hours, claimed: Dict[datetime, threading.Event]):
+        # under _lock: hand over hours this fill claimed, waking whoever waits on their run
+        for h in hours:
+            done = claimed.get(h)
+            if done is not None and self._filling.get(h) is done:
+                del self._filling[h]
+                done.set()
+
+    def cells(self, start: datetime, end: datetime,
+              terminal: Optional[int] = None,
+              move_type: Optional[int] = None,
+              desig: Optional[int] = None) -> List[Cell]:
+        """All non-empty cells in [start, end) matching the filters (codes; None = all), in hour order."""
+        hours = hours_between(start, end)
+        if not self._cacheable(start, end):
+            return self._select(self._fetch(start, end), hours, terminal, move_type, desig)
+        with self._lock:
+            window = {}
+            for h in hours:
+                if h in self._hours:
+                    self._hours.move_to_end(h)
+                    window[h] = self._hours[h]
+        if len(window) < len(hours):
+            window.update(self._load([h for h in hours if h not in window]))
+        return self._select(window, hours, terminal, move_type, desig)
+
+    @staticmethod
+    def _select(window: Dict[datetime, Dict[CellKey, float]], hours: List[datetime],
+                terminal, move_type, desig) -> List[Cell]:
+        out: List[Cell] = []
+        for h in hours:
+            for key, pred in window.get(h, {}).items():
+                if _matches(key, terminal, move_type, desig):
+                    out.append((h, *key, pred))
+        return out
+
+    def _buckets(self, edges: List[datetime]):
+        # under the lock: the index is updated in place by fills
+        with self._lock:
+            found = self._index.buckets(edges)
+            return found, list(self._index.keys)
+
+    def rollup(self, start: datetime, end: datetime, resolution: str = "hour",
+               terminal: Optional[int] = None,
+               move_type: Optional[int] = None,
+               desig: Optional[int] = None) -> "Rollup":
+        """
+        Per-series sums over [start, end) at hour, day or week resolution,
+        restricted to the series matching the filters. Answered from the
+        prefix index; missing hours are filled first. Windows outside the
+        cached stretch, or larger than the cube can hold, fall back to
+        bucketing cells.
+        """
+        edges = bucket_edges(start, end, resolution)
+        if not self._cacheable(start, end):
+            return self._rollup_cells(edges, terminal, move_type, desig)
+        found, keys = self._buckets(edges)
+        if found is None:
+            with self._lock:
+                missing = [h for h in hours_between(start, end) if h not in self._hours]
+            self._load(missing)
+            found, keys = self._buckets(edges)
+        if found is None:
+            return self._rollup_cells(edges, terminal, move_type, desig)
+
+        sums, counts = found
+        rows = [i for i, k in enumerate(keys) if _matches(k, terminal, move_type, desig)]
+        return Rollup(edges[:-1], [keys[i] for i in rows], sums[rows], counts[rows])
+
+    def _rollup_cells(self, edges: List[datetime], terminal, move_type, desig) -> "Rollup":
+        cells = self.cells(edges[0], edges[-1], terminal, move_type, desig)
+        keys = sorted({(t, mt, dg) for _, t, mt, dg, _ in cells})
+        row = {k: i for i, k in enumerate(keys)}
+        sums = np.zeros((len(keys), len(edges) - 1))
+        counts = np.zeros((len(keys), len(edges) - 1), dtype=np.int32)
+        for h, t, mt, dg, pred in cells:
+            j = bisect_right(edges, h) - 1
+            sums[row[(t, mt, dg)], j] += pred
+            counts[row[(t, mt, dg)], j] += 1
+        return Rollup(edges[:-1], keys, sums, counts)
+
+    def totals(self, start: datetime, end: datetime,
+               terminal: Optional[int] = None,
+               move_type: Optional[int] = None,
+               desig: Optional[int] = None) -> Dict[CellKey, float]:
+        """
+        SUM(pred) per (terminal, move_type, desig) over [start, end), for the
+        series with at least one row in the window: a single-bucket rollup,
+        i.e. two prefix lookups per series whatever the window length.
+        """
+        r = self.rollup(start, end, "window", terminal, move_type, desig)
+        return {k: float(r.sums[i, 0]) for i, k in enumerate(r.keys)
+                if r.sums.shape[1] and r.counts[i, 0] > 0}
+
+    def invalidate(self):
+        """Drop every cached hour (a new model run may have changed any of them)."""
+        with self._lock:
+            self._hours.clear()
+            self._index = PrefixIndex()
+            self._generation += 1
+            # fills in flight are dropped when they land; later requests fetch afresh
+            for done in self._filling.values():
+                done.set()
+            self._filling.clear()
+
+
+cube = HourlyCube()
+# a new model run may have changed any hour, whether or not the preset scheduler runs
+freshness.subscribe(lambda old, new: cube.invalidate())
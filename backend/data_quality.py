@@ -0,0 +1,91 @@
+# server/app/data_quality.py
+"""
+Data-quality telemetry.
+
+Anomalies (non-canonical or unknown MoveType/Desig values, negative
+predictions) are counted in memory per (endpoint, kind, value) instead of
+being logged one line per row. For each (endpoint, kind) at most one
+representative line is logged every DQ_LOG_INTERVAL_SECONDS, carrying the
+number of occurrences since the previous line, so a bad model run costs a
+few counter increments rather than a log flood. The counters are served by
+GET /meta/data_quality.
+
+Kinds:
+  move_type_normalized / desig_normalized   known variant mapped to canonical
+  move_type_unknown / desig_unknown         unrecognized value mapped to UNK
+  negative_pred                             prediction clamped to 0
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+from backend.config import settings
+from backend.utils.timebox import now_local
+
+logger = logging.getLogger(__name__)
+
+_MAX_VALUE_LEN = 64
+_OTHER = "<other>"  # value bucket once DQ_MAX_COUNTERS distinct keys exist
+
+
+class DataQualityTelemetry:
+    def __init__(self, log_interval: float = settings.DQ_LOG_INTERVAL_SECONDS,
+                 max_counters: int = settings.DQ_MAX_COUNTERS):
+        self.log_interval = log_interval
+        self.max_counters = max_counters
+        self._lock = threading.Lock()
+        self._counts: Dict[Tuple[str, str, str], int] = {}
+        self._pending: Dict[Tuple[str, str], int] = {}    # occurrences since last log line
+        self._last_log: Dict[Tuple[str, str], float] = {}
+        self.since = now_local()
+
+    def record(self, endpoint: str, kind: str, value: Any = "", n: int = 1,
+               level: int = logging.WARNING, detail: str = ""):
+        """Count `n` occurrences; log a sampled line if this (endpoint, kind) is due."""
+        if n <= 0:
+            return
+        value = "" if value is None else str(value)[:_MAX_VALUE_LEN]
+        stream = (endpoint, kind)
+        now = time.monotonic()
+        with self._lock:
+            key = (endpoint, kind, value)
+            if key not in self._counts and len(self._counts) >= self.max_counters:
+                key = (endpoint, kind, _OTHER)
+            self._counts[key] = self._counts.get(key, 0) + n
+            pending = self._pending.get(stream, 0) + n
+            due = now - self._last_log.get(stream, float("-inf")) >= self.log_interval
+            if due:
+                self._pending[stream] = 0
+                self._last_log[stream] = now
+            else:
+                self._pending[stream] = pending
+        if due:
+            logger.log(level, f"Data quality: {kind} {value!r} in {endpoint} "
+                              f"({pending} occurrences since last report){detail}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        totals: Dict[str, int] = {}
+        for (_, kind, _), n in counts.items():
+            totals[kind] = totals.get(kind, 0) + n
+        return {
+            "since": self.since,
+            "log_interval_seconds": self.log_interval,
+            "totals": totals,
+            "counters": [
+                {"endpoint": e, "kind": k, "value": v, "count": n}
+                for (e, k, v), n in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+            ],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._pending.clear()
+            self._last_log.clear()
+            self.since = now_local()
+
+
+telemetry = DataQualityTelemetry()
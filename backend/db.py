@@ -1,7 +1,19 @@
 # server/app/db.py
+import collections
+import logging
+import queue
+import threading
+import time
 from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
 import vertica_python
 from backend.config import settings
+from backend.cancellation import current_scope, statement_timeout
+from backend.profiling import ProfiledConnection, current_profile
+from backend.tracing import TracedConnection, current_span, span, start_span
+
+logger = logging.getLogger(__name__)
 
 conn_info = {
     "host": settings.VERTICA_HOST,
@@ -11,12 +23,199 @@ conn_info = {
     "database": settings.VERTICA_DB,
     "autocommit": True,
     "use_prepared_statements": True,
+    "binary_transfer": settings.VERTICA_BINARY_TRANSFER,
 }
 
+
+class ConnectionPool:
+    """
+    Bounded pool of Vertica connections. At most `size` connections are
+    open at once; idle ones are reused (most recently used first). A
+    connection whose block raised is closed rather than returned, since
+    its session state is unknown.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._opened = 0
+        self._caps: Dict[int, Optional[int]] = {}  # id(conn) -> session RUNTIMECAP seconds
+        self._waiting = 0
+        self._checkouts = 0
+        self._waits: "collections.deque" = collections.deque()  # (time, seconds), last window
+
+    def _take_idle(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            try:
+                if not conn.closed():
+                    return conn
+            except Exception:
+                pass
+            # dropped: its id may be reused by a new connection, whose session has no cap yet
+            with self._lock:
+                self._caps.pop(id(conn), None)
+
+    @contextmanager
+    def connection(self, timeout: float = settings.DB_POOL_TIMEOUT_SECONDS):
+        profile = current_profile()
+        waiting = time.perf_counter()
+        acquire = start_span("pool.acquire")
+        with self._lock:
+            self._waiting += 1
+        try:
+            got = self._slots.acquire(timeout=timeout)
+        finally:
+            self._record_wait(time.perf_counter() - waiting)
+        if not got:
+            if acquire is not None:
+                acquire.attrs["error"] = "TimeoutError"
+                acquire.finish()
+            raise TimeoutError(f"no database connection available within {timeout}s")
+        conn = None
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = vertica_python.connect(**conn_info)
+                with self._lock:
+                    self._opened += 1
+                if acquire is not None:
+                    acquire.attrs["connected"] = True
+            with self._lock:
+                self._in_use += 1
+            if acquire is not None:
+                acquire.finish()
+                acquire = None
+            if profile is not None:
+                profile.add("connection_wait", time.perf_counter() - waiting)
+            try:
+                yield conn
+            except BaseException:
+                self._discard(conn)
+                conn = None
+                raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    self._in_use -= 1
+                self._idle.put(conn)
+            self._slots.release()
+
+    def _record_wait(self, seconds: float):
+        now = time.monotonic()
+        with self._lock:
+            self._waiting -= 1
+            self._checkouts += 1
+            self._waits.append((now, seconds))
+            while now - self._waits[0][0] > settings.SATURATION_WINDOW_SECONDS:
+                self._waits.popleft()
+
+    def set_runtimecap(self, conn, seconds: Optional[float]):
+        """Session statement timeout; only issued when it differs from the connection's."""
+        cap = int(seconds) if seconds else None
+        if self._caps.get(id(conn), None) == cap:
+            return
+        value = f"'{cap} seconds'" if cap else "NONE"
+        conn.cursor().execute(f"SET SESSION RUNTIMECAP {value}")
+        self._caps[id(conn)] = cap
+
+    def _discard(self, conn):
+        with self._lock:
+            self._in_use -= 1
+            self._caps.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            logger.debug("Error closing discarded connection", exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(w for _, w in self._waits)
+            return {"size": self.size, "in_use": self._in_use,
+                    "idle": self._idle.qsize(), "opened_total": self._opened,
+                    "waiting": self._waiting, "checkouts_total": self._checkouts,
+                    # checkout (slot) waits over the last SATURATION_WINDOW_SECONDS
+                    "checkout_wait_ms": {
+                        "count": len(waits),
+                        "avg": round(1000 * sum(waits) / len(waits), 2) if waits else 0.0,
+                        "p95": round(1000 * waits[int(0.95 * (len(waits) - 1))], 2) if waits else 0.0,
+                        "max": round(1000 * waits[-1], 2) if waits else 0.0,
+                    }}
+
+
+def fetch_columns(cur, batch: int = settings.DB_FETCH_BATCH_ROWS) -> List[list]:
+    """
+    The executed cursor's result set as one list per column, read `batch`
+    rows at a time with fetchmany() and transposed per batch, instead of
+    unpacking row tuples one by one in the caller.
+    """
+    columns: Optional[List[list]] = None
+    with span("db.fetch") as s:
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            if columns is None:
+                columns = [list(c) for c in zip(*rows)]
+            else:
+                for column, values in zip(columns, zip(*rows)):
+                    column.extend(values)
+        if columns is None:
+            columns = [[] for _ in (cur.description or ())]
+        if s is not None:
+            s.attrs["rows"] = len(columns[0]) if columns else 0
+            s.trace.count(rows=s.attrs["rows"])
+    return columns
+
+
 @contextmanager
-def get_conn():
-    conn = vertica_python.connect(**conn_info)
+def transaction(conn):
+    """Run the block as one transaction on an (otherwise autocommit) pooled connection."""
+    conn.autocommit = False
     try:
         yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
     finally:
-        conn.close()
+        conn.autocommit = True
+
+
+# request workers (see executor.py) plus a few for the background jobs
+pool = ConnectionPool(settings.DB_POOL_SIZE + settings.DB_POOL_RESERVE)
+
+
+def _instrumented(conn):
+    # statement spans in a traced request, timings in a profiled one
+    if current_span() is not None:
+        conn = TracedConnection(conn)
+    profile = current_profile()
+    return conn if profile is None else ProfiledConnection(conn, profile)
+
+
+@contextmanager
+def get_conn():
+    """
+    A pooled connection carrying the current statement timeout. Inside a
+    request (see cancellation.py) it is cancelled if the client disconnects;
+    in a profiled or traced request (see profiling.py, tracing.py) its
+    statements are timed.
+    """
+    scope = current_scope()
+    if scope is None:
+        with pool.connection() as conn:
+            pool.set_runtimecap(conn, statement_timeout.get())
+            yield _instrumented(conn)
+        return
+    scope.check()
+    with pool.connection() as conn:
+        pool.set_runtimecap(conn, statement_timeout.get())
+        with scope.attach(conn):
+            yield _instrumented(conn)
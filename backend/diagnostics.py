@@ -0,0 +1,236 @@
+# server/app/diagnostics.py
+"""
+Always-on diagnostics for finding hot paths under real load.
+
+SamplingProfiler: a background thread snapshots every thread's stack each
+SAMPLER_INTERVAL_MS (sys._current_frames, no tracing hooks, so the cost is
+one stack walk per thread per tick) and counts the folded stacks in
+SAMPLER_BUCKET_SECONDS buckets, keeping SAMPLER_WINDOW_SECONDS of them.
+top() turns any trailing part of that window into the hottest functions:
+"self" samples (the function was running) and "total" samples (it was on
+the stack). Threads parked in a wait (idle executor workers, the event
+loop's selector, the pollers) are left out unless asked for.
+
+MemoryTracker: tracemalloc, off by default because tracing slows every
+allocation. Started on demand; each snapshot reports the largest
+allocation sites and the growth since the previous snapshot, which is how
+a cache or result list that keeps growing shows up.
+
+Both are served under /diagnostics (admin only).
+"""
+import collections
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from backend.config import settings
+from backend.profiling import fold
+
+logger = logging.getLogger(__name__)
+
+# leaf frames of a thread that is waiting rather than working
+_IDLE = {
+    "threading.Condition.wait",
+    "threading.Event.wait",
+    "threading.Thread._wait_for_tstate_lock",
+    "selectors.EpollSelector.select",
+    "selectors.KqueueSelector.select",
+    "selectors.PollSelector.select",
+    "selectors.SelectSelector.select",
+    "concurrent.futures.thread._worker",
+}
+
+
+class _Bucket:
+    __slots__ = ("start", "ticks", "stacks")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.ticks = 0
+        self.stacks: Dict[str, int] = collections.Counter()  # folded stack -> samples
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms: int = settings.SAMPLER_INTERVAL_MS,
+                 window_seconds: int = settings.SAMPLER_WINDOW_SECONDS,
+                 bucket_seconds: int = settings.SAMPLER_BUCKET_SECONDS):
+        self.interval = interval_ms / 1000
+        self.window = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self._buckets: Deque[_Bucket] = collections.deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self):
+        me = threading.get_ident()
+        stacks = [fold(frame, lines=False) for ident, frame in sys._current_frames().items() if ident != me]
+        now = time.time()
+        with self._lock:
+            if not self._buckets or now - self._buckets[-1].start >= self.bucket_seconds:
+                self._buckets.append(_Bucket(now))
+                while now - self._buckets[0].start > self.window + self.bucket_seconds:
+                    self._buckets.popleft()
+            bucket = self._buckets[-1]
+            bucket.ticks += 1
+            for stack in stacks:
+                bucket.stacks[stack] += 1
+
+    def _recent(self, seconds: Optional[float]) -> Tuple[int, Dict[str, int], float]:
+        # (ticks, stack counts, seconds covered) of the buckets overlapping the last `seconds`
+        cutoff = time.time() - (seconds if seconds is not None else self.window)
+        ticks, stacks, first = 0, collections.Counter(), None
+        with self._lock:
+            for b in self._buckets:
+                if b.start + self.bucket_seconds < cutoff:
+                    continue
+                first = b.start if first is None else first
+                ticks += b.ticks
+                stacks.update(b.stacks)
+        return ticks, stacks, 0.0 if first is None else time.time() - first
+
+    def top(self, seconds: Optional[float] = None, limit: int = 30, sort: str = "self",
+            include_idle: bool = False) -> Dict[str, Any]:
+        """
+        Hottest functions over the last `seconds` (default: the whole window).
+        Percentages are of the thread samples counted (busy threads only,
+        unless include_idle).
+        """
+        ticks, stacks, covered = self._recent(seconds)
+        own: Dict[str, int] = collections.Counter()
+        total: Dict[str, int] = collections.Counter()
+        counted = 0
+        for stack, n in stacks.items():
+            names = stack.split(";")
+            if not include_idle and names[-1] in _IDLE:
+                continue
+            counted += n
+            own[names[-1]] += n
+            for name in set(names):
+                total[name] += n
+        ranked = (own if sort == "self" else total).most_common(limit)
+        return {
+            "seconds": round(covered, 1),
+            "ticks": ticks,
+            "thread_samples": counted,
+            "interval_ms": round(self.interval * 1000),
+            "functions": [
+                {
+                    "function": name,
+                    "self": own.get(name, 0),
+                    "total": total[name],
+                    "self_pct": round(100 * own.get(name, 0) / counted, 2),
+                    "total_pct": round(100 * total[name] / counted, 2),
+                }
+                for name, _ in ranked
+            ],
+        }
+
+    def folded(self, seconds: Optional[float] = None, include_idle: bool = False) -> str:
+        """The window's samples as folded stacks, for flamegraph.pl or speedscope."""
+        _, stacks, _ = self._recent(seconds)
+        return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common()
+                       if include_idle or stack.rsplit(";", 1)[-1] not in _IDLE)
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Stack sample failed")
+
+
+class MemoryTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last: Optional[tracemalloc.Snapshot] = None
+        self._last_at: Optional[float] = None
+
+    def status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else None,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory() if tracing else 0,
+            "has_snapshot": self._last is not None,
+        }
+
+    def start(self, frames: int = settings.TRACEMALLOC_FRAMES) -> Dict[str, Any]:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._last = self._last_at = None
+                logger.info(f"tracemalloc started ({frames} frames)")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+                logger.info("tracemalloc stopped")
+            self._last = self._last_at = None
+        return self.status()
+
+    def snapshot(self, key_type: str = "lineno", limit: int = 25) -> Dict[str, Any]:
+        """
+        Largest allocation sites now and, from the second snapshot on, the
+        biggest changes since the previous one. key_type: "lineno",
+        "filename" or "traceback".
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first")
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        now = time.time()
+        with self._lock:
+            last, last_at = self._last, self._last_at
+            self._last, self._last_at = snap, now
+
+        def site(stat) -> str:
+            if key_type == "traceback":
+                return " <- ".join(f"{f.filename}:{f.lineno}" for f in stat.traceback)
+            frame = stat.traceback[0]
+            return frame.filename if key_type == "filename" else f"{frame.filename}:{frame.lineno}"
+
+        stats = snap.statistics(key_type)
+        out: Dict[str, Any] = {
+            "total_bytes": sum(s.size for s in stats),
+            "top": [{"site": site(s), "bytes": s.size, "blocks": s.count} for s in stats[:limit]],
+        }
+        if last is not None:
+            diff = snap.compare_to(last, key_type)
+            out["since_seconds"] = round(now - last_at, 1)
+            out["growth"] = [
+                {"site": site(d), "bytes": d.size, "bytes_diff": d.size_diff,
+                 "blocks": d.count, "blocks_diff": d.count_diff}
+                for d in diff[:limit] if d.size_diff
+            ]
+        return out
+
+
+sampler = SamplingProfiler()
+memory = MemoryTracker()
@@ -0,0 +1,288 @@
+# server/app/executor.py
+"""
+Dedicated executor for request work that talks to Vertica.
+
+Routes decorated with @db_route run on DB_POOL_SIZE worker threads (one
+pooled connection each, see db.py) instead of Starlette's shared thread
+pool, taking jobs from a priority queue:
+
+  LIVE    the rolling next8h/today presets the control room polls
+  CUSTOM  any other window
+  EXPORT  bulk downloads
+
+so interactive panels are never queued behind heavy custom-range scans.
+Sync routes run on a worker whole; async routes run on the event loop and
+send only their blocking calls here (see aiodb.py), under the priority
+class the route was admitted with.
+Admission control: a request is shed with 503 + Retry-After as soon as
+DB_QUEUE_LIMIT jobs of the same or higher priority are queued ahead of
+it, instead of waiting for a worker indefinitely. A request is admitted
+once, when its route is entered; the jobs it then queues are never shed.
+Composite routes (several db_routes in one request) admit all of theirs
+at once with admit(), so they are shed whole or served whole.
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.cancellation import current_scope, statement_timeout
+from backend.config import settings
+from backend.profiling import awaiting, current_profile
+from backend.stale import last_good
+from backend.tracing import span
+from vertica_python import errors as vertica_errors
+
+logger = logging.getLogger(__name__)
+
+LIVE, CUSTOM, EXPORT = 0, 1, 2
+PRIORITIES = ("live", "custom", "export")
+# default statement timeout per class (seconds)
+TIMEOUTS = (settings.STATEMENT_TIMEOUT_LIVE_SECONDS,
+            settings.STATEMENT_TIMEOUT_CUSTOM_SECONDS,
+            settings.STATEMENT_TIMEOUT_EXPORT_SECONDS)
+
+
+class Overloaded(Exception):
+    """The executor queue is over its limit for this priority; retry later."""
+
+    def __init__(self, priority: int, queued: int, retry_after: int):
+        super().__init__(f"{queued} {PRIORITIES[priority]}-or-higher requests queued")
+        self.priority = priority
+        self.queued = queued
+        self.retry_after = retry_after
+
+
+# errors that mean the database is struggling rather than the request being wrong
+_UNAVAILABLE = (vertica_errors.Error, TimeoutError, OSError, Overloaded)
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "priority", "enqueued")
+
+    def __init__(self, fn, args, kwargs, priority):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.future: Future = Future()
+        self.priority = priority
+        self.enqueued = time.monotonic()
+
+
+class DBExecutor:
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._queued = [0] * len(PRIORITIES)
+        self._running = 0
+        self._shed = [0] * len(PRIORITIES)
+        self._done = [0] * len(PRIORITIES)
+        self._wait_total = [0.0] * len(PRIORITIES)
+        self._wait_max = [0.0] * len(PRIORITIES)
+        self._service_avg = 0.5  # seconds, moving average; feeds Retry-After
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"db-executor-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _retry_after(self, ahead: int) -> int:
+        return max(1, math.ceil((ahead + 1) * self._service_avg / self.workers))
+
+    def _check(self, priority: int, jobs: int):
+        # under self._lock
+        ahead = sum(self._queued[:priority + 1])
+        if ahead + jobs > self.queue_limit:
+            self._shed[priority] += 1
+            raise Overloaded(priority, ahead, self._retry_after(ahead))
+
+    def admit(self, jobs: Dict[int, int]):
+        """Raises Overloaded unless jobs[p] more jobs of each priority p fit in the queue."""
+        with self._lock:
+            for p in sorted(jobs):
+                # a class is shed by what is queued at its own or a higher priority
+                self._check(p, sum(n for q, n in jobs.items() if q <= p))
+
+    def submit(self, fn: Callable, *args, priority: int = CUSTOM, admitted: bool = False, **kwargs) -> Future:
+        """
+        Queue fn(*args, **kwargs); raises Overloaded if too much is queued
+        ahead of it, unless its request was already `admitted`.
+        """
+        self._ensure_started()
+        with self._lock:
+            if not admitted:
+                self._check(priority, 1)
+            self._queued[priority] += 1
+        job = _Job(fn, args, kwargs, priority)
+        self._queue.put((priority, next(self._seq), job))
+        return job.future
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            waited = time.monotonic() - job.enqueued
+            p = job.priority
+            with self._lock:
+                self._queued[p] -= 1
+                self._done[p] += 1
+                self._wait_total[p] += waited
+                self._wait_max[p] = max(self._wait_max[p], waited)
+                self._running += 1
+            started = time.monotonic()
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._running -= 1
+                    self._service_avg = 0.9 * self._service_avg + 0.1 * elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "running": self._running,
+                "avg_service_seconds": round(self._service_avg, 4),
+                "classes": {
+                    name: {
+                        "queued": self._queued[i],
+                        "started": self._done[i],
+                        "shed": self._shed[i],
+                        "avg_wait_seconds": round(self._wait_total[i] / self._done[i], 4) if self._done[i] else 0.0,
+                        "max_wait_seconds": round(self._wait_max[i], 4),
+                    }
+                    for i, name in enumerate(PRIORITIES)
+                },
+            }
+
+
+executor = DBExecutor(settings.DB_POOL_SIZE, settings.DB_QUEUE_LIMIT)
+
+
+# (priority, statement timeout) of the async db_route being served; None outside one
+_route: contextvars.ContextVar[Optional[Tuple[int, float]]] = contextvars.ContextVar("db_route", default=None)
+
+
+# set once the current request is admitted: its jobs are queued without being shed
+_admitted: contextvars.ContextVar[bool] = contextvars.ContextVar("db_admitted", default=False)
+
+
+def current_route() -> Optional[Tuple[int, float]]:
+    return _route.get()
+
+
+def admit(*calls: Tuple[Callable, Dict[str, Any]]):
+    """
+    Admit a composite request once for all of its db_route calls, given as
+    (route, kwargs): the calls the preset store cannot answer must fit in
+    the queue together, else Overloaded is raised before any of them runs.
+    Afterwards the calls (and their queries) are not admitted again.
+    """
+    if _admitted.get():
+        return
+    jobs: Dict[int, int] = {}
+    for fn, kwargs in calls:
+        lookup = getattr(fn, "preset_lookup", None)
+        key, hit = lookup(**kwargs) if lookup else (None, None)
+        if hit is None:
+            p = LIVE if key is not None else CUSTOM
+            jobs[p] = jobs.get(p, 0) + 1
+    executor.admit(jobs)
+    _admitted.set(True)
+
+
+def _in_scope(priority: int, timeout: Optional[float], enqueued: float, fn: Callable, *args, **kwargs):
+    # runs on a worker inside the caller's copied context
+    scope = current_scope()
+    if scope is not None:
+        scope.check()  # the client left while the job was queued
+    statement_timeout.set(timeout)
+    waited = time.perf_counter() - enqueued
+    with span(f"job {getattr(fn, '__qualname__', fn)}", priority=PRIORITIES[priority],
+              queue_wait_ms=round(waited * 1000, 2)):
+        profile = current_profile()
+        if profile is None:
+            return fn(*args, **kwargs)
+        profile.add("queue_wait", waited)
+        with profile.on_thread(), profile.phase("worker"):
+            return fn(*args, **kwargs)
+
+
+def submit_scoped(fn: Callable, *args, priority: int, timeout: Optional[float], **kwargs) -> Future:
+    """
+    submit() carrying the caller's context (cancellation scope) and a
+    statement timeout; not shed when the caller's request was admitted.
+    """
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, _in_scope, priority, timeout, time.perf_counter(), fn, *args,
+                           priority=priority, admitted=_admitted.get(), **kwargs)
+
+
+def db_route(priority: Optional[int] = None, timeout: Optional[float] = None):
+    """
+    Admit a route to the DB executor. With no explicit priority, calls for
+    a rolling preset window (see precompute.preset_cached) are LIVE and are
+    answered straight from the preset store when it has them; anything else
+    is CUSTOM. A sync route runs on a worker; an async route runs on the
+    event loop and its aiodb calls are queued under the same class; the
+    route is admitted once, on entry, and its calls are never shed.
+
+    Preset-cached routes also fall back to the last good result of the
+    same call while the database fails or is slow (see stale.py).
+
+    timeout: statement timeout for the route's queries in seconds (0 = none);
+    defaults to the priority class's.
+    """
+    def decorator(fn: Callable):
+        lookup = getattr(fn, "preset_lookup", None)
+        call_key = getattr(fn, "call_key", None)
+        is_async = inspect.iscoroutinefunction(fn)
+
+        async def call(p: int, t: float, args, kwargs):
+            if not is_async:
+                with awaiting():
+                    return await asyncio.wrap_future(submit_scoped(fn, *args, priority=p, timeout=t, **kwargs))
+            if not _admitted.get():
+                executor.admit({p: 1})
+            token, admitted = _route.set((p, t)), _admitted.set(True)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _admitted.reset(admitted)
+                _route.reset(token)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key, hit = lookup(*args, **kwargs) if lookup else (None, None)
+            if hit is not None:
+                return hit
+            p = priority if priority is not None else (LIVE if key is not None else CUSTOM)
+            t = TIMEOUTS[p] if timeout is None else timeout
+            if call_key is None or p == EXPORT or not last_good.enabled:
+                return await call(p, t, args, kwargs)
+            # preset-cached reads fall back to their last good result (see stale.py)
+            return await last_good.serve(call_key(*args, **kwargs), lambda: call(p, t, args, kwargs), _UNAVAILABLE)
+
+        return wrapper
+    return decorator
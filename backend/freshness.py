@@ -0,0 +1,126 @@
+# server/app/freshness.py
+"""
+Freshness of the forecast data, tracked by one background poller.
+
+/meta/freshness used to run MAX(updated_at), COUNT(*) over the last day of
+the tokens table on every call. The tracker keeps the watermark
+(MAX(updated_at)), row counts per MoveDate_pred and the time the latest
+model run landed in memory. After a full load at startup (and once per
+local day) each poll only reads rows with updated_at past the watermark,
+which the updated_at projection on the tokens table (schema migration 3)
+serves cheaply.
+
+In-process subscribers are called when the watermark moves, instead of
+each polling the database themselves, in the order they subscribed: each
+module subscribes when it is imported, so after the modules it reads
+from. That is the latest-run table (merged first), then the registry and
+the cube, then the preset scheduler.
+"""
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.config import settings
+from backend.db import get_conn
+from backend.utils.timebox import now_local
+
+logger = logging.getLogger(__name__)
+
+# rows counted: MoveDate_pred from yesterday on (as /meta/freshness always reported)
+_WINDOW_DAYS = 1
+
+
+class FreshnessTracker:
+    def __init__(self, poll_seconds: int = settings.FRESHNESS_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[Any, Any], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.watermark: Optional[datetime] = None
+        self.landed_at: Optional[datetime] = None   # when this process saw the watermark move
+        self.checked_at: Optional[datetime] = None
+        self._day: Optional[date] = None            # local day of the last full load
+        self._counts: Dict[date, int] = {}
+
+    def subscribe(self, fn: Callable[[Any, Any], None]):
+        """Call fn(old_watermark, new_watermark) from the poller whenever the watermark moves."""
+        self._subscribers.append(fn)
+
+    def _fetch(self, since: date, watermark: Optional[datetime]):
+        delta = 'AND "updated_at" > ?' if watermark is not None else ""
+        q = f"""
+        SELECT "MoveDate_pred", COUNT(*), MAX("updated_at")
+        FROM {settings.VERTICA_TABLE_TOKENS}
+        WHERE "MoveDate_pred" >= ? {delta}
+        GROUP BY 1
+        """
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(q, [since] + ([watermark] if watermark is not None else []))
+            return cur.fetchall()
+
+    def poll(self) -> bool:
+        """Update from the database; returns True if the watermark moved."""
+        now = now_local()
+        since = now.date() - timedelta(days=_WINDOW_DAYS)
+        full = self._day != now.date()  # resync counts once a day
+        rows = self._fetch(since, None if full else self.watermark)
+
+        with self._lock:
+            old = self.watermark
+            counts = {} if full else {d: n for d, n in self._counts.items() if d >= since}
+            watermark = None if full else old
+            for d, n, upd in rows:
+                counts[d] = counts.get(d, 0) + int(n)
+                if upd is not None and (watermark is None or upd > watermark):
+                    watermark = upd
+            if full and watermark is None:
+                watermark = old
+            moved = watermark != old
+            if moved and old is not None:
+                self.landed_at = now
+            self._counts, self.watermark, self.checked_at = counts, watermark, now
+            self._day = now.date()
+
+        if moved:
+            logger.info(f"Tokens watermark moved: {old} -> {watermark}")
+            for fn in list(self._subscribers):
+                try:
+                    fn(old, watermark)
+                except Exception:
+                    logger.exception(f"Freshness subscriber {fn} failed")
+        return moved
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state, from memory; checked_at is None until the poller's first check."""
+        with self._lock:
+            return {
+                "updated_at": self.watermark,
+                "row_count_last_24h": sum(self._counts.values()),
+                "rows_by_day": dict(sorted(self._counts.items())),
+                "landed_at": self.landed_at,
+                "checked_at": self.checked_at,
+            }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="freshness-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Freshness poll failed")
+            self._stop.wait(self.poll_seconds)
+
+
+freshness = FreshnessTracker()
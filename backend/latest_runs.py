@@ -0,0 +1,245 @@
+# server/app/latest_runs.py
+"""
+Latest-run table: one row per (TerminalID, MoveType, Desig, MoveDate_pred,
+MoveHour_pred) holding the most recent model run's prediction, already
+normalized (MoveType IN|OUT|UNK, Desig EMPTY|FULL|EXP|UNK, plus their
+integer codes) and clamped.
+
+Without it every query deduplicates with
+ROW_NUMBER() OVER (PARTITION BY ... ORDER BY updated_at DESC) over its
+whole window. `refresh()` MERGEs only the rows newer than the table's own
+watermark, so the window function runs once per model run over the delta
+instead of once per request over the window. Readers go through
+`latest_cte()`, which reads the table when it is available and falls back
+to the per-query dedup otherwise.
+
+The table and its projections are created by backend/schema.py. Run
+`python -m backend.latest_runs` from cron / the ETL (or POST /meta/refresh)
+to refresh it out of band; the API also refreshes it whenever the
+freshness tracker sees a new model run (LATEST_REFRESH_IN_PROCESS).
+"""
+import logging
+import threading
+
+from backend.config import settings
+from backend.db import get_conn
+from backend import codes, schema
+from backend.codes import (MOVE_TYPE_CODE_SQL, DESIG_CODE_SQL,
+                           MOVE_TYPE_NAME_SQL, DESIG_NAME_SQL)
+from backend.data_quality import telemetry
+from backend.freshness import freshness
+
+logger = logging.getLogger(__name__)
+
+# Normalization to codes and clamping, shared by the per-query dedup and the
+# MERGE source: the only place raw MoveType/Desig strings are looked at
+_NORMALIZED_COLUMNS = f"""
+        "TerminalID",
+        {MOVE_TYPE_CODE_SQL} AS move_type_code,
+        {DESIG_CODE_SQL} AS desig_code,
+        "MoveDate_pred",
+        "MoveHour_pred",
+        TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) AS ts_pred,
+        GREATEST(0.0, "TokenCount_pred"::FLOAT) AS pred,  -- Clamp negative to 0
+        "updated_at"
+"""
+
+_PARTITION = '"TerminalID", move_type_code, desig_code, "MoveDate_pred", "MoveHour_pred"'
+
+_available = False
+_lock = threading.Lock()
+
+
+def _split(table: str):
+    schema, _, name = table.rpartition(".")
+    return schema or "public", name
+
+
+def table_exists(conn) -> bool:
+    schema, name = _split(settings.VERTICA_TABLE_LATEST)
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT COUNT(*) FROM v_catalog.tables WHERE table_schema ILIKE ? AND table_name ILIKE ?",
+        [schema, name],
+    )
+    return bool(cur.fetchone()[0])
+
+
+def available() -> bool:
+    """True once the latest-run table is known to exist and be populated."""
+    return _available
+
+
+def _populated(conn) -> bool:
+    cur = conn.cursor()
+    cur.execute(f"SELECT 1 FROM {settings.VERTICA_TABLE_LATEST} LIMIT 1")
+    return cur.fetchone() is not None
+
+
+def detect():
+    """
+    Check for an existing, populated latest-run table (e.g. built by a cron
+    job). An empty one, as created by a schema migration run elsewhere
+    (the capacity poller migrates too), does not count: it is switched to
+    after its first merge.
+    """
+    global _available
+    with get_conn() as conn:
+        _available = table_exists(conn) and _populated(conn)
+    logger.info(f"Latest-run table {settings.VERTICA_TABLE_LATEST} available: {_available}")
+    return _available
+
+
+def refresh() -> int:
+    """
+    Bring the latest-run table up to date with the tokens table.
+
+    Only source rows with updated_at past the table's watermark are read;
+    they are deduplicated among themselves and MERGEd by partition key, so
+    a newer run replaces the stored row. Returns the number of rows merged.
+    """
+    global _available
+    with _lock, get_conn() as conn:
+        schema.migrate(conn)
+        cur = conn.cursor()
+        cur.execute(f'SELECT MAX("updated_at") FROM {settings.VERTICA_TABLE_LATEST}')
+        watermark = cur.fetchone()[0]
+        delta_filter = 'WHERE "updated_at" > ?' if watermark is not None else ""
+        params = [watermark] if watermark is not None else []
+        cur.execute(f"""
+        MERGE INTO {settings.VERTICA_TABLE_LATEST} tgt
+        USING (
+          SELECT {_PARTITION}, ts_pred, pred, "updated_at",
+                 {MOVE_TYPE_NAME_SQL} AS "MoveType",
+                 {DESIG_NAME_SQL} AS "Desig"
+          FROM (
+            SELECT d.*,
+                   ROW_NUMBER() OVER (PARTITION BY {_PARTITION} ORDER BY "updated_at" DESC) AS rn
+            FROM (
+              SELECT {_NORMALIZED_COLUMNS}
+              FROM {settings.VERTICA_TABLE_TOKENS}
+              {delta_filter}
+            ) d
+          ) ranked
+          WHERE rn = 1
+        ) src
+        ON  tgt."TerminalID" = src."TerminalID"
+        AND tgt.move_type_code = src.move_type_code
+        AND tgt.desig_code = src.desig_code
+        AND tgt."MoveDate_pred" = src."MoveDate_pred"
+        AND tgt."MoveHour_pred" = src."MoveHour_pred"
+        WHEN MATCHED THEN UPDATE SET pred = src.pred, "updated_at" = src."updated_at"
+        WHEN NOT MATCHED THEN INSERT
+          ("TerminalID", "MoveType", "Desig", move_type_code, desig_code,
+           "MoveDate_pred", "MoveHour_pred", ts_pred, pred, "updated_at")
+          VALUES (src."TerminalID", src."MoveType", src."Desig", src.move_type_code, src.desig_code,
+                  src."MoveDate_pred", src."MoveHour_pred", src.ts_pred, src.pred, src."updated_at")
+        """, params)
+        row = cur.fetchone()  # Vertica reports DML as a one-row OUTPUT count
+        merged = int(row[0]) if row else 0
+        try:
+            _record_ingest_anomalies(cur, delta_filter, params)
+        except Exception:
+            logger.exception("Could not collect ingest data-quality counters")
+    _available = True
+    logger.info(f"Latest-run table refreshed: {merged} rows merged since {watermark}")
+    return merged
+
+
+def _canonical(names) -> str:
+    return ", ".join(f"'{n}'" for n in names if n != names[codes.UNK])
+
+
+def _record_ingest_anomalies(cur, delta_filter: str, params: list):
+    """
+    Count what the MERGE just normalized away (non-canonical or unknown
+    MoveType/Desig spellings, negative predictions) into the data-quality
+    telemetry, over the same delta.
+    """
+    where = delta_filter or "WHERE TRUE"
+    tokens = settings.VERTICA_TABLE_TOKENS
+    cur.execute(f"""
+    SELECT 'move_type', "MoveType", COUNT(*) FROM {tokens} {where}
+      AND ("MoveType" IS NULL OR UPPER(TRIM("MoveType")) NOT IN ({_canonical(codes.MOVE_TYPES)}))
+    GROUP BY 2
+    UNION ALL
+    SELECT 'desig', "Desig", COUNT(*) FROM {tokens} {where}
+      AND ("Desig" IS NULL OR UPPER(TRIM("Desig")) NOT IN ({_canonical(codes.DESIGS)}))
+    GROUP BY 2
+    UNION ALL
+    SELECT 'pred', '<0', COUNT(*) FROM {tokens} {where}
+      AND "TokenCount_pred" < 0
+    """, params * 3)
+    for column, raw, n in cur.fetchall():
+        if column == "pred":
+            telemetry.record("ingest", "negative_pred", raw, n=int(n), detail="; clamped to 0")
+            continue
+        to_code = codes.move_type_code if column == "move_type" else codes.desig_code
+        if to_code(raw) == codes.UNK:
+            telemetry.record("ingest", f"{column}_unknown", raw, n=int(n), detail="; stored as UNK")
+        else:
+            telemetry.record("ingest", f"{column}_normalized", raw, n=int(n), level=logging.INFO)
+
+
+def latest_cte(terminal_filter: str = "", filters: str = "") -> str:
+    """
+    Returns a CTE named `latest` with one row per (TerminalID, MoveType, Desig,
+    date, hour) in the window [?, ?): the winning model run, clamped, with
+    MoveType/Desig as codes (see codes.py). Columns: "TerminalID",
+    move_type_code, desig_code, "MoveDate_pred", "MoveHour_pred", ts_pred,
+    pred, "updated_at".
+
+    terminal_filter: predicate on "TerminalID" (pushed into the scan)
+    filters:         predicates on move_type_code / desig_code
+    Parameters bind in order: start, end, terminal_filter's, filters'.
+
+    NOTE: This returns just the CTE definition, not a complete query.
+    """
+    if _available:
+        return f"""
+    WITH latest AS (
+      SELECT "TerminalID", move_type_code, desig_code, "MoveDate_pred", "MoveHour_pred",
+             ts_pred, pred, "updated_at"
+      FROM {settings.VERTICA_TABLE_LATEST}
+      WHERE ts_pred >= ? AND ts_pred < ?
+        {terminal_filter}
+        {filters}
+    )"""
+    return f"""
+    WITH base AS (
+      SELECT {_NORMALIZED_COLUMNS}
+      FROM {settings.VERTICA_TABLE_TOKENS}
+      WHERE TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) >= ?
+        AND TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) < ?
+        {terminal_filter}
+    ),
+    dedup AS (
+      SELECT
+        b.*,
+        ROW_NUMBER() OVER (
+          PARTITION BY {_PARTITION}
+          ORDER BY "updated_at" DESC
+        ) AS rn
+      FROM base b
+    ),
+    latest AS (
+      SELECT * FROM dedup WHERE rn = 1 {filters}
+    )"""
+
+
+def _on_new_run(old, new):
+    if settings.LATEST_REFRESH_IN_PROCESS:
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Latest-run table refresh failed; queries keep the per-query dedup")
+
+
+# subscribed before the registry and the cube (which import this module), so
+# they reload from the merged table
+freshness.subscribe(_on_new_run)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    refresh()
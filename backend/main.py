@@ -1,7 +1,20 @@
 # server/app/main.py
-from fastapi import FastAPI
-from .routers import forecast, meta, capacity, analytics
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from .routers import forecast, meta, capacity, analytics, export, diagnostics
 from fastapi.middleware.cors import CORSMiddleware
+from .config import settings
+from .precompute import scheduler
+from .freshness import freshness
+from .capacity import capacities
+from .registry import registry
+from .executor import Overloaded
+from .cancellation import CancelOnDisconnect, RequestCancelled, current_scope
+from .profiling import ProfileRequests, instrument_routes
+from .diagnostics import sampler
+from .tracing import TraceRequests
+from .saturation import monitor
+from vertica_python.errors import QueryCanceled
 
 app = FastAPI(title="Gate Tokens Forecast API", version="1.0")
 
@@ -13,10 +26,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# cancels in-flight Vertica statements when the client goes away
+app.add_middleware(CancelOnDisconnect)
+# ?profile=1 with the admin token: timing breakdown and stack samples (see backend/profiling.py)
+app.add_middleware(ProfileRequests)
+# TRACING_ENABLED: one trace of spans per request (see backend/tracing.py)
+app.add_middleware(TraceRequests)
+
 app.include_router(forecast.router)
 app.include_router(meta.router)
 app.include_router(capacity.router)
 app.include_router(analytics.router)
+app.include_router(export.router)
+app.include_router(diagnostics.router)
+instrument_routes(app)
+
+@app.exception_handler(Overloaded)
+async def shed_request(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"detail": f"Server busy: {exc}"},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(RequestCancelled)
+async def client_gone(request: Request, exc: RequestCancelled):
+    # nobody is listening; 499 is what nginx logs for this
+    return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+
+@app.exception_handler(QueryCanceled)
+async def statement_timeout(request: Request, exc: QueryCanceled):
+    scope = current_scope()
+    if scope is not None and scope.cancelled:
+        return await client_gone(request, RequestCancelled())
+    return JSONResponse(status_code=504, content={"detail": "Query exceeded its statement timeout"})
+
+@app.on_event("startup")
+def start_background_jobs():
+    registry.load()
+    sampler.start()
+    monitor.start()
+    freshness.start()
+    capacities.start()
+    if settings.PRECOMPUTE_ENABLED:
+        scheduler.start()
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    scheduler.stop()
+    capacities.stop()
+    freshness.stop()
+    sampler.stop()
+    monitor.stop()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,301 @@
+# server/app/precompute.py
+"""
+Background pre-computation of the rolling dashboard presets.
+
+The control-room screens only ever look at two windows:
+  - next8h: [current hour, current hour + 8h)
+  - today:  [00:00, 23:00] of the current local day
+
+Both roll forward on the hour. The scheduler below recomputes every
+registered endpoint for those windows (for every terminal / filter
+combination) at each hour boundary and whenever a new model run lands,
+so the first request after the roll is served straight from memory.
+"""
+import asyncio
+import functools
+import inspect
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic.fields import FieldInfo
+
+from backend.config import settings
+# the cube (and through it the registry and the latest-run table) subscribes
+# to the freshness tracker on import, ahead of the scheduler below
+from backend import cube  # noqa: F401
+from backend.registry import registry
+from backend.stale import last_good
+from backend.freshness import freshness
+from backend.utils.timebox import now_local, TZ
+
+logger = logging.getLogger(__name__)
+
+# (endpoint, window, filters) -> computed response
+_STORE: Dict[Tuple, Any] = {}
+_LOCK = threading.Lock()
+# bumped whenever refresh_all swaps in a fresh store; a request that started
+# before the swap may have read older data and does not store its result
+_GENERATION = 0
+
+# endpoint name -> (raw function, preset names it is computed for)
+_ENDPOINTS: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+
+# filter values the scheduler enumerates (None = "ALL"); every other
+# parameter is left at its default
+_MOVE_TYPES = [None, "IN", "OUT"]
+_DESIGS = [None, "EMPTY", "FULL", "EXP"]
+_DIMS = ["desig", "movetype"]
+
+
+def preset_windows(now: Optional[datetime] = None) -> Dict[str, Tuple[datetime, datetime]]:
+    """Current [start, end) bounds of the rolling presets, as the dashboard requests them."""
+    now = (now or now_local()).astimezone(TZ)
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    midnight = hour.replace(hour=0)
+    return {
+        "next8h": (hour, hour + timedelta(hours=8)),
+        "today": (midnight, midnight + timedelta(hours=23)),
+    }
+
+
+def _parse_hour(s: str) -> datetime:
+    # same truncation as analytics.parse_local_dt
+    dt = datetime.fromisoformat(s)
+    dt = dt.replace(tzinfo=TZ) if dt.tzinfo is None else dt.astimezone(TZ)
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _canon(name: str, value: Any) -> Any:
+    if value is None or isinstance(value, FieldInfo):
+        return None  # not provided (None or an unresolved Query() default)
+    if not isinstance(value, str):
+        return value
+    v = value.strip()
+    if name == "dim":
+        return v.lower()
+    v = v.upper()
+    return None if v in {"", "ALL", "ANY"} else v
+
+
+def call_key(name: str, presets: Tuple[str, ...], args: Dict[str, Any]) -> Optional[Tuple]:
+    """(endpoint, window, filters) of a call, for any window; None when the bounds do not parse."""
+    if "start_iso" in args:
+        try:
+            window = (_parse_hour(args["start_iso"]), _parse_hour(args["end_iso"]))
+        except (TypeError, ValueError):
+            return None
+    else:
+        # endpoints without explicit bounds (next8h) imply their preset window
+        window = preset_windows()[presets[0]]
+    filters = tuple((p, _canon(p, v)) for p, v in sorted(args.items())
+                    if p not in ("start_iso", "end_iso"))
+    return (name, window, filters)
+
+
+def _cache_key(name: str, presets: Tuple[str, ...], args: Dict[str, Any]) -> Optional[Tuple]:
+    """Cache key for a call, or None when the call is not for a current preset window."""
+    key = call_key(name, presets, args)
+    if key is None or ("start_iso" in args and key[1] not in [preset_windows()[p] for p in presets]):
+        return None
+    return key
+
+
+def preset_cached(*presets: str):
+    """
+    Serve an endpoint from the preset store when it is called for one of
+    the given rolling windows; any other window falls through to the
+    endpoint itself. Decorated endpoints are recomputed by the scheduler;
+    a request that computes a preset itself stores the result only if no
+    refresh finished while it ran.
+
+    The wrapper's `preset_lookup(*args, **kwargs)` returns (cache key or
+    None, stored response or None) without computing anything, and its
+    `call_key(*args, **kwargs)` the key of the call whatever the window
+    (what stale.last_good keeps results under). Works on sync and async
+    endpoints alike.
+    """
+    def decorator(fn: Callable):
+        name = f"{fn.__module__}.{fn.__name__}"
+        sig = inspect.signature(fn)
+        _ENDPOINTS[name] = (fn, presets)
+
+        def arguments(args, kwargs) -> Dict[str, Any]:
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return bound.arguments
+
+        def lookup(*args, **kwargs):
+            key = _cache_key(name, presets, arguments(args, kwargs))
+            if key is None:
+                return None, None
+            with _LOCK:
+                return key, _STORE.get(key)
+
+        def store(key, result, generation: int):
+            with _LOCK:
+                if generation != _GENERATION:
+                    return result  # superseded by a refresh that finished meanwhile
+                _STORE[key] = result
+            last_good.put(key, result)
+            return result
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                key, hit = lookup(*args, **kwargs)
+                if key is None:
+                    return await fn(*args, **kwargs)
+                if hit is not None:
+                    return hit
+                generation = _GENERATION
+                return store(key, await fn(*args, **kwargs), generation)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key, hit = lookup(*args, **kwargs)
+                if key is None:
+                    return fn(*args, **kwargs)
+                if hit is not None:
+                    return hit
+                generation = _GENERATION
+                return store(key, fn(*args, **kwargs), generation)
+
+        wrapper.preset_lookup = lookup
+        wrapper.call_key = lambda *args, **kwargs: call_key(name, presets, arguments(args, kwargs))
+        return wrapper
+    return decorator
+
+
+def _with_defaults(fn: Callable, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """kwargs plus every omitted parameter at its default, as FastAPI would call `fn`."""
+    out = {}
+    for p in inspect.signature(fn).parameters.values():
+        v = kwargs.get(p.name, p.default)
+        out[p.name] = v.default if isinstance(v, FieldInfo) else v
+    return out
+
+
+def _combinations(fn: Callable, terminals: List[str]):
+    """Every filter combination the dashboard can request from `fn`."""
+    params = inspect.signature(fn).parameters
+    axes: List[Tuple[str, list]] = []
+    if "terminal_id" in params:
+        required = params["terminal_id"].default is inspect.Parameter.empty
+        axes.append(("terminal_id", list(terminals) if required else [None] + list(terminals)))
+    if "move_type" in params:
+        axes.append(("move_type", _MOVE_TYPES))
+    if "desig" in params:
+        axes.append(("desig", _DESIGS))
+    if "dim" in params:
+        axes.append(("dim", _DIMS))
+    names = [a[0] for a in axes]
+    for values in itertools.product(*[a[1] for a in axes]):
+        yield dict(zip(names, values))
+
+
+def refresh_all() -> int:
+    """Recompute every registered endpoint for the current preset windows."""
+    global _GENERATION
+    windows = preset_windows()
+    terminals = registry.terminals()
+    # async endpoints run on a private loop; their aiodb calls run inline on this thread
+    loop = asyncio.new_event_loop()
+    try:
+        fresh = _compute(loop, windows, terminals)
+    finally:
+        loop.close()
+    with _LOCK:
+        _STORE.clear()
+        _STORE.update(fresh)
+        _GENERATION += 1
+    logger.info(f"Pre-computed {len(fresh)} preset responses for {list(windows)}")
+    return len(fresh)
+
+
+def _compute(loop: asyncio.AbstractEventLoop, windows: Dict[str, Tuple[datetime, datetime]],
+             terminals: List[str]) -> Dict[Tuple, Any]:
+    fresh: Dict[Tuple, Any] = {}
+    for name, (fn, presets) in _ENDPOINTS.items():
+        is_async = inspect.iscoroutinefunction(fn)
+        takes_bounds = "start_iso" in inspect.signature(fn).parameters
+        for preset in presets if takes_bounds else presets[:1]:
+            start, end = windows[preset]
+            for combo in _combinations(fn, terminals):
+                kwargs = dict(combo)
+                if takes_bounds:
+                    kwargs.update(start_iso=start.isoformat(), end_iso=end.isoformat())
+                kwargs = _with_defaults(fn, kwargs)
+                key = _cache_key(name, presets, kwargs)
+                if key is None:
+                    continue  # the hour rolled mid-refresh; the next tick catches up
+                try:
+                    fresh[key] = loop.run_until_complete(fn(**kwargs)) if is_async else fn(**kwargs)
+                except Exception:
+                    # requests for it fall back to the last good result (see stale.py)
+                    logger.exception(f"Preset refresh failed for {name} {preset} {combo}")
+                    continue
+                last_good.put(key, fresh[key])
+    return fresh
+
+
+class PresetScheduler:
+    """
+    Daemon thread that keeps the preset store current.
+
+    Wakes at every hour boundary, every PRECOMPUTE_POLL_SECONDS and when
+    the freshness tracker reports a new watermark; a refresh runs when the
+    hour rolled or the watermark moved, i.e. a new model run landed. By
+    then the tracker's other subscribers have merged the run into the
+    latest-run table, dropped the cube and reloaded the registry.
+    """
+
+    def __init__(self, poll_seconds: int = settings.PRECOMPUTE_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._hour: Optional[datetime] = None
+        self._watermark = None
+        freshness.subscribe(lambda old, new: self.trigger())
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="preset-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self):
+        """Run a tick now instead of at the next poll (e.g. the ETL just loaded a run)."""
+        self._wake.set()
+
+    def _seconds_to_next_tick(self) -> float:
+        now = now_local()
+        next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        return max(1.0, min(self.poll_seconds, (next_hour - now).total_seconds()))
+
+    def tick(self):
+        hour = now_local().replace(minute=0, second=0, microsecond=0)
+        watermark = freshness.watermark
+        if hour != self._hour or watermark != self._watermark:
+            refresh_all()
+            self._hour, self._watermark = hour, watermark
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Preset scheduler tick failed")
+            self._wake.wait(self._seconds_to_next_tick())
+            self._wake.clear()
+
+
+scheduler = PresetScheduler()
@@ -0,0 +1,366 @@
+# server/app/profiling.py
+"""
+On-demand profiling of single requests.
+
+An admin adds ?profile=1 (or the header X-Profile: 1) together with a
+valid X-Admin-Token to any API request. That request then
+
+  - times its phases: executor queue wait, connection wait, SQL execute,
+    fetch, the rest of the DB workers' time (cube fills, lock waits), the
+    endpoint's own Python on the event loop (its run time minus the time
+    it awaited the database) and response serialization;
+  - is sampled every PROFILE_SAMPLE_INTERVAL_MS: the stacks of the threads
+    working for it (the event loop and the executor workers while they run
+    its jobs) are counted as folded stacks, the input of flamegraph.pl and
+    speedscope.
+
+The response itself is unchanged apart from a Server-Timing header (shown
+by the browser's devtools) and X-Profile-Id; the last PROFILE_KEEP
+profiles are kept in memory for GET /meta/profiles/{id}. Without the flag
+a request pays one context variable lookup per instrumented call.
+
+DB phases are summed over a request's calls, so with concurrent queries
+(the dashboard's panels) they can add up to more than the wall time.
+"""
+import asyncio
+import collections
+import contextvars
+import functools
+import itertools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from fastapi.routing import APIRoute
+
+from backend.auth import admin_token_valid
+from backend.config import settings
+from backend.saturation import inflight
+from backend.tracing import endpoint_done, span
+from backend.utils.timebox import TZ
+
+_ids = itertools.count(1)
+
+
+def fold(frame, lines: bool = True) -> str:
+    """A thread's stack as one folded line, root first: module.function[:line];..."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+        names.append(f"{name}:{frame.f_lineno}" if lines else name)
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = next(_ids)
+        self.method, self.path = method, path
+        self.started_at = datetime.now(TZ)
+        self.status: Optional[int] = None
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.phases: Dict[str, float] = collections.defaultdict(float)
+        self.calls: Dict[str, int] = collections.Counter()
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self._threads: Dict[int, int] = collections.Counter()  # ident -> nesting
+        self._awaiting = 0
+        self._await_from = 0.0
+        self.endpoint_done: Optional[float] = None
+        self.response_started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] += seconds
+            self.calls[phase] += 1
+
+    @contextmanager
+    def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    @contextmanager
+    def on_thread(self):
+        """Sample the calling thread while the block runs."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    @contextmanager
+    def awaiting(self):
+        # event loop only: the union of the intervals the endpoint awaited the database
+        if not self._awaiting:
+            self._await_from = time.perf_counter()
+        self._awaiting += 1
+        try:
+            yield
+        finally:
+            self._awaiting -= 1
+            if not self._awaiting:
+                self.add("awaiting_db", time.perf_counter() - self._await_from)
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            idents = list(self._threads)
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = [f"{names.get(i, i)};{fold(frames[i])}" for i in idents if i in frames]
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                self.stacks[stack] += 1
+
+    def _elapsed(self, t: Optional[float]) -> Optional[float]:
+        return None if t is None else t - self._t0
+
+    def breakdown(self) -> Dict[str, Any]:
+        with self._lock:
+            phases = dict(self.phases)
+            calls = dict(self.calls)
+        endpoint = self._elapsed(self.endpoint_done)
+        awaited = phases.get("awaiting_db", 0.0)
+        db = {k: phases.get(k, 0.0) for k in ("queue_wait", "connection_wait", "sql", "fetch")}
+        worker = phases.get("worker", 0.0)
+        return {
+            "total_ms": _ms(self._elapsed(self.finished)),
+            "endpoint_ms": _ms(endpoint),
+            "router_python_ms": _ms(None if endpoint is None else max(endpoint - awaited, 0.0)),
+            "awaiting_db_ms": _ms(awaited),
+            "serialize_ms": _ms(None if endpoint is None or self.response_started is None
+                                else self.response_started - self.endpoint_done),
+            "db": {
+                **{f"{k}_ms": _ms(v) for k, v in db.items()},
+                "worker_other_ms": _ms(max(worker - db["connection_wait"] - db["sql"] - db["fetch"], 0.0)),
+                "jobs": calls.get("worker", 0),
+                "statements": calls.get("sql", 0),
+            },
+        }
+
+    def server_timing(self) -> str:
+        b = self.breakdown()
+        parts = [("endpoint", b["endpoint_ms"]), ("app", b["router_python_ms"]),
+                 ("db", b["awaiting_db_ms"]), ("sql", b["db"]["sql_ms"]), ("fetch", b["db"]["fetch_ms"]),
+                 ("serialize", b["serialize_ms"])]
+        return ", ".join(f"{name};dur={ms}" for name, ms in parts if ms is not None)
+
+    def folded(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            **self.breakdown(),
+            "samples": self.samples,
+            "sample_interval_ms": settings.PROFILE_SAMPLE_INTERVAL_MS,
+        }
+
+
+class ProfileStore:
+    """The last `keep` request profiles."""
+
+    def __init__(self, keep: int = settings.PROFILE_KEEP):
+        self._profiles: Deque[RequestProfile] = collections.deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id: int) -> Optional[RequestProfile]:
+        with self._lock:
+            return next((p for p in self._profiles if p.id == profile_id), None)
+
+    def recent(self) -> List[RequestProfile]:
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+profiles = ProfileStore()
+
+_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("request_profile", default=None)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _profile.get()
+
+
+@contextmanager
+def phase(name: str):
+    """Time the block as `name` when the current request is profiled."""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.phase(name):
+        yield
+
+
+@contextmanager
+def awaiting():
+    """Mark an await on database work (on the event loop) when the current request is profiled."""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.awaiting():
+        yield
+
+
+class _ProfiledCursor:
+    def __init__(self, cur, profile: RequestProfile):
+        self._cur, self._profile = cur, profile
+
+    def execute(self, *args, **kwargs):
+        with self._profile.phase("sql"):
+            return self._cur.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        with self._profile.phase("sql"):
+            return self._cur.executemany(*args, **kwargs)
+
+    def fetchone(self):
+        with self._profile.phase("fetch"):
+            return self._cur.fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with self._profile.phase("fetch"):
+            return self._cur.fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with self._profile.phase("fetch"):
+            return self._cur.fetchall()
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class ProfiledConnection:
+    """A connection whose cursors time execute (sql) and fetch* (fetch) calls."""
+
+    def __init__(self, conn, profile: RequestProfile):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_profile", profile)
+
+    def cursor(self, *args, **kwargs):
+        return _ProfiledCursor(self._conn.cursor(*args, **kwargs), self._profile)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)  # e.g. autocommit
+
+
+def _timed_endpoint(call, route: str):
+    # records when the endpoint returns (what follows is serialization), runs
+    # it as the "endpoint" span of a traced request and counts it in flight
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(*args, **kwargs):
+            profile = _profile.get()
+            with inflight.track(route), span("endpoint"):
+                try:
+                    return await call(*args, **kwargs)
+                finally:
+                    if profile is not None:
+                        profile.endpoint_done = time.perf_counter()
+                    endpoint_done()
+        return endpoint
+
+    @functools.wraps(call)
+    def sync_endpoint(*args, **kwargs):
+        # sync endpoints run on Starlette's thread pool
+        profile = _profile.get()
+        with inflight.track(route), span("endpoint"):
+            try:
+                if profile is None:
+                    return call(*args, **kwargs)
+                with profile.on_thread():
+                    return call(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.endpoint_done = time.perf_counter()
+                endpoint_done()
+    return sync_endpoint
+
+
+def instrument_routes(app):
+    """Instrument every API route's endpoint call; call once the routers are included."""
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.dependant.call is not None:
+            route.dependant.call = _timed_endpoint(route.dependant.call, route.path)
+
+
+def _requested(scope) -> bool:
+    headers = dict(scope.get("headers") or [])
+    flag = headers.get(b"x-profile", b"").decode() == "1" or \
+        parse_qs(scope.get("query_string", b"").decode()).get("profile", [""])[-1] == "1"
+    return flag and admin_token_valid(headers.get(b"x-admin-token", b"").decode() or None)
+
+
+def _sample(profile: RequestProfile, stop: threading.Event):
+    interval = settings.PROFILE_SAMPLE_INTERVAL_MS / 1000
+    while not stop.wait(interval):
+        profile.sample()
+
+
+class ProfileRequests:
+    """ASGI middleware: profiles requests that ask for it (see the module docstring)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            return await self.app(scope, receive, send)
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = _profile.set(profile)
+        stop = threading.Event()
+        sampler = threading.Thread(target=_sample, args=(profile, stop), name="request-profiler", daemon=True)
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                profile.response_started = time.perf_counter()
+                profile.status = message["status"]
+                message = {**message, "headers": [
+                    *message.get("headers", []),
+                    (b"server-timing", profile.server_timing().encode()),
+                    (b"x-profile-id", str(profile.id).encode()),
+                ]}
+            await send(message)
+
+        with profile.on_thread():
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_timed)
+            finally:
+                stop.set()
+                profile.finished = time.perf_counter()
+                _profile.reset(token)
+                profiles.add(profile)
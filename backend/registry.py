@@ -0,0 +1,123 @@
+# server/app/registry.py
+"""
+In-memory registry of the terminals (and MoveType/Desig codes) present in
+the forecast data.
+
+/meta/enums and the preset scheduler used to run
+SELECT DISTINCT TerminalID over the whole tokens table on every call. The
+registry is loaded once by the startup hook (main.py) and refreshed in the
+background when the freshness tracker sees a new model run, so
+enum lookups are memory reads; reads never query, and return nothing until
+the first load has succeeded.
+
+It is also the dictionary encoding for terminals in the in-memory
+structures: the cube keys its cells by a small integer per terminal.
+Codes are assigned on first sight and never reused within the process.
+"""
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from backend.config import settings
+from backend.db import get_conn
+from backend import codes, latest_runs
+from backend.freshness import freshness
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = -1  # lookup() result for a terminal that has never been seen
+
+
+class TerminalRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._terminals: List[str] = []     # present in the data at last refresh
+        self._move_types: List[str] = []
+        self._desigs: List[str] = []
+        self.loaded = False
+
+    def code(self, terminal: str) -> int:
+        """Code for `terminal`, assigning a new one if it has not been seen."""
+        c = self._codes.get(terminal)
+        if c is None:
+            with self._lock:
+                c = self._codes.get(terminal)
+                if c is None:
+                    c = self._codes[terminal] = len(self._names)
+                    self._names.append(terminal)
+        return c
+
+    def lookup(self, terminal: str) -> int:
+        """Code for `terminal`, or UNKNOWN (matches no cell) if it was never seen."""
+        return self._codes.get(terminal, UNKNOWN)
+
+    def name(self, code: int) -> str:
+        return self._names[code]
+
+    def _query(self) -> str:
+        # the latest-run table has one row per cell and a terminal-first
+        # projection; the tokens fallback is only hit before it exists
+        if latest_runs.available():
+            return f"""
+            SELECT DISTINCT "TerminalID", move_type_code, desig_code
+            FROM {settings.VERTICA_TABLE_LATEST}
+            """
+        return f"""
+        SELECT DISTINCT "TerminalID", {codes.MOVE_TYPE_CODE_SQL}, {codes.DESIG_CODE_SQL}
+        FROM {settings.VERTICA_TABLE_TOKENS}
+        """
+
+    def refresh(self):
+        """Reload the terminals and codes present in the data."""
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(self._query())
+            rows = cur.fetchall()
+        terminals = sorted({str(t) for t, _, _ in rows})
+        for t in terminals:
+            self.code(t)
+        self._terminals = terminals
+        self._move_types = [codes.MOVE_TYPES[c] for c in sorted({int(mt) for _, mt, _ in rows})]
+        self._desigs = [codes.DESIGS[c] for c in sorted({int(dg) for _, _, dg in rows})]
+        self.loaded = True
+        logger.info(f"Registry refreshed: {len(terminals)} terminals")
+
+    def load(self):
+        """Initial load, from the startup hook; if it fails the next refresh fills the registry."""
+        try:
+            latest_runs.detect()  # read the latest-run table rather than scan the tokens table
+        except Exception:
+            logger.exception("Could not check for the latest-run table")
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Registry load failed; terminals stay empty until the next refresh")
+
+    def terminals(self) -> List[str]:
+        return list(self._terminals)
+
+    def observed(self) -> Dict[str, List[str]]:
+        """MoveType/Desig values present in the data (UNK = unrecognized at ingest)."""
+        return {"move_types": list(self._move_types), "desigs": list(self._desigs)}
+
+
+registry = TerminalRegistry()
+
+
+def _on_new_run(old, new):
+    try:
+        registry.refresh()
+    except Exception:
+        logger.exception("Registry refresh failed; keeping the previous terminals")
+
+
+freshness.subscribe(_on_new_run)
+
+
+def terminal_filter(terminal_id: Optional[str]) -> Optional[int]:
+    """Request terminal filter -> code; None for no filter ("ALL", empty)."""
+    if not terminal_id or terminal_id.strip().upper() in {"ALL", "ANY"}:
+        return None
+    return registry.lookup(terminal_id)
@@ -1,91 +1,50 @@
 from fastapi import APIRouter, HTTPException
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
+import asyncio
 import zoneinfo
 import logging
 
-from ..db import get_conn
+import numpy as np
+
 from ..config import settings
-from .forecast import norm_move_type, norm_desig  # reuse normalizers
+from ..cube import cube, CellKey, choose_resolution
+from ..precompute import preset_cached
+from ..executor import admit, db_route
+from ..data_quality import telemetry
+from ..registry import registry, terminal_filter
+from ..capacity import capacities
+from ..schemas import CapacityScenario, WhatIfRequest
+from ..whatif import capacity_tensor, simulate
+from .. import aiodb, codes, stale
+from ..codes import MOVE_TYPES, DESIGS
 
 # Configure logger for data quality monitoring
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 TZ = zoneinfo.ZoneInfo(settings.DEFAULT_TIMEZONE)
+_IN, _OUT = MOVE_TYPES.index("IN"), MOVE_TYPES.index("OUT")
 
 # Data Quality Controls
-def validate_prediction(pred: float, context: str = "") -> float:
-    """
-    Validate and normalize prediction values.
-    - Ensures pred >= 0 (clamps negative values to 0 and logs)
-    - Returns rounded value for consistency
-    """
-    if pred is None:
-        return 0.0
-    
-    original_pred = pred
-    pred = float(pred)
-    
-    # Check for negative predictions
-    if pred < 0:
-        logger.warning(f"Negative prediction detected: {original_pred} in {context}. Clamping to 0.")
-        pred = 0.0
-    
-    # Apply consistent rounding policy (1 decimal place)
-    return round(pred, 1)
+# Anomalies are counted per (endpoint, kind, value) by the telemetry module,
+# which also rate-limits the log lines; see GET /meta/data_quality
+def _endpoint(context: str) -> str:
+    return context.split(":", 1)[0] or "analytics"
 
-def normalize_move_type(move_type: str, context: str = "") -> str:
+def validate_predictions(values, context: str = "") -> np.ndarray:
     """
-    Normalize MoveType to {IN, OUT} only.
-    Maps common variants and logs anomalies.
+    Data-quality policy over a whole result set at once: missing values
+    become 0, negatives are clamped to 0 and everything is rounded to 1
+    decimal place. Anomalies are recorded once per call, only if there are any.
     """
-    if not move_type:
-        return "UNK"
-    
-    original = move_type
-    mt = str(move_type).upper().strip()
-    
-    # Standard mapping
-    if mt in {"IN", "INBOUND", "I", "IMPORT", "ENTRY"}:
-        if mt != "IN":
-            logger.info(f"Normalized MoveType '{original}' -> 'IN' in {context}")
-        return "IN"
-    elif mt in {"OUT", "OUTBOUND", "O", "EXPORT", "EXIT"}:
-        if mt != "OUT":
-            logger.info(f"Normalized MoveType '{original}' -> 'OUT' in {context}")
-        return "OUT"
-    else:
-        logger.warning(f"Unknown MoveType '{original}' in {context}. Mapping to 'UNK'")
-        return "UNK"
-
-def normalize_designation(desig: str, context: str = "") -> str:
-    """
-    Normalize Desig to {EMPTY, FULL, EXP} only.
-    Maps common variants and logs anomalies.
-    """
-    if not desig:
-        return "UNK"
-    
-    original = desig
-    dg = str(desig).upper().strip()
-    
-    # Standard mapping
-    if dg in {"EMPTY", "E", "MT", "BLANK"}:
-        if dg != "EMPTY":
-            logger.info(f"Normalized Desig '{original}' -> 'EMPTY' in {context}")
-        return "EMPTY"
-    elif dg in {"FULL", "F", "LADEN", "LOADED"}:
-        if dg != "FULL":
-            logger.info(f"Normalized Desig '{original}' -> 'FULL' in {context}")
-        return "FULL"
-    elif dg in {"EXP", "EXPORT", "X"}:
-        if dg != "EXP":
-            logger.info(f"Normalized Desig '{original}' -> 'EXP' in {context}")
-        return "EXP"
-    else:
-        logger.warning(f"Unknown Desig '{original}' in {context}. Mapping to 'UNK'")
-        return "UNK"
+    preds = np.nan_to_num(np.asarray(values, dtype=float), nan=0.0)
+    negative = preds < 0
+    if negative.any():
+        telemetry.record(_endpoint(context), "negative_pred", "<0", n=int(negative.sum()),
+                         detail=f"; min {preds.min()} in {context}, clamping to 0")
+        preds = np.where(negative, 0.0, preds)
+    return np.round(preds, 1)
 
 def get_metadata() -> Dict[str, Any]:
     """
@@ -100,7 +59,9 @@ def get_metadata() -> Dict[str, Any]:
             "rounding_policy": "1_decimal_place",
             "move_type_normalization": "IN|OUT|UNK",
             "desig_normalization": "EMPTY|FULL|EXP|UNK"
-        }
+        },
+        # stale, age_seconds, computed_at when built from a last good result
+        **stale.served(),
     }
 
 def parse_local_dt(s: str) -> datetime:
@@ -114,93 +75,86 @@ def _time_bounds(start_iso: str, end_iso: str):
     if end < start: raise HTTPException(422, "end before start")
     return start, end
 
-def _get_deduped_base_cte(start_dt: datetime, end_dt: datetime, terminal_filters: str = "") -> str:
+async def _window_totals(start_dt: datetime, end_dt: datetime,
+                   terminal_id: Optional[str] = None,
+                   move_type: Optional[str] = None,
+                   desig: Optional[str] = None) -> Dict[CellKey, float]:
     """
-    Returns the base CTE that deduplicates by (TerminalID, MoveType, Desig, date, hour)
-    and picks the latest updated_at for each combination.
-    
-    Data Quality Features:
-    - Clamps negative predictions to 0
-    - Normalizes MoveType to {IN, OUT, UNK}
-    - Normalizes Desig to {EMPTY, FULL, EXP, UNK}
-    - Deduplicates by latest updated_at
-    
-    NOTE: This returns just the CTE definition, not a complete query.
+    Window totals per (terminal, move_type, desig) from the cube's prefix-sum
+    index: O(1) per series whatever the window length.
+    """
+    return await aiodb.run(cube.totals, start_dt, end_dt,
+                           terminal=terminal_filter(terminal_id),
+                           move_type=codes.move_type_filter(move_type),
+                           desig=codes.desig_filter(desig))
+
+def _resolution(start_dt: datetime, end_dt: datetime, max_points: Optional[int]) -> str:
+    """Hourly, or day/week buckets for long windows and explicit point budgets (see cube.choose_resolution)."""
+    try:
+        return choose_resolution(start_dt, end_dt, max_points)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+
+async def _rollup_groups(start_dt: datetime, end_dt: datetime, resolution: str, group,
+                   terminal_id: Optional[str] = None,
+                   move_type: Optional[str] = None,
+                   desig: Optional[str] = None) -> Tuple[List[datetime], List[Any], np.ndarray, np.ndarray]:
+    """
+    SUM(pred) GROUP BY (group((terminal, move_type, desig)), bucket) as a
+    (groups, buckets) matrix, with a mask of the cells that have rows.
+    Returns (bucket starts, sorted groups, sums, present).
     """
-    return f"""
-    WITH base AS (
-      SELECT
-        "TerminalID",
-        CASE 
-          WHEN UPPER(TRIM("MoveType")) IN ('IN', 'INBOUND', 'I', 'IMPORT', 'ENTRY') THEN 'IN'
-          WHEN UPPER(TRIM("MoveType")) IN ('OUT', 'OUTBOUND', 'O', 'EXPORT', 'EXIT') THEN 'OUT'
-          ELSE 'UNK'
-        END AS "MoveType",
-        CASE 
-          WHEN UPPER(TRIM("Desig")) IN ('EMPTY', 'E', 'MT', 'BLANK') THEN 'EMPTY'
-          WHEN UPPER(TRIM("Desig")) IN ('FULL', 'F', 'LADEN', 'LOADED') THEN 'FULL'
-          WHEN UPPER(TRIM("Desig")) IN ('EXP', 'EXPORT', 'X') THEN 'EXP'
-          ELSE 'UNK'
-        END AS "Desig",
-        "MoveDate_pred",
-        "MoveHour_pred",
-        TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) AS ts_pred,
-        GREATEST(0.0, "TokenCount_pred"::FLOAT) AS pred,  -- Clamp negative to 0
-        "updated_at"
-      FROM {settings.VERTICA_TABLE_TOKENS}
-      WHERE TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) >= ? 
-        AND TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) < ?
-        {terminal_filters}
-    ),
-    dedup AS (
-      SELECT
-        b.*,
-        ROW_NUMBER() OVER (
-          PARTITION BY "TerminalID", "MoveType", "Desig", "MoveDate_pred", "MoveHour_pred"
-          ORDER BY "updated_at" DESC
-        ) AS rn
-      FROM base b
-    )"""
+    r = await aiodb.run(cube.rollup, start_dt, end_dt, resolution,
+                        terminal=terminal_filter(terminal_id),
+                        move_type=codes.move_type_filter(move_type),
+                        desig=codes.desig_filter(desig))
+    labels = [group(k) for k in r.keys]
+    groups = sorted(set(labels), key=lambda g: (g is not None, g))
+    row = {g: i for i, g in enumerate(groups)}
+    idx = np.array([row[g] for g in labels], dtype=np.intp)
+    sums = np.zeros((len(groups), len(r.starts)))
+    counts = np.zeros((len(groups), len(r.starts)), dtype=np.int32)
+    np.add.at(sums, idx, r.sums)
+    np.add.at(counts, idx, r.counts)
+    return list(r.starts), groups, sums, counts > 0
+
+def _by_hour_of_day(starts: List[datetime], sums: np.ndarray,
+                    present: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Fold hourly buckets onto hour of day: (groups, 24) sums and presence."""
+    hod = np.array([ts.hour for ts in starts], dtype=np.intp)
+    folded = np.zeros((sums.shape[0], 24))
+    seen = np.zeros((sums.shape[0], 24), dtype=np.int32)
+    np.add.at(folded.T, hod, sums.T)
+    np.add.at(seen.T, hod, present.T.astype(np.int32))
+    return folded, seen > 0
+
+def _present_values(sums: np.ndarray, present: np.ndarray, context: str):
+    """(row, column, validated pred) for the present cells, in row-major order."""
+    i, j = np.nonzero(present)
+    preds = validate_predictions(sums[present], context)
+    return zip(i.tolist(), j.tolist(), preds.tolist())
+
+def _sum_totals(totals: Dict[CellKey, float], key) -> Dict[Any, float]:
+    """Re-group series totals: SUM(pred) GROUP BY key((terminal, move_type, desig))."""
+    out: Dict[Any, float] = {}
+    for series, s in totals.items():
+        k = key(series)
+        out[k] = out.get(k, 0.0) + s
+    return out
 
 # 1) Terminal ranking (total tokens in window)
 @router.get("/terminal_ranking")
-def terminal_ranking(start_iso: str, end_iso: str,
+@db_route()
+@preset_cached("next8h", "today")
+async def terminal_ranking(start_iso: str, end_iso: str,
                      move_type: Optional[str] = None, desig: Optional[str] = None):
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
-    
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    mt = norm_move_type(move_type)
-    if mt: 
-        additional_filters.append('AND "MoveType" = ?')
-        params.append(mt)
-    
-    dg = norm_desig(desig)
-    if dg: 
-        additional_filters.append('AND "Desig" = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    q = f"""
-    {base_cte}
-    SELECT "TerminalID", SUM(pred) AS total_pred
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1
-    ORDER BY 2 DESC
-    """
+    totals = _sum_totals(await _window_totals(start_dt, end_dt, move_type=move_type, desig=desig),
+                         lambda k: registry.name(k[0]))
 
-    rows = []
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for t, s in cur.iterate():
-            pred_validated = validate_prediction(s, f"terminal_ranking:{t}")
-            rows.append({"terminal": t, "total_pred": pred_validated})
+    ranked = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+    preds = validate_predictions([s for _, s in ranked], "terminal_ranking")
+    rows = [{"terminal": t, "total_pred": p} for (t, _), p in zip(ranked, preds.tolist())]
     
     return {
         "ranking": rows,
@@ -209,42 +163,16 @@ def terminal_ranking(start_iso: str, end_iso: str,
 
 # 2) MoveType share (IN vs OUT, total over window)
 @router.get("/movetype_share")
-def movetype_share(start_iso: str, end_iso: str,
+@db_route()
+@preset_cached("next8h", "today")
+async def movetype_share(start_iso: str, end_iso: str,
                    terminal_id: Optional[str] = None, desig: Optional[str] = None):
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
-    
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    if terminal_id and terminal_id.upper() not in {"ALL", ""}:
-        additional_filters.append('AND "TerminalID" = ?')
-        params.append(terminal_id)
-    
-    dg = norm_desig(desig)
-    if dg: 
-        additional_filters.append('AND "Desig" = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    q = f"""
-    {base_cte}
-    SELECT "MoveType", SUM(pred) AS pred
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1
-    """
+    totals = await _window_totals(start_dt, end_dt, terminal_id=terminal_id, desig=desig)
 
-    out = {"IN": 0.0, "OUT": 0.0}
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for mt, s in cur.iterate():
-            validated_pred = validate_prediction(s, f"movetype_share:{mt}")
-            if mt in out: 
-                out[mt] = validated_pred
+    by_mt = _sum_totals(totals, lambda k: MOVE_TYPES[k[1]])
+    preds = validate_predictions([by_mt.get("IN", 0.0), by_mt.get("OUT", 0.0)], "movetype_share")
+    out = dict(zip(("IN", "OUT"), preds.tolist()))
     
     return {
         "share": out,
@@ -253,141 +181,76 @@ def movetype_share(start_iso: str, end_iso: str,
 
 # 3) MoveType hourly trend (IN & OUT series)
 @router.get("/movetype_hourly")
-def movetype_hourly(start_iso: str, end_iso: str,
-                    terminal_id: Optional[str] = None, desig: Optional[str] = None):
-    start_dt, end_dt = _time_bounds(start_iso, end_iso)
-    
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    if terminal_id and terminal_id.upper() not in {"ALL", ""}:
-        additional_filters.append('AND "TerminalID" = ?')
-        params.append(terminal_id)
-    
-    dg = norm_desig(desig)
-    if dg: 
-        additional_filters.append('AND "Desig" = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    q = f"""
-    {base_cte}
-    SELECT "MoveDate_pred", "MoveHour_pred", "MoveType", SUM(pred) AS pred
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1,2,3
-    ORDER BY 1,2
+@db_route()
+@preset_cached("next8h", "today")
+async def movetype_hourly(start_iso: str, end_iso: str,
+                    terminal_id: Optional[str] = None, desig: Optional[str] = None,
+                    max_points: Optional[int] = None):
     """
+    IN/OUT series over the window. Points are hourly; windows longer than
+    MAX_RANGE_DAYS, or calls passing max_points, get the finest of hour, day
+    or week buckets within that many points per series ("date"/"hour" give
+    the bucket start; see "resolution").
+    """
+    start_dt, end_dt = _time_bounds(start_iso, end_iso)
+    resolution = _resolution(start_dt, end_dt, max_points)
+    starts, groups, sums, present = await _rollup_groups(start_dt, end_dt, resolution, lambda k: MOVE_TYPES[k[1]],
+                                                         terminal_id=terminal_id, desig=desig)
+    dates = [str(ts.date()) for ts in starts]
+    names = [g.lower() for g in groups]
     
-    rows = []
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for d, h, mt, s in cur.iterate():
-            validated_pred = validate_prediction(s, f"movetype_hourly:{mt}:{d}:{h}")
-            rows.append({
-                "date": str(d), 
-                "hour": int(h), 
-                "move_type": str(mt).lower(), 
-                "pred": validated_pred
-            })
+    rows = [
+        {"date": dates[j], "hour": starts[j].hour, "move_type": names[i], "pred": p}
+        for j, i, p in _present_values(sums.T, present.T, "movetype_hourly")
+    ]
     
     return {
         "points": rows,
+        "resolution": resolution,
         "meta": get_metadata()
     }
 
 # 4) Desig stacked hourly (EXP/FULL/EMPTY)
 @router.get("/desig_hourly")
-def desig_hourly(start_iso: str, end_iso: str,
-                 terminal_id: Optional[str] = None, move_type: Optional[str] = None):
+@db_route()
+@preset_cached("next8h", "today")
+async def desig_hourly(start_iso: str, end_iso: str,
+                 terminal_id: Optional[str] = None, move_type: Optional[str] = None,
+                 max_points: Optional[int] = None):
+    """EXP/FULL/EMPTY series over the window; bucketing as in movetype_hourly."""
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
+    resolution = _resolution(start_dt, end_dt, max_points)
+    starts, groups, sums, present = await _rollup_groups(start_dt, end_dt, resolution, lambda k: DESIGS[k[2]],
+                                                         terminal_id=terminal_id, move_type=move_type)
+    dates = [str(ts.date()) for ts in starts]
+    names = [g.lower() for g in groups]
     
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    if terminal_id and terminal_id.upper() not in {"ALL", ""}:
-        additional_filters.append('AND "TerminalID" = ?')
-        params.append(terminal_id)
-    
-    mt = norm_move_type(move_type)
-    if mt: 
-        additional_filters.append('AND "MoveType" = ?')
-        params.append(mt)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    q = f"""
-    {base_cte}
-    SELECT "MoveDate_pred", "MoveHour_pred", "Desig", SUM(pred) AS pred
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1,2,3
-    ORDER BY 1,2
-    """
-    
-    rows = []
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for d, h, dg, s in cur.iterate():
-            validated_pred = validate_prediction(s, f"desig_hourly:{dg}:{d}:{h}")
-            rows.append({
-                "date": str(d), 
-                "hour": int(h), 
-                "desig": str(dg).lower(), 
-                "pred": validated_pred
-            })
+    rows = [
+        {"date": dates[j], "hour": starts[j].hour, "desig": names[i], "pred": p}
+        for j, i, p in _present_values(sums.T, present.T, "desig_hourly")
+    ]
     
     return {
         "points": rows,
+        "resolution": resolution,
         "meta": get_metadata()
     }
 
 # 5) Heatmap: Terminal x Hour (sum over window)
 @router.get("/terminal_hour_heatmap")
-def terminal_hour_heatmap(start_iso: str, end_iso: str,
+@db_route()
+@preset_cached("next8h", "today")
+async def terminal_hour_heatmap(start_iso: str, end_iso: str,
                           move_type: Optional[str] = None, desig: Optional[str] = None):
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
+    starts, terminals, sums, present = await _rollup_groups(start_dt, end_dt, "hour", lambda k: registry.name(k[0]),
+                                                            move_type=move_type, desig=desig)
+    sums, present = _by_hour_of_day(starts, sums, present)
     
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    mt = norm_move_type(move_type)
-    if mt: 
-        additional_filters.append('AND "MoveType" = ?')
-        params.append(mt)
-    
-    dg = norm_desig(desig)
-    if dg: 
-        additional_filters.append('AND "Desig" = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    q = f"""
-    {base_cte}
-    SELECT "TerminalID", "MoveHour_pred", SUM(pred) AS pred
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1,2
-    ORDER BY 1,2
-    """
-    
-    rows = []
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for t, h, s in cur.iterate():
-            validated_pred = validate_prediction(s, f"terminal_hour_heatmap:{t}:{h}")
-            rows.append({"terminal": str(t), "hour": int(h), "pred": validated_pred})
+    rows = [
+        {"terminal": str(terminals[i]), "hour": h, "pred": p}
+        for i, h, p in _present_values(sums, present, "terminal_hour_heatmap")
+    ]
     
     return {
         "cells": rows,
@@ -396,7 +259,9 @@ def terminal_hour_heatmap(start_iso: str, end_iso: str,
 
 # --- SUNBURST: Terminal -> MoveType -> Desig -------------------------------
 @router.get("/sunburst")
-def sunburst(
+@db_route()
+@preset_cached("next8h", "today")
+async def sunburst(
     start_iso: str,
     end_iso: str,
     terminal_id: Optional[str] = None,    # "ALL" or specific - "ALL" treated as no filter
@@ -412,9 +277,9 @@ def sunburst(
       ]}]
     
     Performance Notes:
-    - Uses deduplication CTE to avoid double counting multiple model runs
-    - Uses timestamp-based filtering for time-zone safety
-    - Query scans only the window and groups by 3 columns - optimized for Vertica
+    - Composed from the per-hour cell cache (deduplicated by latest model run)
+    - Only hours missing from the cache are scanned on Vertica
+    - Series totals are prefix-sum lookups, independent of window length
     
     Data Handling:
     - "ALL" parameters are treated as no filter (backend strips them)
@@ -423,47 +288,17 @@ def sunburst(
     - Values represent sum of TokenCount_pred over the selected window
     """
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
-    
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    if terminal_id and terminal_id.upper() not in {"ALL", ""}:
-        additional_filters.append('AND "TerminalID" = ?')
-        params.append(terminal_id)
-    
-    mt = norm_move_type(move_type)
-    if mt: 
-        additional_filters.append('AND UPPER(TRIM("MoveType")) = ?')
-        params.append(mt)
-    
-    dg = norm_desig(desig)
-    if dg: 
-        additional_filters.append('AND UPPER(TRIM("Desig")) = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    q = f"""
-    {base_cte}
-    SELECT "TerminalID", "MoveType", "Desig", SUM(pred) AS pred
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1,2,3
-    """
+    totals = await _window_totals(start_dt, end_dt, terminal_id=terminal_id,
+                                  move_type=move_type, desig=desig)
 
     # Build hierarchy in Python
     tree: Dict[str, Dict[str, Dict[str, float]]] = {}
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for t, mt, dg, s in cur.iterate():
-            t = str(t)
-            mt = str(mt).lower()
-            dg = str(dg).lower()
-            tree.setdefault(t, {}).setdefault(mt, {}).setdefault(dg, 0.0)
-            tree[t][mt][dg] += float(s or 0.0)
+    for (t, mt, dg), s in totals.items():
+        t = registry.name(t)
+        mt = MOVE_TYPES[mt].lower()
+        dg = DESIGS[dg].lower()
+        tree.setdefault(t, {}).setdefault(mt, {}).setdefault(dg, 0.0)
+        tree[t][mt][dg] += float(s or 0.0)
 
     # Convert to [{name, value, children:[...]}] sorted by value desc
     def to_nodes(d: Dict[str, Dict[str, Dict[str, float]]]):
@@ -486,7 +321,9 @@ def sunburst(
 
 # --- Composition by terminal (percent) --------------------------------------
 @router.get("/composition_by_terminal")
-def composition_by_terminal(
+@db_route()
+@preset_cached("next8h", "today")
+async def composition_by_terminal(
     start_iso: str,
     end_iso: str,
     dim: str = "desig",                 # "desig" | "movetype"
@@ -501,59 +338,20 @@ def composition_by_terminal(
     Client can normalize to 100% (recommended).
     """
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
-    
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    if terminal_id and terminal_id.upper() not in {"ALL", ""}:
-        additional_filters.append('AND "TerminalID" = ?')
-        params.append(terminal_id)
-    
-    mt = norm_move_type(move_type)
-    if mt: 
-        additional_filters.append('AND "MoveType" = ?')
-        params.append(mt)
-    
-    dg = norm_desig(desig)
-    if dg: 
-        additional_filters.append('AND "Desig" = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
+    totals = await _window_totals(start_dt, end_dt, terminal_id=terminal_id,
+                                  move_type=move_type, desig=desig)
     
     dim = dim.lower()
     if dim not in ("desig", "movetype"):
         dim = "desig"
 
     # Select the appropriate dimension
-    if dim == "desig":
-        q = f"""
-        {base_cte}
-        SELECT "TerminalID", "Desig" AS K, SUM(pred) AS pred
-        FROM dedup
-        WHERE rn = 1
-        GROUP BY 1,2
-        ORDER BY 1,2
-        """
-    else:  # movetype
-        q = f"""
-        {base_cte}
-        SELECT "TerminalID", "MoveType" AS K, SUM(pred) AS pred
-        FROM dedup
-        WHERE rn = 1
-        GROUP BY 1,2
-        ORDER BY 1,2
-        """
-
-    rows = []
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for t, k, s in cur.iterate():
-            validated_pred = validate_prediction(s, f"composition_by_terminal:{dim}:{t}:{k}")
-            rows.append({"terminal": str(t), "key": str(k).lower(), "pred": validated_pred})
+    k_idx, names = (2, DESIGS) if dim == "desig" else (1, MOVE_TYPES)
+
+    grouped = sorted(_sum_totals(totals, lambda key: (registry.name(key[0]), names[key[k_idx]])).items())
+    preds = validate_predictions([s for _, s in grouped], f"composition_by_terminal:{dim}")
+    rows = [{"terminal": str(t), "key": str(k).lower(), "pred": p}
+            for ((t, k), _), p in zip(grouped, preds.tolist())]
 
     return {
         "dim": dim, 
@@ -563,8 +361,11 @@ def composition_by_terminal(
 
 # 8) Hourly totals (aggregated across MoveType/Desig for KPIs)
 @router.get("/hourly_totals")
-def hourly_totals(start_iso: str, end_iso: str,
-                  terminal_id: Optional[str] = None):
+@db_route()
+@preset_cached("next8h", "today")
+async def hourly_totals(start_iso: str, end_iso: str,
+                  terminal_id: Optional[str] = None,
+                  max_points: Optional[int] = None):
     """
     Returns hourly totals aggregated across all MoveType and Desig combinations.
     This is the proper data source for KPIs like peak hour and total volume calculations
@@ -576,47 +377,34 @@ def hourly_totals(start_iso: str, end_iso: str,
         {"date": "2024-01-15", "hour": 8, "pred": 125.5},
         {"date": "2024-01-15", "hour": 9, "pred": 143.2},
         ...
-      ]
+      ],
+      "resolution": "hour"
     }
+
+    Windows longer than MAX_RANGE_DAYS, or calls passing max_points, may be
+    returned as day or week buckets instead (date/hour = bucket start).
     """
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
+    resolution = _resolution(start_dt, end_dt, max_points)
+    starts, _, sums, present = await _rollup_groups(start_dt, end_dt, resolution, lambda k: None,
+                                                    terminal_id=terminal_id)
     
-    # Build additional filters for the base CTE
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    if terminal_id and terminal_id.upper() not in {"ALL", ""}:
-        additional_filters.append('AND "TerminalID" = ?')
-        params.append(terminal_id)
-    
-    terminal_filters = " ".join(additional_filters)
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    q = f"""
-    {base_cte}
-    SELECT "MoveDate_pred", "MoveHour_pred", SUM(pred) AS pred
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1,2
-    ORDER BY 1,2
-    """
-    
-    rows = []
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        for d, h, s in cur.iterate():
-            validated_pred = validate_prediction(s, f"hourly_totals:{d}:{h}")
-            rows.append({"date": str(d), "hour": int(h), "pred": validated_pred})
+    rows = [
+        {"date": str(starts[j].date()), "hour": starts[j].hour, "pred": p}
+        for j, _, p in _present_values(sums.T, present.T, "hourly_totals")
+    ]
     
     return {
         "points": rows,
+        "resolution": resolution,
         "meta": get_metadata()
     }
 
 # 9) Total forecast volume (IN+OUT all designations for KPIs)
 @router.get("/total_forecast_volume")
-def total_forecast_volume(start_iso: str, end_iso: str,
+@db_route()
+@preset_cached("next8h", "today")
+async def total_forecast_volume(start_iso: str, end_iso: str,
                           terminal_id: Optional[str] = None,
                           move_type: Optional[str] = None,
                           desig: Optional[str] = None):
@@ -646,87 +434,26 @@ def total_forecast_volume(start_iso: str, end_iso: str,
     """
     start_dt, end_dt = _time_bounds(start_iso, end_iso)
     
-    # Build filters
-    additional_filters = []
-    params = [start_dt, end_dt]
-    
-    if terminal_id and terminal_id.upper() not in {"ALL", ""}:
-        additional_filters.append('AND "TerminalID" = ?')
-        params.append(terminal_id)
-    
-    mt = norm_move_type(move_type)
-    if mt: 
-        additional_filters.append('AND UPPER(TRIM("MoveType")) = ?')
-        params.append(mt)
-    
-    dg = norm_desig(desig)
-    if dg: 
-        additional_filters.append('AND UPPER(TRIM("Desig")) = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
-    
-    # Use the standardized base CTE with data quality controls
-    base_cte = _get_deduped_base_cte(start_dt, end_dt, terminal_filters)
-    
-    # Main query for totals using the standardized CTE
-    q = f"""
-    {base_cte},
-    hourly AS (
-      SELECT "MoveHour_pred" AS hour,
-             SUM(pred) AS pred_total,
-             SUM(CASE WHEN "MoveType"='IN'  THEN pred ELSE 0 END) AS pred_in,
-             SUM(CASE WHEN "MoveType"='OUT' THEN pred ELSE 0 END) AS pred_out
-      FROM dedup
-      WHERE rn = 1
-      GROUP BY 1
-      ORDER BY 1
-    )
-    SELECT
-      SUM(pred_total) AS total_volume,
-      SUM(pred_in) AS total_in,
-      SUM(pred_out) AS total_out
-    FROM hourly
-    """
-    
-    # Execute main query for totals
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q, params)
-        result = cur.fetchone()
-        
-        if result:
-            total_volume, total_in, total_out = result
-            total_volume = validate_prediction(total_volume, "total_forecast_volume:total")
-            total_in = validate_prediction(total_in, "total_forecast_volume:in")
-            total_out = validate_prediction(total_out, "total_forecast_volume:out")
-        else:
-            total_volume = total_in = total_out = 0.0
-    
-    # Get hourly breakdown using same base CTE
-    breakdown_q = f"""
-    {base_cte}
-    SELECT "MoveHour_pred" AS hour,
-           SUM(pred) AS pred_total,
-           SUM(CASE WHEN "MoveType"='IN'  THEN pred ELSE 0 END) AS pred_in,
-           SUM(CASE WHEN "MoveType"='OUT' THEN pred ELSE 0 END) AS pred_out
-    FROM dedup
-    WHERE rn = 1
-    GROUP BY 1
-    ORDER BY 1
-    """
-    
-    breakdown = []
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(breakdown_q, params)
-        for hour, total, in_val, out_val in cur.iterate():
-            breakdown.append({
-                "hour": int(hour),
-                "total": validate_prediction(total, f"total_forecast_volume:breakdown:{hour}:total"),
-                "in": validate_prediction(in_val, f"total_forecast_volume:breakdown:{hour}:in"),
-                "out": validate_prediction(out_val, f"total_forecast_volume:breakdown:{hour}:out")
-            })
+    # One hourly rollup per move type gives both the totals and the breakdown
+    starts, groups, sums, present = await _rollup_groups(start_dt, end_dt, "hour", lambda k: k[1],
+                                                         terminal_id=terminal_id,
+                                                         move_type=move_type, desig=desig)
+    by_hour, seen = _by_hour_of_day(starts, sums, present)
+    zero = np.zeros(24)
+    hourly = np.vstack([
+        by_hour.sum(axis=0),
+        by_hour[groups.index(_IN)] if _IN in groups else zero,
+        by_hour[groups.index(_OUT)] if _OUT in groups else zero,
+    ])
+    totals = validate_predictions(hourly.sum(axis=1), "total_forecast_volume")
+    total_volume, total_in, total_out = totals.tolist()
+
+    hours = np.nonzero(seen.any(axis=0))[0]
+    breakdown_values = validate_predictions(hourly[:, hours], "total_forecast_volume:breakdown")
+    breakdown = [
+        {"hour": h, "total": total, "in": in_, "out": out}
+        for h, (total, in_, out) in zip(hours.tolist(), breakdown_values.T.tolist())
+    ]
     
     # Calculate window hours
     window_hours = max(1, int((end_dt - start_dt).total_seconds() / 3600))
@@ -741,3 +468,222 @@ def total_forecast_volume(start_iso: str, end_iso: str,
         "breakdown": breakdown,
         "meta": get_metadata()
     }
+
+# 10) Composite: the main dashboard's panels in one request
+@router.get("/dashboard")
+async def dashboard(start_iso: str, end_iso: str,
+                    terminal_id: Optional[str] = None,
+                    move_type: Optional[str] = None,
+                    desig: Optional[str] = None,
+                    max_points: Optional[int] = None):
+    """
+    The panels the dashboard page loads for one window and filter set, keyed
+    by endpoint name; each value is exactly what that endpoint returns for
+    the same parameters. Panels are computed concurrently (each preset-cached
+    like a direct call), so the page pays for the slowest panel rather than
+    the sum. The request is admitted once for all of its panels, and the
+    first panel to fail cancels the others.
+    """
+    window = {"start_iso": start_iso, "end_iso": end_iso}
+    panels = {
+        "terminal_ranking": (terminal_ranking, {**window, "move_type": move_type, "desig": desig}),
+        "movetype_share": (movetype_share, {**window, "terminal_id": terminal_id, "desig": desig}),
+        "movetype_hourly": (movetype_hourly, {**window, "terminal_id": terminal_id, "desig": desig,
+                                              "max_points": max_points}),
+        "desig_hourly": (desig_hourly, {**window, "terminal_id": terminal_id, "move_type": move_type,
+                                        "max_points": max_points}),
+        "terminal_hour_heatmap": (terminal_hour_heatmap, {**window, "move_type": move_type, "desig": desig}),
+        "hourly_totals": (hourly_totals, {**window, "terminal_id": terminal_id, "max_points": max_points}),
+        "total_forecast_volume": (total_forecast_volume, {**window, "terminal_id": terminal_id,
+                                                          "move_type": move_type, "desig": desig}),
+    }
+    admit(*panels.values())
+    results = await aiodb.gather(*(fn(**kwargs) for fn, kwargs in panels.values()))
+    return dict(zip(panels, results))
+
+# 11) Utilization: hourly demand against each terminal's capacity calendar
+# Risk thresholds as in the dashboard's calculateRiskLevel (dataUtils.ts)
+_HIGH_RISK_UTILIZATION, _HIGH_RISK_OVERLOAD_HOURS = 1.2, 3
+_WARNING_UTILIZATION, _WARNING_OVERLOAD_HOURS = 1.0, 1
+
+@db_route()
+@preset_cached("next8h", "today")
+async def _hourly_demand(start_iso: str, end_iso: str,
+                         terminal_id: Optional[str] = None,
+                         move_type: Optional[str] = None,
+                         desig: Optional[str] = None):
+    """Predicted demand per (terminal, hour): (hour starts, terminals, sums, present)."""
+    start_dt, end_dt = _time_bounds(start_iso, end_iso)
+    return await _rollup_groups(start_dt, end_dt, "hour", lambda k: registry.name(k[0]),
+                                terminal_id=terminal_id, move_type=move_type, desig=desig)
+
+def _risk_levels(overload_hours: np.ndarray, max_utilization: np.ndarray) -> np.ndarray:
+    return np.select(
+        [(max_utilization >= _HIGH_RISK_UTILIZATION) | (overload_hours >= _HIGH_RISK_OVERLOAD_HOURS),
+         (max_utilization >= _WARNING_UTILIZATION) | (overload_hours >= _WARNING_OVERLOAD_HOURS)],
+        ["High Risk", "Warning"], "Safe")
+
+def _utilization_kpis(starts: List[datetime], demand: np.ndarray, capacity: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    KPIs per row of (rows, hours) demand and capacity matrices, in one pass
+    over the whole matrix. As in calculateCapacityMetrics, the average is
+    over every hour of the window, hours without forecast rows counting as
+    zero demand. Hours at zero capacity (e.g. a maintenance override) count
+    as overloaded if there is any demand but are left out of the
+    utilization figures.
+    """
+    rated = capacity > 0
+    util = np.divide(demand, capacity, out=np.zeros_like(demand), where=rated)
+    overload = (demand > capacity).sum(axis=1)
+    max_util = util.max(axis=1, initial=0.0)
+    n = rated.sum(axis=1)
+    avg_util = np.divide(util.sum(axis=1), n, out=np.zeros(len(n)), where=n > 0)
+    peak = demand.argmax(axis=1) if demand.shape[1] else np.zeros(len(demand), dtype=np.intp)
+    peak_pred = demand.max(axis=1, initial=0.0)
+    risk = _risk_levels(overload, max_util)
+    return [
+        {
+            "peak_hour": starts[j].isoformat() if p > 0 else None,
+            "peak_pred": round(p, 1),
+            "overload_hours": o,
+            "max_utilization": round(mx, 3),
+            "avg_utilization": round(av, 3),
+            "risk_level": r,
+        }
+        for j, p, o, mx, av, r in zip(peak.tolist(), peak_pred.tolist(), overload.tolist(),
+                                      max_util.tolist(), avg_util.tolist(), risk.tolist())
+    ]
+
+async def _demand_and_capacity(start_iso: str, end_iso: str,
+                               terminal_id: Optional[str] = None,
+                               move_type: Optional[str] = None,
+                               desig: Optional[str] = None):
+    """
+    Hourly demand and capacity as aligned (terminals, hours) matrices for
+    every terminal asked for, with or without rows in the window.
+    Returns (start, hour starts, terminals, demand, present, capacity).
+    """
+    start_dt, end_dt = _time_bounds(start_iso, end_iso)
+    if (end_dt - start_dt).days > settings.MAX_RANGE_DAYS:
+        raise HTTPException(422, "window too large")
+    starts, found, sums, present = await _hourly_demand(start_iso, end_iso, terminal_id=terminal_id,
+                                                        move_type=move_type, desig=desig)
+    hours = len(starts)
+
+    if terminal_filter(terminal_id) is None:
+        terminals = sorted(set(found) | set(registry.terminals()))
+    else:
+        terminals = [terminal_id]
+    row = {t: i for i, t in enumerate(found)}
+    idx = np.array([row.get(t, -1) for t in terminals], dtype=np.intp)
+    has = idx >= 0
+    demand = np.zeros((len(terminals), hours))
+    seen = np.zeros((len(terminals), hours), dtype=bool)
+    demand[has], seen[has] = sums[idx[has]], present[idx[has]]
+    demand = validate_predictions(demand, "utilization")
+    capacity = np.array([capacities.hourly(t, start_dt, end_dt)[:hours] for t in terminals],
+                        dtype=float).reshape(len(terminals), hours)
+    return start_dt, starts, terminals, demand, seen, capacity
+
+@router.get("/utilization")
+async def utilization(start_iso: str, end_iso: str,
+                      terminal_id: Optional[str] = None,
+                      move_type: Optional[str] = None,
+                      desig: Optional[str] = None):
+    """
+    Capacity KPIs per terminal (and for all terminals together) over the
+    window, replacing the client-side calculateCapacityMetrics /
+    calculatePeakHour / calculateRiskLevel over full hourly series:
+
+    {
+      "terminals": [{"terminal": "T1", "capacity_per_hour": 60,
+                     "peak_hour": "...", "peak_pred": 71.2, "overload_hours": 2,
+                     "max_utilization": 1.187, "avg_utilization": 0.64,
+                     "risk_level": "Warning"}, ...],
+      "overall": {... the same over summed demand and capacity ...}
+    }
+
+    Demand is the preset-cached hourly rollup; capacity is joined per
+    request from the in-memory calendars (see capacity.py), so capacity
+    edits apply immediately.
+    """
+    _, starts, terminals, demand, _, capacity = await _demand_and_capacity(
+        start_iso, end_iso, terminal_id=terminal_id, move_type=move_type, desig=desig)
+
+    kpis = _utilization_kpis(starts, demand, capacity)
+    overall = _utilization_kpis(starts, demand.sum(axis=0, keepdims=True),
+                                capacity.sum(axis=0, keepdims=True))[0]
+    return {
+        "terminals": [{"terminal": t, "capacity_per_hour": capacities.get(t), **k}
+                      for t, k in zip(terminals, kpis)],
+        "overall": overall,
+        "window_hours": len(starts),
+        "meta": get_metadata()
+    }
+
+# 12) Capacity what-if: a batch of scenarios against the cached hourly forecast
+_WHAT_IF_DECIMALS = {"overload_hours": 0, "peak_utilization": 3, "backlog_hours": 0,
+                     "max_backlog": 1, "end_backlog": 1}
+
+def _scenario_results(names: List[str], terminals: List[str], r: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    totals = {
+        "overload_hours": r["overload_hours"].sum(axis=1),
+        "peak_utilization": r["peak_utilization"].max(axis=1, initial=0.0),
+        "backlog_hours": r["backlog_hours"].sum(axis=1),
+        "max_backlog": r["max_backlog"].max(axis=1, initial=0.0),
+        "end_backlog": r["end_backlog"].sum(axis=1),
+    }
+
+    def rounded(values: Dict[str, np.ndarray]) -> Dict[str, list]:
+        return {k: (v.astype(int) if _WHAT_IF_DECIMALS[k] == 0 else np.round(v, _WHAT_IF_DECIMALS[k])).tolist()
+                for k, v in values.items()}
+
+    totals, per_terminal = rounded(totals), rounded(r)
+    return [
+        {
+            "name": name,
+            **{k: v[n] for k, v in totals.items()},
+            "terminals": [
+                {"terminal": t, **{k: v[n][i] for k, v in per_terminal.items()}}
+                for i, t in enumerate(terminals)
+            ],
+        }
+        for n, name in enumerate(names)
+    ]
+
+@router.post("/what_if")
+async def what_if(payload: WhatIfRequest):
+    """
+    Evaluate capacity scenarios ("T2 at 45/hour for the next week") against
+    the hourly forecast for the window. Each scenario's changes apply on top
+    of the current capacity calendars; a "baseline" entry (no changes) is
+    returned first for comparison. Per scenario and per terminal:
+    overload_hours, peak_utilization, backlog_hours, max_backlog and
+    end_backlog (queued tokens carried past the window's end); the
+    scenario-level figures are sums (hours, end_backlog) or maxima.
+
+    Demand comes from the same cached rollup as /analytics/utilization and
+    all scenarios are evaluated as one array (see whatif.py), so a batch
+    costs no Vertica queries once the window is cached.
+    """
+    if len(payload.scenarios) > settings.WHAT_IF_MAX_SCENARIOS:
+        raise HTTPException(422, f"at most {settings.WHAT_IF_MAX_SCENARIOS} scenarios per request")
+    start_dt, _, terminals, demand, _, capacity = await _demand_and_capacity(
+        payload.start_iso, payload.end_iso, move_type=payload.move_type, desig=payload.desig)
+
+    def evaluate():
+        # CPU-only; runs off the event loop
+        scenarios = [CapacityScenario(name="baseline"), *payload.scenarios]
+        tensor = capacity_tensor(capacity, terminals, start_dt, scenarios)
+        return _scenario_results([s.name for s in scenarios], terminals, simulate(demand, tensor))
+
+    try:
+        results = await asyncio.to_thread(evaluate)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return {
+        "scenarios": results,
+        "window_hours": capacity.shape[1],
+        "meta": get_metadata()
+    }
+
@@ -1,23 +1,74 @@
 # server/app/routers/capacity.py
-from fastapi import APIRouter
-from datetime import datetime
-from backend.schemas import CapacityGetResponse, CapacityPutRequest
+from datetime import datetime, timedelta
+from typing import List
+from fastapi import APIRouter, HTTPException
+from backend.schemas import CapacityGetResponse, CapacityPutRequest, CapacityBulkResponse, CapacityBulkPutRequest
 from backend.config import settings
-from backend.utils.timebox import now_local
+from backend.capacity import capacities, validate_calendar
+from backend.executor import db_route, CUSTOM
+from backend.registry import registry
+from backend.utils.timebox import now_local, TZ
 
 router = APIRouter(prefix="/capacity", tags=["capacity"])
-_CAPACITY = {}  # in-memory; replace with DB table later
+
+# persisted in Vertica and cached in memory; see backend/capacity.py
+
+def _response(terminal_id: str) -> CapacityGetResponse:
+    cal = capacities.calendar(terminal_id)
+    return CapacityGetResponse(terminal_id=terminal_id, capacity_per_hour=cal.base,
+                               updated_at=cal.updated_at or now_local(),
+                               rules=cal.rules, overrides=cal.overrides)
+
+def _put(requests: List[CapacityPutRequest]):
+    for r in requests:
+        try:
+            validate_calendar(r.rules, r.overrides)
+        except ValueError as e:
+            raise HTTPException(422, f"{r.terminal_id}: {e}")
+    capacities.put_many(requests)
 
 @router.get("", response_model=CapacityGetResponse)
 def get_capacity(terminal_id: str):
-    cap = _CAPACITY.get(terminal_id, settings.DEFAULT_CAPACITY_PER_HOUR)
-    return CapacityGetResponse(terminal_id=terminal_id, capacity_per_hour=cap, updated_at=now_local())
+    return _response(terminal_id)
 
 @router.put("", response_model=CapacityGetResponse)
+@db_route(CUSTOM)
 def put_capacity(payload: CapacityPutRequest):
-    _CAPACITY[payload.terminal_id] = payload.capacity_per_hour
-    return CapacityGetResponse(terminal_id=payload.terminal_id, capacity_per_hour=payload.capacity_per_hour, updated_at=now_local())
-# Note: This is a simple in-memory store; replace with persistent storage in production
-# For example, you could use a Vertica table to store terminal capacities
-# and update the `get_capacity` and `put_capacity` methods to query that table.
-# This would allow you to maintain capacity data across server restarts and scale better.
\ No newline at end of file
+    _put([payload])
+    return _response(payload.terminal_id)
+
+@router.get("/bulk", response_model=CapacityBulkResponse)
+def get_capacities():
+    """Capacity of every terminal in the data plus any configured one, in one call."""
+    terminals = sorted(set(registry.terminals()) | set(capacities.all()))
+    return CapacityBulkResponse(capacities=[_response(t) for t in terminals],
+                                default_capacity_per_hour=settings.DEFAULT_CAPACITY_PER_HOUR)
+
+@router.put("/bulk", response_model=CapacityBulkResponse)
+@db_route(CUSTOM)
+def put_capacities(payload: CapacityBulkPutRequest):
+    """Set several terminals' capacities in one write; returns the full list as GET /capacity/bulk."""
+    if len({c.terminal_id for c in payload.capacities}) != len(payload.capacities):
+        raise HTTPException(422, "duplicate terminal_id in capacities")
+    _put(payload.capacities)
+    return get_capacities()
+
+@router.get("/hourly")
+def get_hourly_capacity(terminal_id: str, start_iso: str, end_iso: str):
+    """The terminal's effective capacity for each local hour in [start, end), rules and overrides applied."""
+    try:
+        start = datetime.fromisoformat(start_iso)
+        end = datetime.fromisoformat(end_iso)
+        start = (start.replace(tzinfo=TZ) if start.tzinfo is None else start.astimezone(TZ)).replace(minute=0, second=0, microsecond=0)
+        end = (end.replace(tzinfo=TZ) if end.tzinfo is None else end.astimezone(TZ)).replace(minute=0, second=0, microsecond=0)
+        if end < start:
+            raise ValueError("end before start")
+        if (end - start).days > settings.MAX_RANGE_DAYS:
+            raise ValueError("window too large")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Bad start/end: {e}")
+    caps = capacities.hourly(terminal_id, start, end).tolist()
+    return {
+        "terminal_id": terminal_id,
+        "hours": [{"ts": start + timedelta(hours=i), "capacity_per_hour": c} for i, c in enumerate(caps)],
+    }
@@ -0,0 +1,70 @@
+# server/app/routers/diagnostics.py
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from backend.auth import require_admin
+from backend.config import settings
+from backend.diagnostics import memory, sampler
+from backend.tracing import collector
+
+router = APIRouter(prefix="/diagnostics", tags=["diagnostics"], dependencies=[Depends(require_admin)])
+
+@router.get("/hot")
+def hot_functions(
+    seconds: Optional[float] = Query(None, gt=0, description="trailing window; default all that is kept"),
+    limit: int = Query(30, ge=1, le=500),
+    sort: str = Query("self", description="self or total"),
+    include_idle: bool = False,
+):
+    """Hottest functions across all threads from the background stack sampler."""
+    if sort not in ("self", "total"):
+        raise HTTPException(422, "sort must be self or total")
+    if not sampler.running:
+        raise HTTPException(409, "the sampling profiler is off (SAMPLER_INTERVAL_MS=0)")
+    return sampler.top(seconds, limit=limit, sort=sort, include_idle=include_idle)
+
+@router.get("/hot/folded", response_class=PlainTextResponse)
+def hot_stacks(seconds: Optional[float] = Query(None, gt=0), include_idle: bool = False):
+    """The sampler's window as folded stacks, for flamegraph.pl or speedscope."""
+    return sampler.folded(seconds, include_idle=include_idle)
+
+@router.get("/memory")
+def memory_status():
+    return memory.status()
+
+@router.post("/memory/start")
+def memory_start(frames: Optional[int] = Query(None, ge=1, le=100)):
+    """Start allocation tracing (slows allocations until stopped)."""
+    return memory.start(frames) if frames else memory.start()
+
+@router.post("/memory/snapshot")
+def memory_snapshot(key_type: str = Query("lineno", description="lineno, filename or traceback"),
+                    limit: int = Query(25, ge=1, le=500)):
+    """Top allocation sites, and growth since the previous snapshot."""
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise HTTPException(422, "key_type must be lineno, filename or traceback")
+    try:
+        return memory.snapshot(key_type, limit)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+
+@router.post("/memory/stop")
+def memory_stop():
+    return memory.stop()
+
+@router.get("/traces")
+def traces(seconds: Optional[float] = Query(None, gt=0)):
+    """Recent request traces (newest first): route, filters, window, status, duration, rows."""
+    if not settings.TRACING_ENABLED:
+        raise HTTPException(409, "tracing is off (TRACING_ENABLED=0)")
+    return collector.summaries(seconds)
+
+@router.get("/traces/events")
+def trace_events(trace_id: Optional[str] = None, seconds: Optional[float] = Query(None, gt=0)):
+    """
+    Spans of one trace, or of all traces in the last `seconds`, in the
+    Trace Event Format: save and open in ui.perfetto.dev or chrome://tracing.
+    """
+    return collector.events(trace_id, seconds)
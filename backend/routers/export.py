@@ -0,0 +1,203 @@
+# server/app/routers/export.py
+"""
+Report export: the deduplicated hourly forecast (latest model run per
+hour, see latest_runs.latest_cte) for any window and filters, as CSV or
+Parquet.
+
+The result set is streamed: rows are read DB_FETCH_BATCH_ROWS at a time
+on one executor worker at EXPORT priority, encoded there, and handed to
+the response through a small buffer (see aiodb.stream), so memory stays
+bounded whatever the window and live panels keep precedence over exports
+for the remaining workers. At most EXPORT_MAX_CONCURRENT exports stream at
+once.
+"""
+import csv
+import io
+import threading
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from backend import aiodb, codes
+from backend.config import settings
+from backend.db import get_conn
+from backend.executor import EXPORT, db_route
+from backend.latest_runs import latest_cte
+from backend.registry import terminal_filter
+from backend.tracing import start_span
+from backend.routers.analytics import _time_bounds
+from backend.routers.forecast import _code_filters
+from backend.utils.timebox import TZ
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is unavailable without pyarrow
+    pa = pq = None
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+COLUMNS = ["ts", "terminal_id", "move_type", "desig", "pred", "updated_at"]
+MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+_slots = threading.BoundedSemaphore(settings.EXPORT_MAX_CONCURRENT)
+
+
+def _query(terminal_id: Optional[str], move_type: Optional[str], desig: Optional[str]):
+    code_filters, code_params = _code_filters(move_type, desig)
+    terminal = "" if terminal_filter(terminal_id) is None else 'AND "TerminalID" = ?'
+    params = [] if not terminal else [terminal_id]
+    query = f"""
+    {latest_cte(terminal_filter=terminal, filters=code_filters)}
+    SELECT ts_pred, "TerminalID", move_type_code, desig_code, pred, "updated_at"
+    FROM latest
+    ORDER BY ts_pred, "TerminalID", move_type_code, desig_code
+    """
+    return query, params + code_params
+
+
+def _local(ts: Optional[datetime]) -> Optional[datetime]:
+    # TIMESTAMP columns come back naive in local time
+    return ts.replace(tzinfo=TZ) if ts is not None and ts.tzinfo is None else ts
+
+
+def _batches(query: str, params: List) -> Iterator[List[list]]:
+    """The export's rows as column lists (COLUMNS order), one fetchmany() batch at a time."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        yield []  # the query is running: the response can start
+        fetch, fetched = start_span("db.fetch"), 0
+        while True:
+            rows = cur.fetchmany(settings.DB_FETCH_BATCH_ROWS)
+            if not rows:
+                if fetch is not None:
+                    fetch.attrs["rows"] = fetched
+                    fetch.trace.count(rows=fetched)
+                    fetch.finish()
+                return
+            fetched += len(rows)
+            ts, terminals, mts, dgs, preds, updated = (list(c) for c in zip(*rows))
+            yield [
+                [_local(t) for t in ts],
+                [str(t) for t in terminals],
+                [codes.MOVE_TYPES[c] for c in mts],
+                [codes.DESIGS[c] for c in dgs],
+                [0.0 if p is None else float(p) for p in preds],
+                [_local(u) for u in updated],
+            ]
+
+
+def _csv(query: str, params: List) -> Iterator[bytes]:
+    for columns in _batches(query, params):
+        out = io.StringIO()
+        w = csv.writer(out, lineterminator="\n")
+        if not columns:
+            w.writerow(COLUMNS)
+        else:
+            ts, terminals, mts, dgs, preds, updated = columns
+            w.writerows(zip((t.isoformat() for t in ts), terminals, mts, dgs, preds,
+                            ("" if u is None else u.isoformat() for u in updated)))
+        yield out.getvalue().encode()
+
+
+class _Chunks:
+    """Write-only file object collecting what ParquetWriter writes, taken per row group."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _parquet(query: str, params: List) -> Iterator[bytes]:
+    # one row group per fetch batch
+    schema = pa.schema([
+        ("ts", pa.timestamp("s", tz=str(TZ))),
+        ("terminal_id", pa.string()),
+        ("move_type", pa.string()),
+        ("desig", pa.string()),
+        ("pred", pa.float64()),
+        ("updated_at", pa.timestamp("s", tz=str(TZ))),
+    ])
+    sink = _Chunks()
+    writer = None
+    for columns in _batches(query, params):
+        if writer is None:
+            writer = pq.ParquetWriter(sink, schema)
+        if columns:
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+@router.get("")
+@db_route(EXPORT)
+async def export(
+    start_iso: str,
+    end_iso: str,
+    terminal_id: Optional[str] = None,
+    move_type: Optional[str] = None,
+    desig: Optional[str] = None,
+    format: str = Query("csv", description="csv or parquet"),
+):
+    """
+    Hourly forecast rows in [start, end): ts, terminal_id, move_type, desig,
+    pred (clamped), updated_at (the model run), ordered by hour. Streamed
+    as an attachment; a failed query is reported with a status code, an
+    error after the first bytes truncates the download.
+    """
+    if format not in MEDIA_TYPES:
+        raise HTTPException(422, f"format must be one of {sorted(MEDIA_TYPES)}")
+    if format == "parquet" and pq is None:
+        raise HTTPException(501, "Parquet export needs pyarrow on the server")
+    start, end = _time_bounds(start_iso, end_iso)
+    if (end - start).days > settings.EXPORT_MAX_DAYS:
+        raise HTTPException(422, f"window too large (max {settings.EXPORT_MAX_DAYS} days)")
+    query, params = _query(terminal_id, move_type, desig)
+
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(503, f"{settings.EXPORT_MAX_CONCURRENT} exports already running",
+                            headers={"Retry-After": "30"})
+    # the slot is held until the worker is done with the query
+    chunks = aiodb.stream(_parquet if format == "parquet" else _csv, query, [start, end, *params],
+                          on_done=_slots.release)
+    try:
+        # wait for the query to start, so admission and SQL errors still get a status code
+        first = await chunks.__anext__()
+    except BaseException:
+        await chunks.aclose()
+        raise
+
+    async def body():
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    name = f"forecast_{start:%Y%m%d%H}_{end:%Y%m%d%H}.{format}"
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
@@ -1,125 +1,137 @@
 # server/app/routers/forecast.py
 from fastapi import APIRouter, Query
-from typing import List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
-from backend.db import get_conn
+import numpy as np
 from backend.config import settings
 from backend.schemas import Next8HResponse, ForecastPoint
-from backend.utils.timebox import next_n_hours, now_local
+from backend.utils.timebox import TZ, next_n_hours, now_local
+from backend.precompute import preset_cached
+from backend.executor import admit, db_route
+from backend.cube import cube, choose_resolution
+from backend.latest_runs import latest_cte
+from backend import aiodb, codes
+from backend.registry import registry
+from backend.capacity import capacities
+from backend.freshness import freshness
 from fastapi import HTTPException
 
 router = APIRouter(prefix="/forecast", tags=["forecast"])
 
-# normalize inputs
+# normalize inputs (same vocabulary as ingest, see codes.py)
+# (an unrecognized value is kept as given, upper-cased: it matches no rows)
 def norm_move_type(s: str | None) -> str | None:
-    if not s: return None
-    s = s.strip().upper()
-    if s in {"ALL", "ANY"}: return None
-    return "IN" if s in {"IN","INWARD"} else ("OUT" if s in {"OUT","OUTWARD"} else s)
+    code = codes.move_type_filter(s)
+    if code == codes.NO_MATCH:
+        return s.strip().upper()
+    return None if code is None else codes.MOVE_TYPES[code]
 
 def norm_desig(s: str | None) -> str | None:
-    if not s: return None
-    s = s.strip().upper()
-    if s in {"ALL", "ANY"}: return None
-    mapping = {"EMPTY":"EMPTY", "FULL":"FULL", "EXP":"EXP", "EXPORT":"EXP"}
-    return mapping.get(s, s)
+    code = codes.desig_filter(s)
+    if code == codes.NO_MATCH:
+        return s.strip().upper()
+    return None if code is None else codes.DESIGS[code]
+
+def _code_filters(move_type: str | None, desig: str | None) -> Tuple[str, List[int]]:
+    """SQL predicates and params on the latest CTE's code columns."""
+    filters, params = [], []
+    mt, dg = codes.move_type_filter(move_type), codes.desig_filter(desig)
+    if mt is not None:
+        filters.append("AND move_type_code = ?")
+        params.append(mt)
+    if dg is not None:
+        filters.append("AND desig_code = ?")
+        params.append(dg)
+    return " ".join(filters), params
+
+def _forecast_rows(columns: List[list], stamp: Callable[[object, int], datetime]) -> Tuple[List[ForecastPoint], Optional[datetime]]:
+    """
+    Forecast points from the latest CTE's columns ("TerminalID",
+    move_type_code, desig_code, "MoveDate_pred", "MoveHour_pred", pred,
+    "updated_at"), with stamp(date, hour) as their ts, plus the newest
+    updated_at. Like the analytics endpoints, points carry the canonical
+    MoveType/Desig names (UNK for values unrecognized at ingest) and pred
+    clamped at 0 (NULL -> 0).
+    """
+    terminals, mts, dgs, d_pred, h_pred, preds, updated = columns
+    stamps = {dh: stamp(*dh) for dh in set(zip(d_pred, h_pred))}  # once per hour, not per row
+    preds = np.maximum(np.nan_to_num(np.array(preds, dtype=float)), 0.0).tolist()
+    latest = max((u for u in updated if u is not None), default=None)
+    rows = [
+        ForecastPoint(
+            ts=stamps[(d, h)],
+            move_type=codes.MOVE_TYPES[mtv],
+            desig=codes.DESIGS[dgv],
+            terminal_id=terminal,
+            pred=pred_value,
+            actual=None,  # No actual data available in this table
+            lower=None, upper=None  # fill when you have intervals
+        )
+        for terminal, mtv, dgv, d, h, pred_value in zip(terminals, mts, dgs, d_pred, h_pred, preds)
+    ]
+    return rows, latest
+
+def _with_capacity(resp: Next8HResponse, terminal_id: str) -> Next8HResponse:
+    # attached per response (from memory) so cached forecasts never carry a stale capacity
+    cal = capacities.calendar(terminal_id)
+    update = {"capacity_per_hour": cal.base}
+    if resp.resolution == "hour" and resp.horizon_hours:
+        # one calendar slice over the window, then each point's hour offset into it
+        t0 = min(p.ts for p in resp.horizon_hours)
+        offsets = np.array([(p.ts - t0) // timedelta(hours=1) for p in resp.horizon_hours])
+        update["capacity_by_hour"] = cal.hourly(t0, int(offsets.max()) + 1)[offsets].tolist()
+    return resp.model_copy(update=update)
 
 @router.get("/next8h", response_model=Next8HResponse)
-def next8h(
+async def next8h(
     terminal_id: str,
     move_type: Optional[str] = Query(None, description="IN or OUT"),
     desig: Optional[str] = Query(None, description="EMPTY, FULL, or EXP"),
 ):
+    return _with_capacity(await _next8h(terminal_id, move_type, desig), terminal_id)
+
+@db_route()
+@preset_cached("next8h")
+async def _next8h(terminal_id: str, move_type: Optional[str] = None, desig: Optional[str] = None):
     horizon = next_n_hours(8)
     start = horizon[0]
     end = start + timedelta(hours=8)  # Exactly 8 hours later for half-open interval [start, end)
 
-    mt = norm_move_type(move_type) if move_type else None
-    dg = norm_desig(desig) if desig else None
+    mt = norm_move_type(move_type)
+    dg = norm_desig(desig)
 
-    # Build deduplication query with timestamp-based filtering
-    additional_filters = []
-    params: List = [start, end, terminal_id]
-    
-    if mt:
-        additional_filters.append('AND UPPER(TRIM("MoveType")) = ?')
-        params.append(mt)
-    if dg:
-        additional_filters.append('AND UPPER(TRIM("Desig")) = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
+    # Latest model run per hour (MoveType/Desig codes, clamped pred)
+    terminal_filters, code_params = _code_filters(move_type, desig)
+    params: List = [start, end, terminal_id, *code_params]
     
     query = f"""
-    WITH base AS (
-      SELECT
-        "TerminalID",
-        UPPER(TRIM("MoveType")) AS "MoveType",
-        UPPER(TRIM("Desig")) AS "Desig",
-        "MoveDate_pred",
-        "MoveHour_pred",
-        TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) AS ts_pred,
-        "TokenCount_pred"::FLOAT AS pred,
-        "updated_at"
-      FROM {settings.VERTICA_TABLE_TOKENS}
-      WHERE TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) >= ? 
-        AND TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) < ?
-        AND "TerminalID" = ?
-        {terminal_filters}
-    ),
-    dedup AS (
-      SELECT
-        b.*,
-        ROW_NUMBER() OVER (
-          PARTITION BY "TerminalID", "MoveType", "Desig", "MoveDate_pred", "MoveHour_pred"
-          ORDER BY "updated_at" DESC
-        ) AS rn
-      FROM base b
-    )
-    SELECT "TerminalID", "MoveType", "Desig", "MoveDate_pred", "MoveHour_pred",
+    {latest_cte(terminal_filter='AND "TerminalID" = ?', filters=terminal_filters)}
+    SELECT "TerminalID", move_type_code, desig_code, "MoveDate_pred", "MoveHour_pred",
            pred, "updated_at"
-    FROM dedup 
-    WHERE rn = 1
+    FROM latest
     ORDER BY "MoveDate_pred", "MoveHour_pred"
     """
 
-    # capacity (simple: per-terminal stored in memory for now; swap with table later)
+    # placeholder; the route attaches the terminal's capacity
     capacity = settings.DEFAULT_CAPACITY_PER_HOUR
 
-    rows=[]
-    latest_updated = None
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(query, params)
-        for r in cur.iterate():
-            # r: tuple in the order of SELECT
-            terminal, mtv, dgv, d_pred, h_pred, pred_value, updated = r
-            # Compose localized timestamp
-            ts = datetime.combine(d_pred, datetime.min.time()).replace(hour=h_pred)
-            # treat as Asia/Dubai; if Vertica stores tz-naive dates/hours, we localize here:
-            ts = ts.replace(tzinfo=None).astimezone()  # make aware via system tz first
-            # force to Asia/Dubai (safe if machine in UTC)
-            import zoneinfo
-            ts = ts.astimezone(zoneinfo.ZoneInfo("Asia/Dubai"))
-
-            latest_updated = max(latest_updated, updated) if latest_updated else updated
-            rows.append(ForecastPoint(
-                ts=ts,
-                move_type=str(mtv).upper(),
-                desig=str(dgv).upper(),
-                terminal_id=terminal,
-                pred=float(pred_value) if pred_value is not None else 0.0,
-                actual=None,  # No actual data available in this table
-                lower=None, upper=None  # fill when you have intervals
-            ))
+    def local_ts(d, h):
+        # Compose localized timestamp
+        ts = datetime.combine(d, datetime.min.time()).replace(hour=h)
+        # treat as Asia/Dubai; if Vertica stores tz-naive dates/hours, we localize here:
+        ts = ts.replace(tzinfo=None).astimezone()  # make aware via system tz first
+        # force to Asia/Dubai (safe if machine in UTC)
+        return ts.astimezone(TZ)
+    rows, latest_updated = _forecast_rows(await aiodb.fetch_columns(query, params), local_ts)
 
     # fill gaps for any hours missing in DB (so charts stay continuous)
-    by_key = {(r.ts, r.move_type, r.desig): r for r in rows}
+    # first row per hour regardless of mt/dg if filters null
+    first = {}
+    for r in rows:
+        first.setdefault(r.ts.replace(minute=0, second=0, microsecond=0), r)
     filled=[]
     for ts in horizon:
-        key = (ts, by_key[next(iter(by_key))].move_type if by_key else (mt or "IN"), by_key[next(iter(by_key))].desig if by_key else (dg or "EXP"))
-        # safer: just search by ts regardless of mt/dg if filters null
-        match = next((r for r in rows if r.ts.replace(minute=0, second=0, microsecond=0)==ts.replace(minute=0, second=0, microsecond=0)), None)
+        match = first.get(ts.replace(minute=0, second=0, microsecond=0))
         if match:
             filled.append(match)
         else:
@@ -134,19 +146,54 @@ def next8h(
         updated_at=latest_updated or now_local(),
         capacity_per_hour=capacity
     )
+
+@router.get("/next8h_multi", response_model=Dict[str, Next8HResponse])
+async def next8h_multi(
+    terminal_ids: str = Query(..., description="Comma-separated terminal IDs"),
+    move_type: Optional[str] = Query(None, description="IN or OUT"),
+    desig: Optional[str] = Query(None, description="EMPTY, FULL, or EXP"),
+):
+    """
+    /forecast/next8h for several terminals at once, fetched concurrently;
+    keyed by terminal. Only terminals the registry knows are accepted; the
+    request is admitted once for all of them and the first to fail cancels
+    the others.
+    """
+    terminals = list(dict.fromkeys(t.strip() for t in terminal_ids.split(",") if t.strip()))
+    if not terminals:
+        raise HTTPException(status_code=422, detail="terminal_ids is empty")
+    known = set(registry.terminals())
+    unknown = [t for t in terminals if t not in known]
+    if unknown:
+        more = " ..." if len(unknown) > 10 else ""
+        raise HTTPException(status_code=422, detail=f"unknown terminal_ids: {', '.join(unknown[:10])}{more}")
+    calls = [(_next8h, {"terminal_id": t, "move_type": move_type, "desig": desig}) for t in terminals]
+    admit(*calls)
+    results = await aiodb.gather(*(fn(**kwargs) for fn, kwargs in calls))
+    return {t: _with_capacity(r, t) for t, r in zip(terminals, results)}
+
 @router.get("/range", response_model=Next8HResponse)  # reuse schema for now
-def range_hours(
+async def range_hours(
     terminal_id: str,
     start_iso: str,
     end_iso: str,
     move_type: Optional[str] = None,
     desig: Optional[str] = None,
+    max_points: Optional[int] = None,
 ):
-    from datetime import datetime
-    import zoneinfo
-
-    TZ = zoneinfo.ZoneInfo(settings.DEFAULT_TIMEZONE)
+    resp = await _range_hours(terminal_id, start_iso, end_iso, move_type, desig, max_points)
+    return _with_capacity(resp, terminal_id)
 
+@db_route()
+@preset_cached("today")
+async def _range_hours(
+    terminal_id: str,
+    start_iso: str,
+    end_iso: str,
+    move_type: Optional[str] = None,
+    desig: Optional[str] = None,
+    max_points: Optional[int] = None,
+):
     def parse_local_dt(s: str) -> datetime:
         # Accepts 'YYYY-MM-DDTHH:mm' (no timezone)
         # If timezone present, keep it; otherwise, assign Asia/Dubai
@@ -162,81 +209,44 @@ def range_hours(
         end   = parse_local_dt(end_iso)
         if end < start:
             raise ValueError("end before start")
-        # guardrail: max 14 days window for now
-        if (end - start).days > 14:
+        # end is inclusive here, so the window spans one more hour
+        resolution = choose_resolution(start, end + timedelta(hours=1), max_points)
+        # guardrail: hourly point series only; window aggregates in /analytics
+        # are prefix-sum lookups and need no such limit
+        if resolution == "hour" and (end - start).days > settings.MAX_RANGE_DAYS:
             raise ValueError("window too large")
     except Exception as e:
         raise HTTPException(status_code=422, detail=f"Bad start/end: {e}")
 
-    mt = norm_move_type(move_type) if move_type else None
-    dg = norm_desig(desig) if desig else None
+    mt = norm_move_type(move_type)
+    dg = norm_desig(desig)
 
-    # Build deduplication query with timestamp-based filtering
-    additional_filters = []
-    params: List = [start, end, terminal_id]
-    
-    if mt:
-        additional_filters.append('AND UPPER(TRIM("MoveType")) = ?')
-        params.append(mt)
-    if dg:
-        additional_filters.append('AND UPPER(TRIM("Desig")) = ?')
-        params.append(dg)
-    
-    terminal_filters = " ".join(additional_filters)
+    if resolution != "hour":
+        return await _range_rollup(terminal_id, start, end + timedelta(hours=1), resolution, move_type, desig)
+
+    # Latest model run per hour (MoveType/Desig codes, clamped pred)
+    terminal_filters, code_params = _code_filters(move_type, desig)
+    params: List = [start, end, terminal_id, *code_params]
 
     q = f"""
-    WITH base AS (
-      SELECT
-        "TerminalID",
-        UPPER(TRIM("MoveType")) AS "MoveType",
-        UPPER(TRIM("Desig")) AS "Desig",
-        "MoveDate_pred",
-        "MoveHour_pred",
-        TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) AS ts_pred,
-        "TokenCount_pred"::FLOAT AS pred,
-        "updated_at"
-      FROM {settings.VERTICA_TABLE_TOKENS}
-      WHERE TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) >= ? 
-        AND TIMESTAMPADD(hour, "MoveHour_pred", CAST("MoveDate_pred" AS TIMESTAMP)) < ?
-        AND "TerminalID" = ?
-        {terminal_filters}
-    ),
-    dedup AS (
-      SELECT
-        b.*,
-        ROW_NUMBER() OVER (
-          PARTITION BY "TerminalID", "MoveType", "Desig", "MoveDate_pred", "MoveHour_pred"
-          ORDER BY "updated_at" DESC
-        ) AS rn
-      FROM base b
-    )
-    SELECT "TerminalID", "MoveType", "Desig", "MoveDate_pred", "MoveHour_pred",
+    {latest_cte(terminal_filter='AND "TerminalID" = ?', filters=terminal_filters)}
+    SELECT "TerminalID", move_type_code, desig_code, "MoveDate_pred", "MoveHour_pred",
            pred, "updated_at"
-    FROM dedup 
-    WHERE rn = 1
+    FROM latest
     ORDER BY "MoveDate_pred", "MoveHour_pred"
     """
 
-    rows=[]; latest=None
-    with get_conn() as conn:
-        cur=conn.cursor(); cur.execute(q, params)
-        for r in cur.iterate():
-            terminal, mtv, dgv, d_pred, h_pred, pred_value, upd = r
-            ts = datetime.combine(d_pred, datetime.min.time()).replace(hour=h_pred)
-            import zoneinfo
-            ts = ts.replace(tzinfo=zoneinfo.ZoneInfo(settings.DEFAULT_TIMEZONE))
-            latest = upd if latest is None or upd>latest else latest
-            rows.append(ForecastPoint(
-                ts=ts, move_type=str(mtv).upper(), desig=str(dgv).upper(),
-                terminal_id=terminal, pred=float(pred_value or 0), actual=None  # No actual data available
-            ))
+    rows, latest = _forecast_rows(await aiodb.fetch_columns(q, params),
+                                  lambda d, h: datetime.combine(d, datetime.min.time()).replace(hour=h, tzinfo=TZ))
 
     # fill missing hours in window
-    from ..utils.timebox import TZ as _TZ
+    first = {}
+    for x in rows:
+        first.setdefault(x.ts, x)
     cursor = start
     filled=[]
     while cursor <= end:
-        m = next((x for x in rows if x.ts==cursor), None)
+        m = first.get(cursor)
         if m: filled.append(m)
         else:
             filled.append(ForecastPoint(ts=cursor, move_type=mt or "IN", desig=dg or "EXP",
@@ -249,3 +259,34 @@ def range_hours(
         updated_at=latest or now_local(),
         capacity_per_hour=settings.DEFAULT_CAPACITY_PER_HOUR
     )
+
+async def _range_rollup(terminal_id: str, start: datetime, end: datetime, resolution: str,
+                  move_type: Optional[str], desig: Optional[str]) -> Next8HResponse:
+    """
+    /forecast/range for windows too long for hourly points: day/week buckets
+    per (move_type, desig) from the analytics cube (normalized, deduplicated,
+    clamped), with empty buckets zero-filled.
+    """
+    mt, dg = norm_move_type(move_type), norm_desig(desig)
+    r = await aiodb.run(cube.rollup, start, end, resolution, terminal=registry.lookup(terminal_id),
+                        move_type=codes.move_type_filter(move_type),
+                        desig=codes.desig_filter(desig))
+    points = []
+    for j, ts in enumerate(r.starts):
+        found = False
+        for i, (t, mtv, dgv) in enumerate(r.keys):
+            if r.counts[i, j] > 0:
+                found = True
+                points.append(ForecastPoint(ts=ts, move_type=codes.MOVE_TYPES[mtv],
+                                            desig=codes.DESIGS[dgv], terminal_id=registry.name(t),
+                                            pred=float(r.sums[i, j])))
+        if not found:
+            points.append(ForecastPoint(ts=ts, move_type=mt or "IN", desig=dg or "EXP",
+                                        terminal_id=terminal_id, pred=0.0))
+    return Next8HResponse(
+        horizon_hours=points,
+        generated_at=now_local(),
+        updated_at=freshness.watermark or now_local(),
+        capacity_per_hour=settings.DEFAULT_CAPACITY_PER_HOUR,
+        resolution=resolution,
+    )
@@ -1,8 +1,18 @@
 # server/app/routers/meta.py
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
 from backend.db import get_conn
-from backend.config import settings
+from backend.auth import require_admin
+from backend import latest_runs, schema
+from backend.data_quality import telemetry
+from backend.freshness import freshness as tracker
+from backend.registry import registry
+from backend.db import pool
+from backend.executor import executor, db_route, CUSTOM
+from backend.profiling import profiles
+from backend.saturation import monitor
 from backend.schemas import FreshnessResponse
+from backend.stale import last_good
 from backend.utils.timebox import now_local
 from datetime import date
 
@@ -10,26 +20,74 @@ router = APIRouter(prefix="/meta", tags=["meta"])
 
 @router.get("/freshness", response_model=FreshnessResponse)
 def freshness():
-    q = f"""
-    SELECT MAX(updated_at), COUNT(*)
-    FROM {settings.VERTICA_TABLE_TOKENS}
-    WHERE "MoveDate_pred" >= CURRENT_DATE - INTERVAL '1 day'
-    """
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(q)
-        max_upd, cnt = cur.fetchone()
-    return FreshnessResponse(updated_at=max_upd or now_local(), row_count_last_24h=int(cnt or 0))
+    # served from memory; the tracker's poller keeps it current
+    snap = tracker.snapshot()
+    return FreshnessResponse(**{**snap, "updated_at": snap["updated_at"] or now_local()})
 
 @router.get("/enums")
 def enums():
-    from backend.config import settings
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(f"SELECT DISTINCT TerminalID FROM {settings.VERTICA_TABLE_TOKENS} ORDER BY 1")
-        terminals = [r[0] for r in cur.fetchall()]
+    # served from the registry; refreshed in the background on new model runs
     return {
-        "terminals": terminals,                    # e.g., ["T1","T2","T3","T4"]
+        "terminals": registry.terminals(),         # e.g., ["T1","T2","T3","T4"]
         "move_types": ["ALL","IN","OUT"],
         "desigs": ["ALL","EMPTY","FULL","EXP"],
+        "observed": registry.observed(),           # values present in the data
     }
+
+@router.get("/metrics")
+def metrics():
+    """
+    Request executor (queue depth, waits, shedding), connection pool
+    (in use, checkout waits), saturation gauges (event-loop lag,
+    Starlette's thread pool, requests in flight per route) and the
+    last-good store (stale responses served, background refreshes).
+    """
+    return {"executor": executor.stats(), "db_pool": pool.stats(), "saturation": monitor.snapshot(),
+            "stale": last_good.stats()}
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    """Recent ?profile=1 requests (newest first) with their timing breakdown."""
+    return [p.to_dict() for p in profiles.recent()]
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_profile(profile_id: int, format: str = "json"):
+    """
+    One request profile. format=folded returns its stack samples as folded
+    stacks ("frame;frame;... count" per line) for flamegraph.pl or speedscope.
+    """
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(404, f"no profile {profile_id} (only the last few are kept)")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return {**profile.to_dict(), "top_stacks": profile.folded().splitlines()[:20]}
+
+@router.get("/data_quality")
+def data_quality():
+    """
+    Data-quality counters since startup (or the last reset): occurrences per
+    (endpoint, kind, value), e.g. ("ingest", "move_type_unknown", "XFER").
+    """
+    return telemetry.snapshot()
+
+@router.delete("/data_quality", dependencies=[Depends(require_admin)])
+def reset_data_quality():
+    telemetry.reset()
+    return telemetry.snapshot()
+
+@router.post("/refresh", dependencies=[Depends(require_admin)])
+@db_route(CUSTOM, timeout=0)  # the MERGE may legitimately run long
+def refresh():
+    """
+    ETL hook: call after a model run is loaded. Applies pending schema
+    migrations, merges the new run into the hourly latest-run table and
+    polls the freshness tracker right away, so its subscribers drop the
+    cube, reload the registry and rebuild the presets without waiting for
+    the next poll.
+    """
+    merged = latest_runs.refresh()
+    tracker.poll()
+    with get_conn() as conn:
+        version = schema.current_version(conn)
+    return {"merged_rows": merged, "schema_version": version, "refreshed_at": now_local()}
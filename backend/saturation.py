@@ -0,0 +1,164 @@
+# server/app/saturation.py
+"""
+Saturation gauges, for telling which layer a latency spike comes from.
+
+A coroutine on the serving event loop samples every
+SATURATION_SAMPLE_MS:
+
+  event_loop    lag: how late a sleep(interval) wakes up, i.e. how long
+                something held the loop (sync work in an async route,
+                heavy serialization)
+  thread_pool   Starlette's worker threads (anyio's default limiter) that
+                run sync routes and dependencies: busy, and tasks waiting
+                for a free one
+  to_thread     the loop's default executor (asyncio.to_thread): threads
+                and queued work items
+  requests      requests inside an endpoint, in total and per route
+                (with each route's peak between two samples)
+
+and keeps SATURATION_WINDOW_SECONDS of samples, so /meta/metrics shows the
+current value next to the window's average and maximum: a spike that came
+and went between two scrapes still shows up in the maximum. The DB
+executor's queues and the connection pool's checkout waits are reported
+by executor.stats() and db.pool.stats() next to these.
+"""
+import asyncio
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from anyio import to_thread
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InFlight:
+    """Requests currently inside an endpoint, per route, and the peaks between samples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, int] = collections.Counter()
+        self._peaks: Dict[str, int] = collections.Counter()
+
+    @contextmanager
+    def track(self, route: str):
+        with self._lock:
+            self._routes[route] += 1
+            self._peaks[route] = max(self._peaks[route], self._routes[route])
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._routes[route] -= 1
+
+    def snapshot(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """(in flight now, peak since the previous snapshot) per route."""
+        with self._lock:
+            now = {r: n for r, n in self._routes.items() if n}
+            peaks = {r: n for r, n in self._peaks.items() if n}
+            self._peaks = collections.Counter(now)
+        return now, peaks
+
+
+inflight = InFlight()
+
+
+def _stats(values) -> Dict[str, float]:
+    values = list(values)
+    if not values:
+        return {"avg": 0.0, "max": 0.0}
+    return {"avg": round(sum(values) / len(values), 2), "max": round(max(values), 2)}
+
+
+class SaturationMonitor:
+    def __init__(self, interval_ms: int = settings.SATURATION_SAMPLE_MS,
+                 window_seconds: int = settings.SATURATION_WINDOW_SECONDS):
+        self.interval = interval_ms / 1000
+        self.window = window_seconds
+        self._samples: Deque[Tuple[float, Dict[str, Any]]] = collections.deque()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _sample(self, lag: float) -> Dict[str, Any]:
+        # on the event loop: anyio's limiter is per loop
+        limiter = to_thread.current_default_thread_limiter().statistics()
+        executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+        routes, peaks = inflight.snapshot()
+        return {
+            "lag_ms": lag * 1000,
+            "threads_limit": limiter.total_tokens,
+            "threads_busy": limiter.borrowed_tokens,
+            "threads_waiting": limiter.tasks_waiting,
+            "to_thread_threads": len(getattr(executor, "_threads", ())),
+            "to_thread_queued": executor._work_queue.qsize() if executor is not None else 0,
+            "in_flight": sum(routes.values()),
+            "routes": routes,
+            "peaks": peaks,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - t - self.interval, 0.0)
+            try:
+                sample = self._sample(lag)
+            except Exception:
+                logger.exception("Saturation sample failed")
+                continue
+            now = time.time()
+            with self._lock:
+                self._samples.append((now, sample))
+                while self._samples and now - self._samples[0][0] > self.window:
+                    self._samples.popleft()
+
+    def start(self):
+        """Start sampling on the running event loop (call from a startup handler)."""
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = [s for _, s in self._samples]
+        if not samples:
+            return {"running": self._task is not None, "samples": 0}
+        last = samples[-1]
+
+        def gauge(key: str) -> Dict[str, float]:
+            return {"now": round(last[key], 2), **_stats(s[key] for s in samples)}
+
+        routes = {r for s in samples for r in s["peaks"]}
+        return {
+            "running": self._task is not None,
+            "samples": len(samples),
+            "interval_ms": round(self.interval * 1000),
+            "window_seconds": self.window,
+            "event_loop": {"lag_ms": gauge("lag_ms")},
+            "thread_pool": {
+                "limit": last["threads_limit"],
+                "busy": gauge("threads_busy"),
+                "waiting": gauge("threads_waiting"),
+            },
+            "to_thread": {"threads": last["to_thread_threads"], "queued": gauge("to_thread_queued")},
+            "requests": {
+                "in_flight": gauge("in_flight"),
+                "by_route": {
+                    r: {"now": last["routes"].get(r, 0), "max": max(s["peaks"].get(r, 0) for s in samples)}
+                    for r in sorted(routes)
+                },
+            },
+        }
+
+
+monitor = SaturationMonitor()
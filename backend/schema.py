@@ -0,0 +1,186 @@
+# server/app/schema.py
+"""
+Schema management for the Vertica objects this backend owns.
+
+The backend maintains one pre-aggregated table next to the ETL-owned
+tokens table (settings.VERTICA_TABLE_TOKENS): the hourly latest-run table
+(settings.VERTICA_TABLE_LATEST), normalized, deduplicated and clamped at
+(TerminalID, MoveType, Desig, date, hour) grain, plus the projections that
+serve its readers. It also owns the capacity table edited through
+/capacity (settings.VERTICA_TABLE_CAPACITY). Objects are created by numbered migrations recorded in
+a version table, so every API process (and `python -m backend.schema`)
+brings the database to the same state; all statements are idempotent.
+
+The incremental refresh lives in latest_runs.refresh(); the ETL can
+trigger it right after loading a model run via POST /meta/refresh.
+"""
+import logging
+import sys
+import threading
+from typing import Callable, List, Tuple
+
+from backend.config import settings
+from backend.db import get_conn
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+def _schema_of(table: str) -> str:
+    schema, _, _ = table.rpartition(".")
+    return schema or "public"
+
+
+def version_table() -> str:
+    return f"{_schema_of(settings.VERTICA_TABLE_LATEST)}.GATE_DASHBOARD_SCHEMA_VERSION"
+
+
+def _latest_table() -> List[str]:
+    return [f"""
+    CREATE TABLE IF NOT EXISTS {settings.VERTICA_TABLE_LATEST} (
+      "TerminalID"    VARCHAR(32) NOT NULL,
+      "MoveType"      VARCHAR(8)  NOT NULL,
+      "Desig"         VARCHAR(8)  NOT NULL,
+      "MoveDate_pred" DATE        NOT NULL,
+      "MoveHour_pred" INT         NOT NULL,
+      ts_pred         TIMESTAMP   NOT NULL,
+      pred            FLOAT       NOT NULL,
+      "updated_at"    TIMESTAMP   NOT NULL
+    )
+    ORDER BY ts_pred, "TerminalID", "MoveType", "Desig"
+    SEGMENTED BY HASH("TerminalID", "MoveDate_pred") ALL NODES
+    """]
+
+
+def _terminal_projection() -> List[str]:
+    # /forecast/next8h and /forecast/range always filter on one terminal
+    return [f"""
+    CREATE PROJECTION IF NOT EXISTS {settings.VERTICA_TABLE_LATEST}_terminal_proj AS
+      SELECT "TerminalID", ts_pred, "MoveType", "Desig", "MoveDate_pred", "MoveHour_pred",
+             pred, "updated_at"
+      FROM {settings.VERTICA_TABLE_LATEST}
+      ORDER BY "TerminalID", ts_pred
+      SEGMENTED BY HASH("TerminalID", "MoveDate_pred") ALL NODES
+    """, "SELECT START_REFRESH()"]
+
+
+def _delta_projection() -> List[str]:
+    # the incremental refresh reads tokens rows by updated_at > watermark
+    return [f"""
+    CREATE PROJECTION IF NOT EXISTS {settings.VERTICA_TABLE_TOKENS}_delta_proj AS
+      SELECT "updated_at", "TerminalID", "MoveType", "Desig", "MoveDate_pred", "MoveHour_pred",
+             "TokenCount_pred"
+      FROM {settings.VERTICA_TABLE_TOKENS}
+      ORDER BY "updated_at"
+      SEGMENTED BY HASH("TerminalID") ALL NODES
+    """, "SELECT START_REFRESH()"]
+
+
+def _code_columns() -> List[str]:
+    # MoveType/Desig as small-integer codes (codes.py) so readers filter and
+    # group on integers; existing rows are back-filled from the names
+    t = settings.VERTICA_TABLE_LATEST
+    return [
+        f"""ALTER TABLE {t} ADD COLUMN IF NOT EXISTS move_type_code INT
+            DEFAULT DECODE("MoveType", 'IN', 1, 'OUT', 2, 0) NOT NULL ALL PROJECTIONS""",
+        f"""ALTER TABLE {t} ADD COLUMN IF NOT EXISTS desig_code INT
+            DEFAULT DECODE("Desig", 'EMPTY', 1, 'FULL', 2, 'EXP', 3, 0) NOT NULL ALL PROJECTIONS""",
+    ]
+
+
+def _capacity_table() -> List[str]:
+    # one row per terminal; tiny, so replicated on every node
+    return [f"""
+    CREATE TABLE IF NOT EXISTS {settings.VERTICA_TABLE_CAPACITY} (
+      "TerminalID"      VARCHAR(32) NOT NULL PRIMARY KEY,
+      capacity_per_hour INT         NOT NULL,
+      "updated_at"      TIMESTAMP   NOT NULL
+    )
+    UNSEGMENTED ALL NODES
+    """]
+
+
+def _capacity_calendar() -> List[str]:
+    # recurring shift rules and one-off overrides per terminal (capacity.py)
+    t = settings.VERTICA_TABLE_CAPACITY
+    return [f"""
+    CREATE TABLE IF NOT EXISTS {t}_RULES (
+      "TerminalID"      VARCHAR(32) NOT NULL,
+      seq               INT         NOT NULL,
+      weekdays          VARCHAR(16) NOT NULL,
+      start_hour        INT         NOT NULL,
+      end_hour          INT         NOT NULL,
+      capacity_per_hour INT         NOT NULL
+    )
+    UNSEGMENTED ALL NODES
+    """, f"""
+    CREATE TABLE IF NOT EXISTS {t}_OVERRIDES (
+      "TerminalID"      VARCHAR(32)  NOT NULL,
+      seq               INT          NOT NULL,
+      start_ts          TIMESTAMP    NOT NULL,
+      end_ts            TIMESTAMP    NOT NULL,
+      capacity_per_hour INT          NOT NULL,
+      reason            VARCHAR(256) NOT NULL
+    )
+    UNSEGMENTED ALL NODES
+    """]
+
+
+# (version, description, statements); append only, never edit a shipped entry
+MIGRATIONS: List[Tuple[int, str, Callable[[], List[str]]]] = [
+    (1, "hourly latest-run aggregate table", _latest_table),
+    (2, "terminal-first projection for forecast reads", _terminal_projection),
+    (3, "updated_at projection on tokens for incremental refresh", _delta_projection),
+    (4, "MoveType/Desig code columns", _code_columns),
+    (5, "per-terminal capacity table", _capacity_table),
+    (6, "capacity shift rules and overrides", _capacity_calendar),
+]
+
+
+def current_version(conn) -> int:
+    cur = conn.cursor()
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {version_table()} (
+      version     INT          NOT NULL,
+      description VARCHAR(256) NOT NULL,
+      applied_at  TIMESTAMP    NOT NULL DEFAULT NOW()
+    )
+    """)
+    cur.execute(f"SELECT COALESCE(MAX(version), 0) FROM {version_table()}")
+    return int(cur.fetchone()[0])
+
+
+def migrate(conn=None) -> int:
+    """Apply every pending migration; returns the resulting schema version."""
+    if conn is None:
+        with get_conn() as own:
+            return migrate(own)
+    with _lock:
+        version = current_version(conn)
+        cur = conn.cursor()
+        for v, description, statements in MIGRATIONS:
+            if v <= version:
+                continue
+            logger.info(f"Applying schema migration {v}: {description}")
+            for stmt in statements():
+                cur.execute(stmt)
+                if cur.description:
+                    cur.fetchall()
+            cur.execute(f"INSERT INTO {version_table()} (version, description) VALUES (?, ?)",
+                        [v, description])
+            version = v
+        return version
+
+
+if __name__ == "__main__":
+    # python -m backend.schema          apply pending migrations
+    # python -m backend.schema --print  print every migration's DDL
+    logging.basicConfig(level=logging.INFO)
+    if "--print" in sys.argv[1:]:
+        for v, description, statements in MIGRATIONS:
+            print(f"-- {v}: {description}")
+            for stmt in statements():
+                print(stmt.strip() + ";\n")
+    else:
+        print(f"schema version {migrate()}")
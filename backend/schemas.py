@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime, date
 
 class ForecastPoint(BaseModel):
@@ -17,16 +17,70 @@ class Next8HResponse(BaseModel):
     generated_at: datetime
     updated_at: datetime
     capacity_per_hour: int
+    resolution: str = "hour"     # hour | day | week (bucket size of horizon_hours)
+    # hourly resolution: the terminal's calendar capacity at each point's ts
+    capacity_by_hour: Optional[List[int]] = None
+    # set when served from the last good result while Vertica is failing (see stale.py)
+    stale: bool = False
+    age_seconds: Optional[float] = None
+    computed_at: Optional[datetime] = None
 
 class FreshnessResponse(BaseModel):
     updated_at: datetime
     row_count_last_24h: int
+    rows_by_day: Dict[date, int] = {}       # MoveDate_pred -> rows, from yesterday on
+    landed_at: Optional[datetime] = None    # when the API saw the latest model run land
+    checked_at: Optional[datetime] = None   # last poll of the tokens table
+
+class CapacityRule(BaseModel):
+    # recurring shift: [start_hour, end_hour) local on each weekday (0=Mon..6=Sun);
+    # end_hour <= start_hour runs past midnight into the next day
+    weekdays: List[int] = Field(default_factory=lambda: list(range(7)))
+    start_hour: int = Field(..., ge=0, le=23)
+    end_hour: int = Field(..., ge=0, le=24)
+    capacity_per_hour: int = Field(..., ge=0)
+
+class CapacityOverride(BaseModel):
+    # one-off window (maintenance, holiday), local hours [start, end)
+    start: datetime
+    end: datetime
+    capacity_per_hour: int = Field(..., ge=0)
+    reason: str = ""
 
 class CapacityGetResponse(BaseModel):
     terminal_id: str
-    capacity_per_hour: int
+    capacity_per_hour: int                  # base: hours no rule or override covers
     updated_at: datetime
+    rules: List[CapacityRule] = []          # later rules win where they overlap
+    overrides: List[CapacityOverride] = []  # win over rules; later ones win
 
 class CapacityPutRequest(BaseModel):
     terminal_id: str
-    capacity_per_hour: int
+    capacity_per_hour: int = Field(..., ge=0)
+    rules: Optional[List[CapacityRule]] = None          # None keeps the stored calendar; [] clears it
+    overrides: Optional[List[CapacityOverride]] = None
+
+class CapacityChange(BaseModel):
+    # capacity for one terminal over [start, end) of the window (open ends = whole window)
+    terminal_id: str
+    capacity_per_hour: int = Field(..., ge=0)
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+class CapacityScenario(BaseModel):
+    name: str
+    changes: List[CapacityChange] = []
+
+class WhatIfRequest(BaseModel):
+    start_iso: str
+    end_iso: str
+    move_type: Optional[str] = None
+    desig: Optional[str] = None
+    scenarios: List[CapacityScenario]
+
+class CapacityBulkResponse(BaseModel):
+    capacities: List[CapacityGetResponse]   # every known terminal, configured or at the default
+    default_capacity_per_hour: int
+
+class CapacityBulkPutRequest(BaseModel):
+    capacities: List[CapacityPutRequest]
@@ -0,0 +1,252 @@
+# server/app/stale.py
+"""
+Stale-while-revalidate for the read endpoints.
+
+Every result a preset-cached endpoint computes (by a request or by the
+preset scheduler) is kept as the last good result for its call: endpoint,
+window and filters (see precompute.call_key). When Vertica is struggling,
+typically under ETL load, a request for a call with a last good result no
+older than STALE_MAX_SECONDS
+
+  - gets that result when its own query fails with a database error, a
+    pool timeout or executor shedding, or has not finished after
+    STALE_AFTER_SECONDS;
+  - starts a single background refresh for the call (the slow query keeps
+    running, a failed one is retried every STALE_RETRY_SECONDS, doubling
+    up to STALE_RETRY_MAX_SECONDS) until a result lands or the last good
+    one ages past STALE_MAX_SECONDS;
+  - while that refresh is pending, later requests for the call get the
+    last good result straight away instead of queueing more queries on
+    the database.
+
+Stale results are marked in `meta` (stale, age_seconds, computed_at);
+forecast responses, which have no meta, carry the same fields at the top
+level. Endpoints that build their response from a stale intermediate
+(utilization, what-if) pick the mark up through get_metadata(). Calls
+without a last good result, or with one that is too old, fail as before.
+"""
+import asyncio
+import collections
+import contextvars
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from backend.cancellation import current_scope
+from backend.config import settings
+from backend.utils.timebox import TZ
+
+logger = logging.getLogger(__name__)
+
+# oldest stale result served to the current request (set where it is served,
+# seen by the awaiting endpoint)
+_served: contextvars.ContextVar[Optional[Tuple[float, float]]] = contextvars.ContextVar("stale_served", default=None)
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at", "refresh")
+
+    def __init__(self, value: Any, stored_at: float):
+        self.value = value
+        self.stored_at = stored_at
+        self.refresh: Optional[asyncio.Task] = None  # the call's pending background refresh
+
+    def age(self) -> float:
+        return max(time.time() - self.stored_at, 0.0)
+
+
+def _name(key: Hashable) -> str:
+    return str(key[0]) if isinstance(key, tuple) and key else str(key)
+
+
+def _marks(age: float, stored_at: float) -> Dict[str, Any]:
+    return {
+        "stale": True,
+        "age_seconds": round(age, 1),
+        "computed_at": datetime.fromtimestamp(stored_at, TZ),
+    }
+
+
+def mark(value: Any, entry: _Entry) -> Any:
+    """`value` marked as served stale: in its meta, or as fields of a response model."""
+    marks = _marks(entry.age(), entry.stored_at)
+    if isinstance(value, dict) and isinstance(value.get("meta"), dict):
+        return {**value, "meta": {**value["meta"], **marks, "computed_at": marks["computed_at"].isoformat()}}
+    if isinstance(value, BaseModel) and "stale" in type(value).model_fields:
+        return value.model_copy(update=marks)
+    return value
+
+
+def served() -> Dict[str, Any]:
+    """Stale marks for the current request's meta ({} when everything was fresh)."""
+    s = _served.get()
+    if s is None:
+        return {}
+    marks = _marks(*s)
+    return {**marks, "computed_at": marks["computed_at"].isoformat()}
+
+
+class LastGood:
+    """Last good result per call, oldest first, bounded by count and age."""
+
+    def __init__(self, max_entries: int = settings.STALE_MAX_ENTRIES,
+                 max_seconds: float = settings.STALE_MAX_SECONDS):
+        self.max_entries = max_entries
+        self.max_seconds = max_seconds
+        self._entries: "collections.OrderedDict[Hashable, _Entry]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._served = 0
+        self._refreshes = 0
+        self._failed_refreshes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_seconds > 0 and self.max_entries > 0
+
+    def put(self, key: Hashable, value: Any, stored_at: Optional[float] = None):
+        if not self.enabled or key is None:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None and old.refresh is not None:
+                # superseded by this result (put() also runs on the preset scheduler's thread)
+                old.refresh.get_loop().call_soon_threadsafe(old.refresh.cancel)
+            self._entries[key] = _Entry(value, now if stored_at is None else stored_at)
+            while self._entries:
+                first = next(iter(self._entries.values()))
+                if len(self._entries) <= self.max_entries and now - first.stored_at <= self.max_seconds:
+                    break
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[_Entry]:
+        """The call's last good result, unless it is older than max_seconds."""
+        if not self.enabled or key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.age() > self.max_seconds:
+            return None
+        return entry
+
+    def _stale(self, entry: _Entry) -> Any:
+        with self._lock:
+            self._served += 1
+        prev = _served.get()
+        age = entry.age()
+        if prev is None or age > prev[0]:
+            _served.set((age, entry.stored_at))
+        return mark(entry.value, entry)
+
+    async def serve(self, key: Hashable, compute: Callable[[], Awaitable[Any]],
+                    unavailable: Tuple[Type[BaseException], ...]) -> Any:
+        """
+        compute() for `key`, falling back to the last good result (see the
+        module docstring). compute must be safe to call again outside the
+        request (it is what the background refresh retries); `unavailable`
+        are the errors that mean the database is struggling.
+        """
+        entry = self.get(key)
+        if entry is None:
+            result = await compute()
+            self.put(key, result)
+            return result
+        if entry.refresh is not None:
+            return self._stale(entry)
+
+        task = asyncio.ensure_future(compute())
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), settings.STALE_AFTER_SECONDS or None)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        except Exception as e:
+            if not task.done():
+                # the query carries on as the call's refresh; its result lands in the store
+                logger.warning(f"{_name(key)}: no result after {settings.STALE_AFTER_SECONDS}s; "
+                               f"serving the last good one")
+                self._adopt(key, entry, task, compute, unavailable)
+                return self._stale(entry)
+            scope = current_scope()
+            if not isinstance(e, unavailable) or (scope is not None and scope.cancelled):
+                raise  # not the database's fault, or the client left and nobody is served
+            logger.warning(f"{_name(key)}: {type(e).__name__}: {e}; serving the last good one")
+            self._start_retries(key, entry, compute, unavailable)
+            return self._stale(entry)
+        self.put(key, result)
+        return result
+
+    def _adopt(self, key, entry: _Entry, task: asyncio.Future, compute, unavailable):
+        entry.refresh = task
+
+        def landed(t: asyncio.Future):
+            if t.cancelled():
+                if entry.refresh is t:
+                    entry.refresh = None
+                return
+            if t.exception() is None:
+                self.put(key, t.result())
+            elif isinstance(t.exception(), unavailable) and entry.refresh is t:
+                entry.refresh = None
+                self._start_retries(key, entry, compute, unavailable)
+            elif entry.refresh is t:
+                entry.refresh = None
+
+        task.add_done_callback(landed)
+
+    def _start_retries(self, key, entry: _Entry, compute, unavailable):
+        # outside the request's context: no cancellation scope, profile or trace
+        loop = asyncio.get_running_loop()
+        entry.refresh = loop.create_task(self._retry(key, entry, compute, unavailable),
+                                         context=contextvars.Context())
+
+    async def _retry(self, key, entry: _Entry, compute, unavailable):
+        delay = settings.STALE_RETRY_SECONDS
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                if entry.age() > self.max_seconds:
+                    logger.warning(f"{_name(key)}: last good result "
+                                   f"is past {self.max_seconds}s; giving up the background refresh")
+                    return
+                with self._lock:
+                    self._refreshes += 1
+                try:
+                    result = await compute()
+                except unavailable as e:
+                    with self._lock:
+                        self._failed_refreshes += 1
+                    delay = min(delay * 2, settings.STALE_RETRY_MAX_SECONDS)
+                    logger.info(f"{_name(key)}: background refresh failed ({type(e).__name__}); retrying in {delay}s")
+                    continue
+                except Exception:
+                    logger.exception(f"{_name(key)}: background refresh failed")
+                    return
+                entry.refresh = None
+                self.put(key, result)
+                return
+        finally:
+            if entry.refresh is asyncio.current_task():
+                entry.refresh = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = list(self._entries.values())
+            served_total, refreshes, failed = self._served, self._refreshes, self._failed_refreshes
+        return {
+            "enabled": self.enabled,
+            "entries": len(entries),
+            "max_entries": self.max_entries,
+            "max_seconds": self.max_seconds,
+            "refreshing": sum(1 for e in entries if e.refresh is not None),
+            "served_stale": served_total,
+            "background_refreshes": refreshes,
+            "failed_refreshes": failed,
+        }
+
+
+last_good = LastGood()
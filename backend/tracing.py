@@ -0,0 +1,310 @@
+# server/app/tracing.py
+"""
+Lightweight request tracing.
+
+With TRACING_ENABLED every HTTP request becomes a trace: a root span with
+the route, window length, filters, status and row counts, and child spans
+for the endpoint, executor jobs (with their queue wait), pool acquire,
+each statement execute, fetch loops and response encoding. Spans follow
+the request through asyncio.gather and onto the DB executor's workers
+(the current span is a context variable, copied with the request's
+context), so the panels of one dashboard refresh show up side by side.
+
+Finished traces go to an in-process collector (the last TRACE_KEEP,
+served by GET /diagnostics/traces) and, with TRACE_FILE set, are appended
+to that file. Both use the Trace Event Format ("X" complete events, one
+per span, with trace/span/parent ids in args), which chrome://tracing and
+Perfetto (ui.perfetto.dev) open directly; the file is a JSON array whose
+closing bracket is left off, as the format allows, so it can be appended
+to while it is being read.
+
+Outside a traced request span() is a no-op costing one context variable
+lookup.
+"""
+import collections
+import contextvars
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from backend.config import settings
+from backend.utils.timebox import TZ
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = time.time() - time.perf_counter()  # perf_counter -> unix seconds
+_PID = os.getpid()
+# query parameters recorded on the root span
+_FILTERS = ("start_iso", "end_iso", "terminal_id", "terminal_ids", "move_type", "desig", "format")
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List["Span"] = []
+        self.rows = 0
+        self.statements = 0
+        self.endpoint_done: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, span: "Span"):
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, rows: int = 0, statements: int = 0):
+        with self._lock:
+            self.rows += rows
+            self.statements += statements
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start", "end", "tid")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attrs: Dict[str, Any],
+                 start: Optional[float] = None):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter() if start is None else start
+        self.end: Optional[float] = None
+        self.tid = threading.get_ident()
+
+    def finish(self, end: Optional[float] = None):
+        self.end = time.perf_counter() if end is None else end
+        self.trace.add(self)
+
+    def event(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "cat": "request" if self.parent_id is None else "span",
+            "ph": "X",
+            "ts": round((_EPOCH + self.start) * 1e6),
+            "dur": round((self.end - self.start) * 1e6),
+            "pid": _PID,
+            "tid": self.tid,
+            "args": {"trace_id": self.trace.trace_id, "span_id": self.span_id,
+                     "parent_id": self.parent_id, **self.attrs},
+        }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def start_span(name: str, **attrs) -> Optional[Span]:
+    """A child of the current span, not made current; finish() it. None outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, name, parent.span_id, attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Run the block as a child span of the current one (a no-op outside a trace)."""
+    s = start_span(name, **attrs)
+    if s is None:
+        yield None
+        return
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        s.finish()
+
+
+def statement(sql: str, limit: int = 300) -> str:
+    """SQL as a span attribute: whitespace collapsed, truncated."""
+    text = re.sub(r"\s+", " ", sql).strip()
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+class _TracedCursor:
+    def __init__(self, cur):
+        self._cur = cur
+
+    def execute(self, sql, *args, **kwargs):
+        with span("db.execute", statement=statement(sql)) as s:
+            result = self._cur.execute(sql, *args, **kwargs)
+            if s is not None:
+                s.trace.count(statements=1)
+            return result
+
+    def executemany(self, sql, seq, *args, **kwargs):
+        seq = list(seq)
+        with span("db.execute", statement=statement(sql), batch=len(seq)) as s:
+            result = self._cur.executemany(sql, seq, *args, **kwargs)
+            if s is not None:
+                s.trace.count(statements=1)
+            return result
+
+    def fetchall(self):
+        with span("db.fetch") as s:
+            rows = self._cur.fetchall()
+            if s is not None:
+                s.attrs["rows"] = len(rows)
+                s.trace.count(rows=len(rows))
+            return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)  # fetchmany loops are spanned by their caller
+
+
+class TracedConnection:
+    """A connection whose cursors record execute and fetchall spans."""
+
+    def __init__(self, conn):
+        object.__setattr__(self, "_conn", conn)
+
+    def cursor(self, *args, **kwargs):
+        return _TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+class TraceCollector:
+    """The last `keep` traces in memory, optionally appended to `path`."""
+
+    def __init__(self, keep: int = settings.TRACE_KEEP, path: str = settings.TRACE_FILE):
+        self._traces: Deque[Dict[str, Any]] = collections.deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.path = path
+        self._file = None
+        self._named: set = set()
+
+    def add(self, trace: Trace, root: Span):
+        with trace._lock:
+            spans = list(trace.spans)
+        events = [s.event() for s in spans]
+        summary = {
+            "trace_id": trace.trace_id,
+            "started_at": datetime.fromtimestamp(_EPOCH + root.start, TZ).isoformat(),
+            "duration_ms": round((root.end - root.start) * 1000, 2),
+            "spans": len(events),
+            **root.attrs,
+        }
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        with self._lock:
+            self._traces.append({"start": _EPOCH + root.start, "summary": summary, "events": events})
+            if self.path:
+                self._write(events, threads)
+
+    def _write(self, events: List[Dict[str, Any]], threads: Dict[int, str]):
+        try:
+            if self._file is None:
+                fresh = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                self._file = open(self.path, "a", encoding="utf-8")
+                if fresh:
+                    self._file.write("[\n")
+            for e in events:
+                if e["tid"] not in self._named:  # thread names, once per file handle
+                    self._named.add(e["tid"])
+                    self._file.write(json.dumps({"name": "thread_name", "ph": "M", "pid": _PID, "tid": e["tid"],
+                                                 "args": {"name": threads.get(e["tid"], str(e["tid"]))}}) + ",\n")
+                self._file.write(json.dumps(e, default=str) + ",\n")
+            self._file.flush()
+        except OSError:
+            logger.exception(f"Could not write traces to {self.path}")
+
+    def _recent(self, seconds: Optional[float]) -> List[Dict[str, Any]]:
+        cutoff = 0.0 if seconds is None else time.time() - seconds
+        with self._lock:
+            return [t for t in self._traces if t["start"] >= cutoff]
+
+    def summaries(self, seconds: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Newest first: id, start, duration, span count and the root span's attributes."""
+        return [t["summary"] for t in reversed(self._recent(seconds))]
+
+    def events(self, trace_id: Optional[str] = None, seconds: Optional[float] = None) -> Dict[str, Any]:
+        """Trace Event Format document of one trace, or of every trace in the last `seconds`."""
+        events = [e for t in self._recent(seconds)
+                  if trace_id is None or t["summary"]["trace_id"] == trace_id
+                  for e in t["events"]]
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        names = [{"name": "thread_name", "ph": "M", "pid": _PID, "tid": tid, "args": {"name": threads.get(tid, str(tid))}}
+                 for tid in {e["tid"] for e in events}]
+        return {"traceEvents": names + events, "displayTimeUnit": "ms"}
+
+
+collector = TraceCollector()
+
+
+def endpoint_done():
+    """Mark the end of the endpoint call; the time up to the response start is encoding."""
+    s = _current.get()
+    if s is not None:
+        s.trace.endpoint_done = time.perf_counter()
+
+
+def _local(s: str) -> datetime:
+    # naive bounds are local time, as in analytics.parse_local_dt
+    dt = datetime.fromisoformat(s)
+    return dt.replace(tzinfo=TZ) if dt.tzinfo is None else dt
+
+
+def _window_hours(query: Dict[str, str]) -> Optional[float]:
+    try:
+        start, end = _local(query["start_iso"]), _local(query["end_iso"])
+    except (KeyError, ValueError):
+        return None
+    return round((end - start).total_seconds() / 3600, 2)
+
+
+class TraceRequests:
+    """ASGI middleware: one trace per HTTP request (when TRACING_ENABLED)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.TRACING_ENABLED:
+            return await self.app(scope, receive, send)
+        query = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        attrs: Dict[str, Any] = {"method": scope["method"], "path": scope["path"],
+                                 **{k: query[k] for k in _FILTERS if k in query}}
+        hours = _window_hours(query)
+        if hours is not None:
+            attrs["window_hours"] = hours
+        trace = Trace()
+        root = Span(trace, "request", None, attrs)
+        token = _current.set(root)
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                root.attrs["status"] = message["status"]
+                if trace.endpoint_done is not None:
+                    Span(trace, "encode", root.span_id, {}, start=trace.endpoint_done).finish()
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-trace-id", trace.trace_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            root.name = getattr(route, "path", None) or scope["path"]
+            root.attrs.update(route=root.name, rows=trace.rows, statements=trace.statements)
+            root.finish()
+            collector.add(trace, root)
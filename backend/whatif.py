@@ -0,0 +1,72 @@
+# server/app/whatif.py
+"""
+Capacity what-if scenarios, evaluated in batch.
+
+A scenario is a list of capacity changes ("T2 at 45/hour for the next
+week") applied on top of the terminals' current capacity calendars. All
+scenarios of a request are stacked into one (scenarios, terminals, hours)
+capacity array and evaluated together against the same hourly demand (the
+cached forecast; see analytics.utilization), so the cost is a handful of
+numpy passes whatever the number of scenarios.
+
+Backlog carry-over: tokens beyond an hour's capacity queue into the next
+hour, b[t] = max(0, b[t-1] + demand[t] - capacity[t]). That recursion has
+the closed form b[t] = X[t] - min(0, min(X[0..t])) with X the running sum
+of demand - capacity, so it is a cumsum and a running minimum rather than
+a loop over hours.
+"""
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from backend.capacity import local_hour
+from backend.schemas import CapacityScenario
+
+
+def capacity_tensor(baseline: np.ndarray, terminals: List[str], start: datetime,
+                    scenarios: List[CapacityScenario]) -> np.ndarray:
+    """
+    (scenarios, terminals, hours) capacities: the baseline (terminals, hours)
+    matrix with each scenario's changes applied in order. Raises ValueError
+    for a change on a terminal outside `terminals`.
+    """
+    row = {t: i for i, t in enumerate(terminals)}
+    hours = baseline.shape[1]
+    h0 = local_hour(start)
+    out = np.repeat(baseline[np.newaxis], len(scenarios), axis=0)
+    for n, scenario in enumerate(scenarios):
+        for change in scenario.changes:
+            if change.terminal_id not in row:
+                raise ValueError(f"unknown terminal {change.terminal_id!r} in scenario {scenario.name!r}")
+            lo = 0 if change.start is None else max(0, local_hour(change.start) - h0)
+            hi = hours if change.end is None else min(hours, local_hour(change.end) - h0)
+            if lo < hi:
+                out[n, row[change.terminal_id], lo:hi] = change.capacity_per_hour
+    return out
+
+
+def simulate(demand: np.ndarray, capacity: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Evaluate (terminals, hours) demand against (scenarios, terminals, hours)
+    capacity. Returns (scenarios, terminals) arrays:
+
+      overload_hours     hours with demand above capacity
+      peak_utilization   max demand / capacity over hours with capacity
+      backlog_hours      hours ending with tokens still queued
+      max_backlog        largest queue at the end of any hour
+      end_backlog        queue carried past the end of the window
+    """
+    d = np.broadcast_to(demand, capacity.shape)
+    rated = capacity > 0
+    util = np.divide(d, capacity, out=np.zeros(capacity.shape), where=rated)
+    x = np.cumsum(d - capacity, axis=-1)
+    backlog = x - np.minimum(np.minimum.accumulate(x, axis=-1), 0.0)
+    has_hours = capacity.shape[-1] > 0
+    return {
+        "overload_hours": (d > capacity).sum(axis=-1),
+        "peak_utilization": util.max(axis=-1, initial=0.0),
+        "backlog_hours": (backlog > 1e-9).sum(axis=-1),
+        "max_backlog": backlog.max(axis=-1, initial=0.0),
+        "end_backlog": backlog[..., -1] if has_hours else np.zeros(capacity.shape[:-1]),
+    }
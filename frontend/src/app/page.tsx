@@ -23,6 +23,7 @@ import Composition100Stack from "@/components/Composition100Stack";
 import Header from "@/components/Header";
 import GateLoadStatus from "@/components/GateLoadStatus";
 import ExportReportButton from "@/components/ExportReportButton";
+import ExportButton from "@/components/ExportButton";
 
 
 function computeWindow(mode: string, start: string, end: string) {
@@ -266,7 +267,8 @@ export default function Page(){
         <div className="ml-[260px]">
           {/* Controls Bar */}
           <div className="theme-bg-secondary theme-border border-b px-6 py-4">
-            <div className="flex items-center justify-end">
+            <div className="flex items-center justify-end gap-3">
+              <ExportButton start={startStr} end={endStr} terminal={terminal} moveType={moveType} desig={desig} />
               <ExportReportButton
                 reportTitle="DP World – Capacity & Gate Flow Insights"
                 reportSub="Forecasting peak demand, alerts, and flow patterns for smarter terminal operations."
@@ -1,10 +1,20 @@
 import React from "react";
+import { exportUrl } from "@/lib/api";
 
-export default function ExportButton() {
+type Props = {
+  start: string;             // "YYYY-MM-DDTHH:mm", local
+  end: string;
+  terminal?: string;
+  moveType?: string;
+  desig?: string;
+  format?: "csv" | "parquet";
+};
+
+// Downloads the hourly forecast for the current filters; the server streams
+// the file, so long windows need not be loaded into the browser first.
+export default function ExportButton({ start, end, terminal, moveType, desig, format = "csv" }: Props) {
   const handleExport = () => {
-    // This would implement actual export functionality
-    // For now, we'll just show an alert
-    alert("Export functionality would generate a PDF/Excel report for executive use");
+    window.location.href = exportUrl(start, end, format, terminal, moveType, desig);
   };
 
   return (
@@ -19,7 +29,7 @@ export default function ExportButton() {
           clipRule="evenodd"
         />
       </svg>
-      Export Report
+      Export Data ({format.toUpperCase()})
     </button>
   );
 }
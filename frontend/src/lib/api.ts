@@ -130,4 +130,36 @@ export async function getTotalForecastVolume(start: string, end: string, termina
     window_hours: number;
     breakdown: { hour: number; total: number; in: number; out: number }[];
   };
-}
\ No newline at end of file
+}
+export type UtilizationKpis = {
+  peak_hour: string | null;
+  peak_pred: number;
+  overload_hours: number;
+  max_utilization: number;
+  avg_utilization: number;
+  risk_level: "High Risk" | "Warning" | "Safe";
+};
+
+export async function getUtilization(start: string, end: string, terminal?: string, moveType?: string, desig?: string) {
+  const params: any = { start_iso: start, end_iso: end };
+  if (terminal && terminal !== "ALL") params.terminal_id = terminal;
+  if (moveType && moveType !== "ALL") params.move_type = moveType;
+  if (desig && desig !== "ALL") params.desig = desig;
+  const r = await api.get("/analytics/utilization", { params });
+  return r.data as {
+    terminals: ({ terminal: string; capacity_per_hour: number } & UtilizationKpis)[];
+    overall: UtilizationKpis;
+    window_hours: number;
+  };
+}
+
+// Server-side export of the hourly forecast; a link to it downloads the
+// streamed file directly instead of building it from the charts' data.
+export function exportUrl(start: string, end: string, format: "csv" | "parquet" = "csv",
+                          terminal?: string, moveType?: string, desig?: string) {
+  const params = new URLSearchParams({ start_iso: start, end_iso: end, format });
+  if (terminal && terminal !== "ALL") params.set("terminal_id", terminal);
+  if (moveType && moveType !== "ALL") params.set("move_type", moveType);
+  if (desig && desig !== "ALL") params.set("desig", desig);
+  return `${base}/export?${params}`;
+}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests for the compiled capacity calendar (backend/capacity.py): the week
+template and override intervals must give the same hourly capacity as
+evaluating the rules and overrides hour by hour.
+
+Runs without a database.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backend.capacity import CapacityCalendar, validate_calendar
+from backend.schemas import CapacityOverride, CapacityRule
+from backend.utils.timebox import TZ
+
+
+def reference(cal: CapacityCalendar, start: datetime, hours: int) -> list:
+    """Capacity per hour the slow way: the last matching override, else rule, else the base."""
+    out = []
+    for i in range(hours):
+        ts = start + timedelta(hours=i)
+        cap = cal.base
+        for rule in cal.rules:
+            for day_offset, hour in ((0, ts.hour), (1, ts.hour + 24)):
+                weekday = (ts.weekday() - day_offset) % 7
+                end = rule.end_hour if rule.end_hour > rule.start_hour else rule.end_hour + 24
+                if weekday in rule.weekdays and rule.start_hour <= hour < end:
+                    cap = rule.capacity_per_hour
+        for o in cal.overrides:
+            if o.start <= ts < o.end:
+                cap = o.capacity_per_hour
+        out.append(cap)
+    return out
+
+
+def at(day: int, hour: int = 0) -> datetime:
+    return datetime(2025, 3, day, hour, tzinfo=TZ)  # 2025-03-03 is a Monday
+
+
+CALENDAR = CapacityCalendar(
+    60,
+    rules=[
+        CapacityRule(weekdays=[0, 1, 2, 3, 4], start_hour=6, end_hour=18, capacity_per_hour=80),
+        CapacityRule(weekdays=[4], start_hour=12, end_hour=14, capacity_per_hour=20),   # later rule wins
+        CapacityRule(weekdays=[5], start_hour=22, end_hour=4, capacity_per_hour=30),    # past midnight
+        CapacityRule(weekdays=[6], start_hour=0, end_hour=24, capacity_per_hour=0),
+    ],
+    overrides=[
+        CapacityOverride(start=at(4, 8), end=at(4, 20), capacity_per_hour=10, reason="maintenance"),
+        CapacityOverride(start=at(4, 10), end=at(4, 12), capacity_per_hour=5),            # later override wins
+        CapacityOverride(start=at(8, 23), end=at(9, 2), capacity_per_hour=90),            # over a rule
+    ],
+)
+
+
+@pytest.mark.parametrize("start", [at(3), at(2, 17), at(7, 13), at(9, 3)])
+def test_hourly_matches_the_rules_evaluated_per_hour(start):
+    hours = 24 * 15
+    np.testing.assert_array_equal(CALENDAR.hourly(start, hours), reference(CALENDAR, start, hours))
+
+
+def test_hourly_truncates_the_start_to_the_hour():
+    np.testing.assert_array_equal(CALENDAR.hourly(at(4, 9) + timedelta(minutes=40), 4), [10, 5, 5, 10])
+
+
+def test_naive_start_is_local_time():
+    np.testing.assert_array_equal(CALENDAR.hourly(at(4, 9).replace(tzinfo=None), 3),
+                                  CALENDAR.hourly(at(4, 9), 3))
+
+
+def test_override_partly_before_the_window():
+    # Sunday 02:00 falls back to the later, all-day Sunday rule over Saturday's night shift
+    np.testing.assert_array_equal(CALENDAR.hourly(at(9, 0), 3), [90, 90, 0])
+
+
+def test_flat_calendar_without_rules():
+    np.testing.assert_array_equal(CapacityCalendar(45).hourly(at(3), 200), np.full(200, 45))
+
+
+def test_validate_calendar_rejects_bad_weekdays_and_reversed_overrides():
+    with pytest.raises(ValueError):
+        validate_calendar([CapacityRule(weekdays=[7], start_hour=0, end_hour=1, capacity_per_hour=1)], None)
+    with pytest.raises(ValueError):
+        validate_calendar([CapacityRule(weekdays=[], start_hour=0, end_hour=1, capacity_per_hour=1)], None)
+    with pytest.raises(ValueError):
+        validate_calendar(None, [CapacityOverride(start=at(4, 10), end=at(4, 10), capacity_per_hour=1)])
+    validate_calendar(CALENDAR.rules, CALENDAR.overrides)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tests for the hourly cell cache (backend/cube.py): the prefix index must
+stay in step with the hours the cube holds as fills add and evict them.
+
+Runs without a database: each cube's _fetch returns synthetic cells.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+import numpy as np
+import pytest
+
+from backend.cube import HourlyCube, hours_between
+from backend.utils.timebox import now_local
+
+BASE = now_local().replace(minute=0, second=0, microsecond=0)
+
+
+def fake_cells(h: datetime) -> Dict:
+    n = int((h - BASE).total_seconds() // 3600)
+    cells = {(0, 0, 0): float(n % 7)}
+    if n % 3 == 0:
+        cells[(1, 1, 2)] = 2.5
+    return cells
+
+
+def make_cube(max_hours: int) -> HourlyCube:
+    cube = HourlyCube(max_hours=max_hours)
+    cube.fetched = []
+
+    def fetch(start, end):
+        cube.fetched.append((start, end))
+        return {h: fake_cells(h) for h in hours_between(start, end)}
+
+    cube._fetch = fetch
+    return cube
+
+
+def indexed_hours(cube: HourlyCube) -> set:
+    index = cube._index
+    return {index.origin + timedelta(hours=int(j)) for j in np.flatnonzero(index._hours)}
+
+
+def expected_totals(start: datetime, end: datetime) -> Dict:
+    totals: Dict = {}
+    for h in hours_between(start, end):
+        for k, v in fake_cells(h).items():
+            totals[k] = totals.get(k, 0.0) + v
+    return totals
+
+
+def test_overflowing_fill_leaves_the_index_matching_the_cube():
+    cube = make_cube(max_hours=100)
+    cube._load(hours_between(BASE, BASE + timedelta(hours=250)))
+    assert len(cube._hours) == 100
+    assert indexed_hours(cube) == set(cube._hours)
+    assert cube._index.loaded[-1] == 100
+
+
+def test_index_follows_fills_and_evictions():
+    cube = make_cube(max_hours=48)
+    for offset, length in [(0, 24), (12, 24), (-30, 10), (40, 30), (5, 3), (-30, 80)]:
+        start = BASE + timedelta(hours=offset)
+        cube.totals(start, start + timedelta(hours=length))
+        assert indexed_hours(cube) == set(cube._hours)
+        assert len(cube._hours) <= 48
+
+
+def test_totals_and_rollups_match_the_cells():
+    cube = make_cube(max_hours=500)
+    start, end = BASE - timedelta(hours=5), BASE + timedelta(hours=50)
+    assert cube.totals(start, end) == pytest.approx(expected_totals(start, end))
+    # answered from the index, without another fetch
+    fetches = len(cube.fetched)
+    r = cube.rollup(start, end, "hour", terminal=1)
+    assert len(cube.fetched) == fetches
+    assert r.keys == [(1, 1, 2)]
+    np.testing.assert_allclose(r.sums[0], [fake_cells(h).get((1, 1, 2), 0.0) for h in hours_between(start, end)])
+
+
+def test_invalidate_drops_the_index():
+    cube = make_cube(max_hours=100)
+    cube.totals(BASE, BASE + timedelta(hours=10))
+    cube.invalidate()
+    assert not cube._hours and cube._index.origin is None
+    cube.totals(BASE, BASE + timedelta(hours=10))
+    assert len(cube.fetched) == 2
+
+
+def test_windows_far_from_now_are_not_cached():
+    cube = make_cube(max_hours=100)
+    for year in (2020, 2040):
+        start = BASE.replace(year=year)
+        end = start + timedelta(hours=8)
+        assert cube.totals(start, end) == pytest.approx(expected_totals(start, end))
+    assert not cube._hours
+    assert len(cube._index._hours) == 0
+
+
+def test_index_axis_is_bounded_as_time_moves_on(monkeypatch):
+    cube = make_cube(max_hours=48)
+    now = BASE
+    monkeypatch.setattr("backend.cube.now_local", lambda: now)
+    for day in range(30):
+        now = BASE + timedelta(days=day)
+        cube.totals(now - timedelta(hours=4), now + timedelta(hours=8))
+        assert all(h >= now - timedelta(hours=48) for h in cube._hours)
+        assert indexed_hours(cube) == set(cube._hours)
+        assert len(cube._index._hours) <= 4 * 48
+
+
+def test_windows_longer_than_the_cube_skip_it():
+    cube = make_cube(max_hours=48)
+    cube.totals(BASE, BASE + timedelta(hours=8))
+    start, end = BASE - timedelta(hours=40), BASE + timedelta(hours=40)
+    assert cube.totals(start, end) == pytest.approx(expected_totals(start, end))
+    assert set(cube._hours) == set(hours_between(BASE, BASE + timedelta(hours=8)))
+
+
+def test_fills_of_other_hours_do_not_wait_and_same_hours_are_fetched_once():
+    cube = make_cube(max_hours=200)
+    fetch = cube._fetch
+    slow_started = threading.Event()
+
+    def slow_fetch(start, end):
+        if start < BASE:
+            slow_started.set()
+            time.sleep(0.5)  # a long custom fill
+        return fetch(start, end)
+
+    cube._fetch = slow_fetch
+    custom = threading.Thread(target=cube.totals, args=(BASE - timedelta(hours=48), BASE - timedelta(hours=24)))
+    custom.start()
+    slow_started.wait(1)
+    began = time.monotonic()
+    cube.totals(BASE, BASE + timedelta(hours=8))  # the live window
+    assert time.monotonic() - began < 0.25
+    # the same hours as the custom fill: waited for, not fetched again
+    cube.totals(BASE - timedelta(hours=40), BASE - timedelta(hours=30))
+    custom.join()
+    assert len(cube.fetched) == 2
+    assert indexed_hours(cube) == set(cube._hours)
+
+
+def test_fill_in_flight_during_invalidate_is_not_stored():
+    cube = make_cube(max_hours=200)
+    fetch = cube._fetch
+
+    def fetch_then_invalidate(start, end):
+        cells = fetch(start, end)
+        cube.invalidate()  # a new model run landed while the fill ran
+        return cells
+
+    cube._fetch = fetch_then_invalidate
+    start, end = BASE, BASE + timedelta(hours=8)
+    assert cube.totals(start, end) == pytest.approx(expected_totals(start, end))
+    assert not cube._hours and not cube._filling
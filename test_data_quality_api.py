@@ -8,6 +8,7 @@ Tests all endpoints to ensure:
 4. Time zone consistency
 5. Consistent rounding policy
 6. Metadata inclusion
+7. Data-quality counters exposed on /meta/data_quality
 """
 
 import requests
@@ -161,6 +162,48 @@ def show_sample_data(data, max_items=3):
         if data.get('breakdown'):
             print(f"   Breakdown sample: {data['breakdown'][:2]}")
 
+def check_data_quality_counters():
+    """Validate the aggregated data-quality telemetry (counts, not log lines)."""
+    print(f"\n{'='*60}")
+    print("Testing: Data quality counters")
+    print("Endpoint: /meta/data_quality")
+    print(f"{'='*60}")
+    
+    try:
+        response = requests.get(f"{BASE_URL}/meta/data_quality")
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+        print(f"❌ Request failed: {e}")
+        return None
+    
+    issues = []
+    known_kinds = {"move_type_normalized", "move_type_unknown",
+                   "desig_normalized", "desig_unknown", "negative_pred"}
+    for key in ("since", "totals", "counters"):
+        if key not in data:
+            issues.append(f"Missing key: {key}")
+    for c in data.get("counters", []):
+        if c.get("kind") not in known_kinds:
+            issues.append(f"Unknown anomaly kind: {c.get('kind')}")
+        if not isinstance(c.get("count"), int) or c["count"] <= 0:
+            issues.append(f"Bad count for {c}")
+    totals = {}
+    for c in data.get("counters", []):
+        totals[c["kind"]] = totals.get(c["kind"], 0) + c["count"]
+    if totals != data.get("totals", {}):
+        issues.append(f"Totals {data.get('totals')} do not match counters {totals}")
+    
+    if issues:
+        print(f"❌ Found {len(issues)} telemetry issues:")
+        for issue in issues:
+            print(f"   - {issue}")
+    else:
+        print("✅ Data quality counters are consistent")
+    for c in data.get("counters", [])[:5]:
+        print(f"   {c['endpoint']}: {c['kind']} {c['value']!r} x{c['count']}")
+    return data
+
 def main():
     """Run comprehensive tests on all analytics endpoints."""
     print("🚀 Starting Data Quality API Test Suite")
@@ -224,6 +267,8 @@ def main():
     
     results = {}
     
+    dq_before = check_data_quality_counters()
+    
     # Run all tests
     for test_case in test_cases:
         result = test_endpoint(
@@ -238,6 +283,14 @@ def main():
     print("📊 TEST SUMMARY")
     print(f"{'='*60}")
     
+    # Anomalies are clamped/normalized in responses and counted, never dropped
+    dq_after = check_data_quality_counters()
+    if dq_before is not None and dq_after is not None:
+        for kind, n in dq_before.get("totals", {}).items():
+            if dq_after.get("totals", {}).get(kind, 0) < n:
+                print(f"❌ Counter for {kind} went down: {n} -> {dq_after['totals'].get(kind, 0)}")
+    results["/meta/data_quality"] = dq_after
+    
     successful = len([r for r in results.values() if r is not None])
     total = len(results)
     
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for the forecast routes' row shaping (backend/routers/forecast.py).
+
+The forecast endpoints read the latest model run per hour through
+latest_runs.latest_cte, like the analytics endpoints, so their points carry
+the canonical MoveType/Desig names (UNK for values unrecognized at ingest)
+and predictions clamped at 0, where they used to echo the raw strings and
+values of the tokens table.
+
+Runs without a database.
+"""
+
+from datetime import date, datetime
+
+from backend import codes
+from backend.routers.forecast import _forecast_rows
+from backend.utils.timebox import TZ
+
+
+def stamp(d: date, h: int) -> datetime:
+    return datetime.combine(d, datetime.min.time()).replace(hour=h, tzinfo=TZ)
+
+
+def columns(*rows):
+    return [list(c) for c in zip(*rows)]
+
+
+DAY = date(2025, 3, 3)
+RUN = datetime(2025, 3, 2, 22)
+
+
+def test_codes_are_reported_by_canonical_name():
+    rows, _ = _forecast_rows(columns(
+        ("T1", codes.MOVE_TYPES.index("IN"), codes.DESIGS.index("EXP"), DAY, 5, 3.0, RUN),
+        ("T1", codes.MOVE_TYPES.index("OUT"), codes.DESIGS.index("FULL"), DAY, 6, 4.0, RUN),
+        ("T1", codes.UNK, codes.UNK, DAY, 7, 1.0, RUN),  # e.g. "INWARD?" / "" at ingest
+    ), stamp)
+    assert [(r.move_type, r.desig) for r in rows] == [("IN", "EXP"), ("OUT", "FULL"), ("UNK", "UNK")]
+    assert [r.ts for r in rows] == [stamp(DAY, 5), stamp(DAY, 6), stamp(DAY, 7)]
+
+
+def test_predictions_are_clamped_and_nulls_are_zero():
+    rows, _ = _forecast_rows(columns(
+        ("T1", 1, 1, DAY, 5, -2.5, RUN),
+        ("T1", 1, 1, DAY, 6, None, RUN),
+        ("T1", 1, 1, DAY, 7, 12.25, RUN),
+    ), stamp)
+    assert [r.pred for r in rows] == [0.0, 0.0, 12.25]
+
+
+def test_newest_updated_at_is_returned():
+    later = datetime(2025, 3, 3, 1)
+    _, latest = _forecast_rows(columns(
+        ("T1", 1, 1, DAY, 5, 1.0, RUN),
+        ("T1", 1, 1, DAY, 6, 1.0, None),
+        ("T1", 1, 1, DAY, 7, 1.0, later),
+    ), stamp)
+    assert latest == later
+    assert _forecast_rows([[]] * 7, stamp) == ([], None)
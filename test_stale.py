@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Tests for the stale-while-revalidate store (backend/stale.py): when the last
+good result is served, the slow query adopted as the background refresh,
+the retry backoff, and put() cancelling a refresh it supersedes.
+
+Runs without a database: compute() is a plain coroutine.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend import stale
+from backend.config import settings
+from backend.stale import LastGood
+
+
+class Unavailable(Exception):
+    """Stands in for a database error."""
+
+
+UNAVAILABLE = (Unavailable,)
+KEY = ("endpoint", "window", ())
+
+
+@pytest.fixture(autouse=True)
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "STALE_AFTER_SECONDS", 0.05)
+    monkeypatch.setattr(settings, "STALE_RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "STALE_RETRY_MAX_SECONDS", 0.04)
+
+
+def result(value):
+    return {"value": value, "meta": {}}
+
+
+async def serve(store, compute):
+    """store.serve() plus the stale marks it left for the request."""
+    value = await store.serve(KEY, compute, UNAVAILABLE)
+    return value, stale.served()
+
+
+def test_fresh_result_is_stored_and_returned():
+    store = LastGood(max_entries=10, max_seconds=60)
+
+    async def compute():
+        return result(1)
+
+    value, marks = asyncio.run(serve(store, compute))
+    assert value == result(1)
+    assert marks == {}
+    assert store.get(KEY).value == result(1)
+
+
+def test_failed_query_serves_the_last_good_result_marked_stale():
+    store = LastGood(max_entries=10, max_seconds=60)
+    store.put(KEY, result(1), stored_at=time.time() - 30)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        raise Unavailable("down")
+
+    async def main():
+        value, marks = await serve(store, compute)
+        assert value["value"] == 1
+        assert value["meta"]["stale"] is True and value["meta"]["age_seconds"] >= 30
+        assert marks["stale"] is True
+        assert store.get(KEY).refresh is not None
+        # while the refresh is pending, later requests do not query
+        again, _ = await serve(store, compute)
+        assert again["value"] == 1
+        assert len(calls) == 1
+        store.get(KEY).refresh.cancel()
+
+    asyncio.run(main())
+
+
+def test_other_errors_are_raised():
+    store = LastGood(max_entries=10, max_seconds=60)
+    store.put(KEY, result(1))
+
+    async def compute():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(serve(store, compute))
+
+
+def test_too_old_result_is_not_served():
+    store = LastGood(max_entries=10, max_seconds=60)
+    store.put(KEY, result(1), stored_at=time.time() - 120)
+
+    async def compute():
+        raise Unavailable("down")
+
+    with pytest.raises(Unavailable):
+        asyncio.run(serve(store, compute))
+
+
+def test_slow_query_is_adopted_and_its_result_lands():
+    store = LastGood(max_entries=10, max_seconds=60)
+    store.put(KEY, result(1))
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return result(2)
+
+    async def main():
+        value, marks = await serve(store, compute)
+        assert value["value"] == 1 and marks["stale"] is True
+        task = store.get(KEY).refresh
+        assert task is not None
+        await task
+        await asyncio.sleep(0)  # done callbacks run on the next loop iteration
+        entry = store.get(KEY)
+        assert entry.value == result(2)
+        assert entry.refresh is None
+        assert len(calls) == 1  # the slow query itself, not a second one
+
+    asyncio.run(main())
+
+
+def test_adopted_query_that_fails_starts_the_retries():
+    store = LastGood(max_entries=10, max_seconds=60)
+    store.put(KEY, result(1))
+    outcomes = ["slow failure", result(3)]
+
+    async def compute():
+        outcome = outcomes.pop(0)
+        if outcome == "slow failure":
+            await asyncio.sleep(0.1)
+            raise Unavailable("down")
+        return outcome
+
+    async def main():
+        value, _ = await serve(store, compute)
+        assert value["value"] == 1
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if store.get(KEY).value == result(3):
+                break
+        assert store.get(KEY).value == result(3)
+        assert store.stats()["background_refreshes"] == 1
+
+    asyncio.run(main())
+
+
+def test_retries_back_off_up_to_the_maximum(monkeypatch):
+    store = LastGood(max_entries=10, max_seconds=60)
+    store.put(KEY, result(1))
+    failures = 4
+    delays = []
+    sleep = asyncio.sleep
+
+    async def recorded_sleep(delay, *args):
+        delays.append(delay)
+        await sleep(0)
+
+    async def compute():
+        nonlocal failures
+        if failures:
+            failures -= 1
+            raise Unavailable("down")
+        return result(2)
+
+    async def main():
+        await serve(store, compute)
+        monkeypatch.setattr(stale.asyncio, "sleep", recorded_sleep)
+        try:
+            await store.get(KEY).refresh
+        finally:
+            monkeypatch.setattr(stale.asyncio, "sleep", sleep)
+
+    asyncio.run(main())
+    # one failure in the request, three in the refresh, then a result
+    assert delays == [0.01, 0.02, 0.04, 0.04]
+    assert store.get(KEY).value == result(2)
+    stats = store.stats()
+    assert stats["background_refreshes"] == 4 and stats["failed_refreshes"] == 3
+    assert stats["refreshing"] == 0
+
+
+def test_retries_stop_once_the_result_is_too_old():
+    store = LastGood(max_entries=10, max_seconds=0.5)
+    store.put(KEY, result(1), stored_at=time.time() - 0.49)
+
+    async def compute():
+        raise Unavailable("down")
+
+    async def main():
+        await serve(store, compute)
+        task = store._entries[KEY].refresh
+        await asyncio.wait_for(task, 1)
+        assert store._entries[KEY].refresh is None
+
+    asyncio.run(main())
+
+
+def test_put_cancels_a_superseded_refresh_on_another_loop():
+    store = LastGood(max_entries=10, max_seconds=60)
+    store.put(KEY, result(1))
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def compute():
+        await asyncio.sleep(5)
+        return result(2)
+
+    try:
+        served = asyncio.run_coroutine_threadsafe(serve(store, compute), loop).result(2)
+        assert served[0]["value"] == 1
+        task = store.get(KEY).refresh
+        assert task is not None and task.get_loop() is loop
+
+        # the preset scheduler's thread stores a newer result meanwhile
+        store.put(KEY, result(3))
+        for _ in range(100):
+            if task.done():
+                break
+            time.sleep(0.01)
+        assert task.cancelled()
+        assert store.get(KEY).value == result(3)
+        assert store.get(KEY).refresh is None
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(2)
+        loop.close()
+
+
+def test_store_is_bounded_by_count_and_age():
+    store = LastGood(max_entries=2, max_seconds=60)
+    store.put("old", 0, stored_at=time.time() - 120)
+    store.put("a", 1)
+    store.put("b", 2)
+    store.put("c", 3)
+    assert store.get("a") is None and store.get("old") is None
+    assert store.get("b").value == 2 and store.get("c").value == 3
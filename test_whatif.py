@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the batched what-if evaluation (backend/whatif.py): the closed-form
+backlog must match carrying the queue hour by hour, and scenario changes
+must land on the right terminal and hours.
+
+Runs without a database.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backend.schemas import CapacityChange, CapacityScenario
+from backend.utils.timebox import TZ
+from backend.whatif import capacity_tensor, simulate
+
+
+def carried(demand: np.ndarray, capacity: np.ndarray) -> np.ndarray:
+    """Backlog at the end of each hour, b[t] = max(0, b[t-1] + demand[t] - capacity[t])."""
+    backlog = np.zeros(demand.shape)
+    b = 0.0
+    for t in range(len(demand)):
+        b = max(0.0, b + demand[t] - capacity[t])
+        backlog[t] = b
+    return backlog
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_backlog_matches_the_hour_by_hour_recursion(seed):
+    rng = np.random.default_rng(seed)
+    scenarios, terminals, hours = 3, 4, 96
+    demand = rng.uniform(0, 100, (terminals, hours)).round(1)
+    capacity = rng.integers(0, 110, (scenarios, terminals, hours)).astype(float)
+
+    r = simulate(demand, capacity)
+    for s in range(scenarios):
+        for t in range(terminals):
+            backlog = carried(demand[t], capacity[s, t])
+            assert r["max_backlog"][s, t] == pytest.approx(backlog.max())
+            assert r["end_backlog"][s, t] == pytest.approx(backlog[-1])
+            assert r["backlog_hours"][s, t] == (backlog > 1e-9).sum()
+            assert r["overload_hours"][s, t] == (demand[t] > capacity[s, t]).sum()
+            rated = capacity[s, t] > 0
+            peak = (demand[t][rated] / capacity[s, t][rated]).max(initial=0.0)
+            assert r["peak_utilization"][s, t] == pytest.approx(peak)
+
+
+def test_backlog_drains_after_a_peak():
+    demand = np.array([[50.0, 120.0, 130.0, 40.0, 40.0, 40.0]])
+    capacity = np.full((1, 1, 6), 100.0)
+    r = simulate(demand, capacity)
+    # 20 + 30 queued, then drained 60 per hour
+    assert r["max_backlog"][0, 0] == pytest.approx(50.0)
+    assert r["backlog_hours"][0, 0] == 2
+    assert r["end_backlog"][0, 0] == pytest.approx(0.0)
+    assert r["overload_hours"][0, 0] == 2
+
+
+def test_empty_window():
+    r = simulate(np.zeros((2, 0)), np.zeros((1, 2, 0)))
+    assert r["end_backlog"].shape == (1, 2)
+    assert not r["max_backlog"].any() and not r["overload_hours"].any()
+
+
+START = datetime(2025, 3, 3, 0, tzinfo=TZ)
+
+
+def test_capacity_tensor_applies_changes_in_order():
+    baseline = np.full((2, 24), 60)
+    scenarios = [
+        CapacityScenario(name="baseline-like", changes=[]),
+        CapacityScenario(name="T2 slow morning", changes=[
+            CapacityChange(terminal_id="T2", capacity_per_hour=45,
+                           start=START + timedelta(hours=6), end=START + timedelta(hours=12)),
+            CapacityChange(terminal_id="T2", capacity_per_hour=30,
+                           start=START + timedelta(hours=10), end=START + timedelta(days=2)),
+        ]),
+        CapacityScenario(name="T1 whole window", changes=[
+            CapacityChange(terminal_id="T1", capacity_per_hour=90),
+        ]),
+    ]
+    out = capacity_tensor(baseline, ["T1", "T2"], START, scenarios)
+    assert out.shape == (3, 2, 24)
+    np.testing.assert_array_equal(out[0], baseline)
+    np.testing.assert_array_equal(out[1, 0], baseline[0])
+    np.testing.assert_array_equal(out[1, 1], [60] * 6 + [45] * 4 + [30] * 14)
+    np.testing.assert_array_equal(out[2, 0], np.full(24, 90))
+    np.testing.assert_array_equal(out[2, 1], baseline[1])
+
+
+def test_capacity_tensor_rejects_unknown_terminals():
+    scenario = CapacityScenario(name="typo", changes=[CapacityChange(terminal_id="T9", capacity_per_hour=1)])
+    with pytest.raises(ValueError):
+        capacity_tensor(np.full((1, 4), 60), ["T1"], START, [scenario])